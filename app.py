@@ -6,26 +6,35 @@ from __future__ import division
 
 from datetime import datetime, date
 import json
+import logging
 import os
 import time
+from functools import wraps
 from mimetypes import guess_type
 from os.path import join
 from math import ceil
+from itertools import chain, islice
 from urllib import urlencode
+from base64 import urlsafe_b64encode, urlsafe_b64decode
 
-from flask import Flask, make_response, request, jsonify, render_template
+from flask import Flask, Response, make_response, request, jsonify, render_template, abort, stream_with_context
+from flask import json as flask_json
 import requests
 from flask.ext.heroku import Heroku
-from sqlalchemy import desc
+from sqlalchemy import desc, tuple_, and_, or_, cast, Date, DateTime, REAL
 from sqlalchemy.sql.expression import func
-from sqlalchemy.orm import defer
+from sqlalchemy.orm import defer, load_only
+from dateutil.parser import parse as parse_datetime
 from dictalchemy import make_class_dictable
 from flask.ext.script import Manager, prompt_bool
 from flask.ext.migrate import Migrate, MigrateCommand
 from werkzeug.contrib.fixers import ProxyFix
+from werkzeug.http import is_resource_modified, quote_etag
 
-from models import initialize_database, Organization, Event, Issue, Project, Story, Label, Error, Attendance
+from models import initialize_database, preload, field_columns, Organization, Event, Issue, Project, Story, Label, Error, Attendance, GithubCache, RateLimit
 from utils import raw_name
+import cache
+import artifacts
 
 # -------------------
 # Init
@@ -72,99 +81,500 @@ app.after_request(add_cors_header)
 # API
 # -------------------
 
-def page_info(query, page, limit):
-    ''' Return last page and offset for a query.
+def cached(view=None, timely=False):
+    ''' Serve a view's successful responses from the response cache, keyed
+        on the URL with its query string in a consistent order.
+
+        Responses carry an ETag and Last-Modified date for the current cache
+        generation, and a request with matching validators gets 304 Not
+        Modified before the view runs at all.
+
+        Responses of timely views depend on the current time, like upcoming
+        events, so they're only cached in this process and only for
+        cache.TIMELY_TTL seconds.
     '''
-    # Get a bunch of projects.
-    total = query.count()
-    last = int(ceil(total / limit))
+    if view is None:
+        return lambda view: cached(view, timely)
+
+    @wraps(view)
+    def cached_view(*args, **kwargs):
+        args_list = sorted([(key.encode('utf8'), value.encode('utf8')) for (key, value) in request.args.iteritems(multi=True)])
+        key = u'%s://%s%s?%s' % (request.scheme, request.host, request.path, urlencode(args_list))
+        last_modified = cache.last_modified()
+
+        if timely:
+            # a new key, and a later Last-Modified date, every TIMELY_TTL seconds
+            started = int(time.time() // cache.TIMELY_TTL * cache.TIMELY_TTL)
+            key = u'%s @%d' % (key, started)
+            last_modified = max(last_modified, datetime.utcfromtimestamp(started)) if last_modified else datetime.utcfromtimestamp(started)
+
+        etag = cache.etag(key)
+        if not is_resource_modified(request.environ, etag=quote_etag(etag), last_modified=last_modified):
+            response = make_response('', 304)
+            return add_validators(response, etag, last_modified)
+
+        if not cache.enabled():
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                add_validators(response, etag, last_modified)
+            return response
+
+        hit = cache.get(key, shared=not timely)
+        if hit:
+            content_type, body = hit
+            response = make_response(body)
+            response.content_type = content_type
+            response.headers['X-Cache'] = 'HIT'
+            return add_validators(response, etag, last_modified)
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            if response.is_streamed:
+                response.response = cache_stream(key, response.content_type, response.response, not timely)
+            else:
+                cache.put(key, response.content_type, response.data, shared=not timely)
+            add_validators(response, etag, last_modified)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    return cached_view
+
+
+def cache_stream(key, content_type, chunks, shared=True):
+    ''' Yield the chunks of a streamed response, caching it once they're all sent.
+    '''
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+
+    # the request is over by now
+    with app.app_context():
+        cache.put(key, content_type, ''.join(body), shared=shared)
+
+
+def add_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+
+# Ways to count the results of a paged query: exactly, from the query
+# planner's estimate, or not at all
+COUNT_MODES = ('exact', 'estimate', 'none')
+
+# Pages of at least this many results are streamed as they're serialized,
+# fetching this many rows at a time from a server-side cursor
+STREAM_PER_PAGE = int(os.environ.get('API_STREAM_PER_PAGE', 100))
+STREAM_CHUNK = 50
+
+GEOJSON_ARTIFACT = u'organizations.geojson'
+
+# URL roots organizations.geojson is stored and kept up to date for, the
+# same production root run_update.py links organizations with by default.
+# It's built on every request from any other host.
+GEOJSON_URL_ROOTS = [root.strip() for root in os.environ.get('API_URL_ROOTS', 'https://www.codeforamerica.org/').split(',') if root.strip()]
+
+# Most ids to get at once with the ids request argument
+MAX_BATCH_IDS = 100
+
+
+def page_info(total, page, limit):
+    ''' Return last page and offset for a total number of results.
+
+        The last page is None if the total isn't known.
+    '''
+    last = int(ceil(total / limit)) if total is not None else None
     offset = (page - 1) * limit
 
     return last, offset
 
 
-def pages_dict(page, last, querystring):
-    ''' Return a dictionary of pages to return in API responses.
+def count_estimate(query):
+    ''' Return the query planner's estimate of the number of rows a query returns.
+    '''
+    compiled = query.statement.compile(dialect=db.session.bind.dialect)
+    plan = db.session.connection().execute('EXPLAIN (FORMAT JSON) %s' % compiled, compiled.params).scalar()
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def encode_cursor(values):
+    ''' Return an opaque cursor for a row's sort key values.
+    '''
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return urlsafe_b64encode(json.dumps(values))
+
+
+def decode_cursor(cursor, keys):
+    ''' Return the sort key values in a cursor, or abort with a 400 if it's no good.
+    '''
+    try:
+        values = json.loads(urlsafe_b64decode(str(cursor)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError(cursor)
+        return [parse_datetime(value) if isinstance(key.type, DateTime) and value is not None else value
+                for (key, value) in zip(keys, values)]
+    except (TypeError, ValueError, UnicodeEncodeError):
+        abort(400)
+
+
+def after_cursor(keys, values, descending):
+    ''' Return a filter for the rows that come after a cursor in key order.
+
+        Only the first key may be null; Postgres sorts nulls last going up,
+        and first going down.
+    '''
+    def ahead(row, cursor_row):
+        return row < cursor_row if descending else row > cursor_row
+
+    # compare in the keys' own types, e.g. real for ts_rank()
+    values = [cast(value, key.type) if value is not None else None for (key, value) in zip(keys, values)]
+
+    if values[0] is not None:
+        condition = ahead(tuple_(*keys), tuple_(*values))
+        if not descending:
+            condition = or_(condition, keys[0] == None)
+    else:
+        condition = and_(keys[0] == None, ahead(tuple_(*keys[1:]), tuple_(*values[1:])))
+        if descending:
+            condition = or_(condition, keys[0] != None)
+
+    return condition
+
+
+def page_link(params, querystring):
+    ''' Return a link to a page of the current request's results.
     '''
     url = '%s://%s%s' % (request.scheme, request.host, request.path)
 
+    for arg in ('per_page', 'count', 'fields'):
+        if arg in request.args:
+            params[arg] = request.args[arg]
+
+    if querystring != '':
+        return '%s?%s&%s' % (url, urlencode(params), querystring) if params else url
+    else:
+        return '%s?%s' % (url, urlencode(params)) if params else url
+
+
+def pages_dict(page, last, querystring, more=False):
+    ''' Return a dictionary of pages to return in API responses.
+
+        If the last page isn't known, more says whether there's a next one.
+    '''
     pages = dict()
 
     if page > 1:
         pages['first'] = dict()
         pages['prev'] = dict()
-        if 'per_page' in request.args:
-            pages['first']['per_page'] = request.args['per_page']
-            pages['prev']['per_page'] = request.args['per_page']
 
     if page > 2:
         pages['prev']['page'] = page - 1
 
-    if page < last:
+    if last is None and more:
+        pages['next'] = {'page': page + 1}
+
+    elif last is not None and page < last:
         pages['next'] = {'page': page + 1}
         pages['last'] = {'page': last}
-        if 'per_page' in request.args:
-            pages['next']['per_page'] = request.args['per_page']
-            pages['last']['per_page'] = request.args['per_page']
 
-    for key in pages:
-        if querystring != '':
-            pages[key] = '%s?%s&%s' % (url, urlencode(pages[key]), querystring) if pages[key] else url
-        else:
-            pages[key] = '%s?%s' % (url, urlencode(pages[key])) if pages[key] else url
+    return dict([(key, page_link(params, querystring)) for (key, params) in pages.items()])
+
+
+def cursor_pages_dict(cursor, next_cursor, querystring):
+    ''' Return a dictionary of pages to return in API responses paged by cursor.
+    '''
+    pages = dict()
+
+    if cursor:
+        pages['first'] = {'cursor': ''}
+
+    if next_cursor:
+        pages['next'] = {'cursor': next_cursor}
 
-    return pages
+    return dict([(key, page_link(params, querystring)) for (key, params) in pages.items()])
 
 
-def paged_results(query, page, per_page, querystring=''):
+def requested_fields():
+    ''' Return the set of fields asked for in the fields request argument,
+        or None for all of them.
     '''
+    if 'fields' not in request.args:
+        return None
+
+    return set([field.strip() for field in request.args['fields'].split(',') if field.strip()])
+
+
+def select_fields(query, fields):
+    ''' Return a query that only loads the columns needed for some fields.
+    '''
+    model = query.column_descriptions[0]['type']
+    if len(query.column_descriptions) > 1 or not hasattr(model, '__table__'):
+        # not a query of whole rows, like only_ids
+        return query
+
+    return query.options(load_only(*field_columns(model, fields)))
+
+
+def page_objects(rows, querystring):
+    ''' Return a page of rows ready to be serialized.
     '''
-    total = query.count()
-    last, offset = page_info(query, page, per_page)
     if querystring.find("only_ids") != -1:
-        model_dicts = [o.id for o in query.limit(per_page).offset(offset)]
+        return [getattr(o, 'id', o) for o in rows]
+
+    fields = requested_fields()
+
+    # the session holds preloaded rows weakly, so keep them until the page is serialized
+    preloaded = preload(rows, fields)
+    model_dicts = [o.asdict(True, fields=fields) for o in rows]
+    del preloaded
+
+    return model_dicts
+
+
+def stream_objects(rows, querystring):
+    ''' Yield rows ready to be serialized, preloading a chunk of them at a time.
+    '''
+    rows = iter(rows)
+    chunk = list(islice(rows, STREAM_CHUNK))
+
+    while chunk:
+        for obj in page_objects(chunk, querystring):
+            yield obj
+        chunk = list(islice(rows, STREAM_CHUNK))
+
+
+def fetch_rows(query, stream):
+    ''' Return a query's rows, as a list or streamed from a server-side cursor.
+    '''
+    return iter(query.yield_per(STREAM_CHUNK)) if stream else query.all()
+
+
+def limit_rows(rows, limit, state):
+    ''' Yield at most limit rows, noting in state the last one and whether there were more.
+    '''
+    for (index, row) in enumerate(rows):
+        if index == limit:
+            state['more'] = True
+            return
+        state['last'] = row
+        yield row
+
+
+def drop_columns(rows, number):
+    ''' Yield rows without their last few columns, leaving them as the query would return them.
+    '''
+    for row in rows:
+        yield row[0] if len(row) == number + 1 else row[:-number]
+
+
+def page_response(total, pages, rows, querystring, stream):
+    ''' Return a page of results to pass to json_response().
+
+        A streamed page's objects come from a generator, and its pages from
+        a function to call once the objects are used up.
+    '''
+    if stream:
+        return dict(total=total, pages=pages, objects=stream_objects(rows, querystring))
+
+    objects = page_objects(list(rows), querystring)
+    return dict(total=total, pages=pages(), objects=objects)
+
+
+def cursor_results(query, per_page, querystring, keys, descending, count, stream):
+    ''' Return the page of results from a query that follows the cursor
+        request argument, with links to the first and next pages.
+
+        Rows are ordered by the keys, and the page starts right after the
+        cursor's row, so deep pages cost no more than the first one. The
+        total is only counted if asked for.
+    '''
+    cursor = request.args.get('cursor', '')
+    ordering = [key.desc() if descending else key.asc() for key in keys]
+    page_query = query.order_by(None).order_by(*ordering).add_columns(*keys)
+
+    if cursor:
+        page_query = page_query.filter(after_cursor(keys, decode_cursor(cursor, keys), descending))
+
+    if count == 'exact' and 'count' in request.args:
+        total = query.count()
+    elif count == 'estimate':
+        total = count_estimate(query)
     else:
-        model_dicts = []
-        for o in query.limit(per_page).offset(offset):
-            obj = o.asdict(True)
-            model_dicts.append(obj)
-    return dict(total=total, pages=pages_dict(page, last, querystring), objects=model_dicts)
+        total = None
+
+    # get one more row than the page to know if there's a next page
+    state = dict(more=False)
+    rows = limit_rows(fetch_rows(page_query.limit(per_page + 1), stream), per_page, state)
+
+    def pages():
+        next_cursor = encode_cursor(state['last'][-len(keys):]) if state['more'] else None
+        return cursor_pages_dict(cursor, next_cursor, querystring)
+
+    return page_response(total, pages, drop_columns(rows, len(keys)), querystring, stream)
+
+
+def paged_results(query, page, per_page, querystring='', keys=None, descending=False):
+    ''' Return a page of results from a query, with links to other pages.
+
+        The count request argument picks how the total is found. With exact,
+        the default, it's counted alongside the page rows in a single query.
+        With estimate, it's the query planner's guess, and with none it's
+        left out and the page only links to the next one if there is one.
+
+        Queries with sort keys can also be paged with the cursor request
+        argument instead of page; see cursor_results().
+
+        Pages of at least STREAM_PER_PAGE rows are streamed from the
+        database a chunk at a time; see page_response().
+
+        The fields request argument limits each object to a comma-separated
+        list of fields, and the query to the columns they need.
+    '''
+    count = request.args.get('count', 'exact')
+    if count not in COUNT_MODES:
+        count = 'exact'
+
+    fields = requested_fields()
+    if fields is not None:
+        query = select_fields(query, fields)
+
+    stream = per_page >= STREAM_PER_PAGE
+
+    if keys and 'cursor' in request.args:
+        return cursor_results(query, per_page, querystring, keys, descending, count, stream)
+
+    offset = (page - 1) * per_page
+    state = dict(more=False)
+
+    if count == 'exact':
+        rows = iter(fetch_rows(query.add_columns(func.count().over()).limit(per_page).offset(offset), stream))
+        first = next(rows, None)
+        if first:
+            total = first[-1]
+            rows = chain([first], rows)
+        else:
+            total = query.count() if offset else 0
+        rows = drop_columns(rows, 1)
+
+    else:
+        # get one more row than the page to know if there's a next page
+        rows = limit_rows(fetch_rows(query.limit(per_page + 1).offset(offset), stream), per_page, state)
+        total = count_estimate(query) if count == 'estimate' else None
+
+    def pages():
+        last, _ = page_info(total, page, per_page)
+        if count == 'estimate':
+            # the estimate can be off, but the pages on hand are certain
+            last = max(last, page + 1 if state['more'] else page)
+
+        return pages_dict(page, last, querystring, state['more'])
+
+    return page_response(total, pages, rows, querystring, stream)
+
+
+def json_stream(fields, key, items, trailer=None):
+    ''' Yield a JSON object of fields with a list of items under key, an item at a time.
+
+        Trailer is an optional function returning more fields, called once
+        the items are used up.
+    '''
+    yield '{'
+    for (name, value) in fields.items():
+        yield '%s: %s, ' % (flask_json.dumps(name), flask_json.dumps(value))
+
+    yield '%s: [' % flask_json.dumps(key)
+    for (index, item) in enumerate(items):
+        yield (', ' if index else '') + flask_json.dumps(item)
+    yield ']'
+
+    for (name, value) in (trailer() if trailer else {}).items():
+        yield ', %s: %s' % (flask_json.dumps(name), flask_json.dumps(value))
+    yield '}'
+
+
+def json_response(response):
+    ''' Return a JSON response for a page of results from paged_results().
+    '''
+    if not callable(response['pages']):
+        return jsonify(response)
+
+    fields = dict(total=response['total'])
+    trailer = lambda: dict(pages=response['pages']())
+    return Response(stream_with_context(json_stream(fields, 'objects', response['objects'], trailer)), mimetype='application/json')
+
+
+def batch_results(model, querystring):
+    ''' Return the objects with the ids in the ids request argument, in the
+        order they were asked for, loaded with a single query.
+
+        Ids that aren't found are left out.
+    '''
+    try:
+        requested = [int(id) for id in request.args['ids'].split(',') if id.strip()]
+    except ValueError:
+        abort(400)
+
+    # each id once, in the order they came
+    ids = []
+    for id in requested:
+        if id not in ids:
+            ids.append(id)
+        if len(ids) > MAX_BATCH_IDS:
+            abort(400)
+
+    query = db.session.query(model).filter(model.id.in_(ids or [None]))
+    fields = requested_fields()
+    if fields is not None:
+        query = select_fields(query, fields)
+
+    rows_by_id = dict([(row.id, row) for row in query])
+    rows = [rows_by_id[id] for id in ids if id in rows_by_id]
+
+    return dict(total=len(rows), pages={}, objects=page_objects(rows, querystring))
 
 
 def get_query_params(args):
     filters = {}
     for key, value in args.iteritems():
-        if 'page' not in key:
+        if 'page' not in key and key not in ('count', 'cursor', 'fields', 'ids'):
             filters[key] = value
     return filters, urlencode(filters)
 
 
 def build_rsvps_response(events):
-    ''' Arrange and organize rsvps from a list of event objects '''
+    ''' Sum up rsvps by week from a query of events, up to today.
+
+        Weeks are named like strftime's "%Y %W", starting on Mondays, with
+        the days before a year's first Monday in week 00.
+    '''
     rsvps = {
         "total": 0,
         "weekly": {}
     }
-    for fetched_event in events:
-        event_dict = fetched_event.asdict()
-        if event_dict["rsvps"]:
-            # 2014-04-30 18:30:00 -0700
-            # Just compare dates
-            event_date = event_dict["start_time"][:10]
-            event_date = datetime.strptime(event_date, "%Y-%m-%d")
-            if datetime.today() > event_date:
-                week = datetime.strftime(event_date, "%Y %W")
-                rsvps["total"] += event_dict["rsvps"]
-                if rsvps["weekly"].get(week):
-                    rsvps["weekly"][week] += event_dict["rsvps"]
-                else:
-                    rsvps["weekly"][week] = event_dict["rsvps"]
+
+    # start_time_notz is local to each event, so its date is the event's own
+    event_date = cast(Event.start_time_notz, Date)
+    year, monday = func.extract('year', event_date), func.date_trunc('week', event_date)
+    weeks = events.with_entities(year, monday, func.sum(Event.rsvps))\
+        .filter(Event.rsvps > 0, event_date <= date.today()).group_by(year, monday)
+
+    for (year, monday, week_rsvps) in weeks:
+        # a week starting in December is split at the new year
+        week = max(monday.date(), date(int(year), 1, 1))
+        rsvps["weekly"][week.strftime("%Y %W")] = week_rsvps
+        rsvps["total"] += week_rsvps
 
     return rsvps
 
 
 @app.route('/api/organizations')
 @app.route('/api/organizations/<name>')
+@cached(timely=True)
 def get_organizations(name=None):
     ''' Regular response option for organizations.
     '''
@@ -197,32 +607,77 @@ def get_organizations(name=None):
     query = query.order_by(ordering)
     response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring)
 
-    return jsonify(response)
+    return json_response(response)
 
 
-@app.route('/api/organizations.geojson')
-def get_organizations_geojson():
-    ''' GeoJSON response option for organizations.
+def organizations_geojson():
+    ''' Return a GeoJSON FeatureCollection of every organization.
     '''
-    geojson = dict(type='FeatureCollection', features=[])
+    def features():
+        for org in db.session.query(Organization).yield_per(STREAM_CHUNK):
+            # The unique identifier of an organization.
+            id = org.api_id()
+
+            # Pick out all the properties that aren't part of the location.
+            props = org.asdict()
+
+            # GeoJSON Point geometry, http://geojson.org/geojson-spec.html#point
+            geom = dict(type='Point', coordinates=[org.longitude, org.latitude])
 
-    for org in db.session.query(Organization):
-        # The unique identifier of an organization.
-        id = org.api_id()
+            yield dict(type='Feature', id=id, properties=props, geometry=geom)
 
-        # Pick out all the properties that aren't part of the location.
-        props = org.asdict()
+    return ''.join(json_stream(dict(type='FeatureCollection'), 'features', features()))
 
-        # GeoJSON Point geometry, http://geojson.org/geojson-spec.html#point
-        geom = dict(type='Point', coordinates=[org.longitude, org.latitude])
 
-        feature = dict(type='Feature', id=id, properties=props, geometry=geom)
-        geojson['features'].append(feature)
+def refresh_geojson(session):
+    ''' Rebuild organizations.geojson for every configured URL root, and
+        throw away any stored for other roots.
+    '''
+    artifacts.discard(session, GEOJSON_ARTIFACT, GEOJSON_URL_ROOTS)
+
+    if not GEOJSON_URL_ROOTS:
+        logging.warning('API_URL_ROOTS is empty, so organizations.geojson will be built on every request')
+
+    for url_root in GEOJSON_URL_ROOTS:
+        with app.test_request_context(base_url=url_root):
+            artifacts.save(db.session, GEOJSON_ARTIFACT, url_root, 'application/json', organizations_geojson())
 
-    return jsonify(geojson)
+
+@app.route('/api/organizations.geojson')
+def get_organizations_geojson():
+    ''' GeoJSON response option for organizations.
+
+        For the configured URL roots it's built on the first request, and
+        again by run_update.py after every update, then sent gzipped if it
+        can be. The host comes from the client, so it's never stored for
+        any other root.
+    '''
+    url_root = u'%s://%s/' % (request.scheme, request.host)
+    if url_root not in GEOJSON_URL_ROOTS:
+        response = make_response(organizations_geojson())
+        response.content_type = 'application/json'
+        return response
+
+    artifact = artifacts.load(GEOJSON_ARTIFACT, url_root)
+    if not artifact:
+        artifact = artifacts.save(db.session, GEOJSON_ARTIFACT, url_root, 'application/json', organizations_geojson())
+
+    if 'gzip' in request.accept_encodings:
+        response = make_response(str(artifact.body))
+        response.content_encoding = 'gzip'
+        response.set_etag(artifact.etag + '-gzip')
+    else:
+        response = make_response(artifacts.gunzip(str(artifact.body)))
+        response.set_etag(artifact.etag)
+
+    response.content_type = artifact.content_type
+    response.vary.add('Accept-Encoding')
+    response.last_modified = artifact.updated
+    return response.make_conditional(request)
 
 
 @app.route("/api/organizations/<organization_name>/events")
+@cached
 def get_orgs_events(organization_name):
     '''
         A cleaner url for getting an organizations events
@@ -235,11 +690,12 @@ def get_orgs_events(organization_name):
 
     # Get event objects
     query = Event.query.filter_by(organization_name=organization.name)
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)))
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), keys=[Event.start_time_notz, Event.id])
+    return json_response(response)
 
 
 @app.route("/api/organizations/<organization_name>/upcoming_events")
+@cached(timely=True)
 def get_upcoming_events(organization_name):
     '''
         Get events that occur in the future. Order asc.
@@ -250,11 +706,12 @@ def get_upcoming_events(organization_name):
         return "Organization not found", 404
     # Get upcoming event objects
     query = Event.query.filter(Event.organization_name == organization.name, Event.start_time_notz >= datetime.utcnow())
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)))
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), keys=[Event.start_time_notz, Event.id])
+    return json_response(response)
 
 
 @app.route("/api/organizations/<organization_name>/past_events")
+@cached(timely=True)
 def get_past_events(organization_name):
     '''
         Get events that occur in the past. Order desc.
@@ -266,24 +723,26 @@ def get_past_events(organization_name):
     # Get past event objects
     query = Event.query.filter(Event.organization_name == organization.name, Event.start_time_notz < datetime.utcnow()).\
         order_by(desc(Event.start_time_notz))
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)))
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), keys=[Event.start_time_notz, Event.id], descending=True)
+    return json_response(response)
 
 
 @app.route("/api/organizations/<organization_name>/events/rsvps")
+@cached(timely=True)
 def gather_orgs_rsvps(organization_name=None):
     ''' Orgs rsvps summarized '''
     # Check org name
     organization = Organization.query.filter_by(name=raw_name(organization_name)).first()
     if not organization:
         return "Organization not found", 404
-    orgs_events = Event.query.filter(Event.organization_name == organization.name).all()
+    orgs_events = Event.query.filter(Event.organization_name == organization.name)
     rsvps = build_rsvps_response(orgs_events)
 
     return json.dumps(rsvps)
 
 
 @app.route("/api/organizations/<organization_name>/stories")
+@cached
 def get_orgs_stories(organization_name):
     '''
         A cleaner url for getting an organizations stories
@@ -295,11 +754,12 @@ def get_orgs_stories(organization_name):
 
     # Get story objects
     query = Story.query.filter_by(organization_name=organization.name).order_by(desc(Story.id))
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)))
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), keys=[Story.id], descending=True)
+    return json_response(response)
 
 
 @app.route("/api/organizations/<organization_name>/projects")
+@cached
 def get_orgs_projects(organization_name):
     '''
         A cleaner url for getting an organizations projects
@@ -327,7 +787,7 @@ def get_orgs_projects(organization_name):
             # Returns all results if the value is empty
             if value:
                 query = query.filter("project.tsv_body @@ plainto_tsquery('%s')" % value)
-                relevance_ordering_filter = func.ts_rank(Project.tsv_body, func.plainto_tsquery('%s' % value))
+                relevance_ordering_filter = func.ts_rank(Project.tsv_body, func.plainto_tsquery('%s' % value), type_=REAL)
                 ordering_filter_name = 'relevance'
         elif 'only_ids' in attr:
             query = query.with_entities(Project.id)
@@ -355,12 +815,13 @@ def get_orgs_projects(organization_name):
         ordering = ordering_filter.asc()
     query = query.order_by(ordering)
 
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring)
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring, keys=[ordering_filter, Project.id], descending=(ordering_dir == 'desc'))
+    return json_response(response)
 
 
 @app.route("/api/organizations/<organization_name>/issues")
 @app.route("/api/organizations/<organization_name>/issues/labels/<labels>")
+@cached
 def get_orgs_issues(organization_name, labels=None):
     ''' A clean url to get an organizations issues
     '''
@@ -391,17 +852,18 @@ def get_orgs_issues(organization_name, labels=None):
         label_queries = [query.filter(L) for L in labels]
 
         # Intersect filters to find issues with all labels
-        query = query.intersect(*label_queries).order_by(func.random())
+        query = query.intersect(*label_queries).order_by(Issue.shuffle_key, Issue.id)
 
     else:
         # Get all issues belonging to these projects
-        query = Issue.query.filter(Issue.project_id.in_(project_ids)).order_by(func.random())
+        query = Issue.query.filter(Issue.project_id.in_(project_ids)).order_by(Issue.shuffle_key, Issue.id)
 
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)))
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), keys=[Issue.shuffle_key, Issue.id])
+    return json_response(response)
 
 
 @app.route("/api/organizations/<organization_name>/attendance")
+@cached
 def get_orgs_attendance(organization_name):
     ''' A clean url to get an organizations attendance '''
 
@@ -413,14 +875,6 @@ def get_orgs_attendance(organization_name):
     # Get that organization's attendance
     attendance = Attendance.query.filter_by(organization_name=organization.name).first()
 
-    weekly = {}
-    for week in attendance.weekly.keys():
-        if week in weekly.keys():
-            weekly[week] += attendance.weekly[week]
-        else:
-            weekly[week] = attendance.weekly[week]
-    attendance.weekly = weekly
-
     attendance_response = {
         "organization_name": attendance.organization_name,
         "cfapi_url": attendance.organization_url,
@@ -439,22 +893,17 @@ def find(lst, key, value):
 
 
 @app.route("/api/organizations/attendance")
+@cached
 def get_all_orgs_attendance():
     ''' A list of all organizations attendance '''
-    all_attendance = Attendance.query.all()
+    columns = Attendance.organization_name, Attendance.organization_url, Attendance.total, Attendance.weekly
     response = []
 
-    for org_attendance in all_attendance:
-        weekly = {}
-        for week in org_attendance.weekly.keys():
-            if week in weekly.keys():
-                weekly[week] += org_attendance.weekly[week]
-            else:
-                weekly[week] = org_attendance.weekly[week]
+    for (organization_name, organization_url, total, weekly) in db.session.query(*columns):
         attendance_response = {
-            "organization_name": org_attendance.organization_name,
-            "cfapi_url": org_attendance.organization_url,
-            "total": org_attendance.total,
+            "organization_name": organization_name,
+            "cfapi_url": organization_url,
+            "total": total,
             "weekly": weekly
         }
         response.append(attendance_response)
@@ -463,52 +912,41 @@ def get_all_orgs_attendance():
 
 
 @app.route("/api/attendance")
+@cached
 def get_all_attendance():
     ''' All attendance summarized '''
-    all_attendance = Attendance.query.all()
-    total = 0
-    weekly = {}
-    for org_attendance in all_attendance:
-        total += org_attendance.total
-        for week in org_attendance.weekly.keys():
-            if week in weekly.keys():
-                weekly[week] += org_attendance.weekly[week]
-            else:
-                weekly[week] = org_attendance.weekly[week]
+    total = db.session.query(func.sum(Attendance.total)).scalar() or 0
+
+    # weekly is a JSON object of week names and counts
+    weeks = db.session.execute('''SELECT week.key, SUM(week.value::integer) FROM attendance,
+                                         json_each_text(attendance.weekly::json) AS week
+                                  GROUP BY week.key''')
 
     response = {
         "total": total,
-        "weekly": weekly
+        "weekly": dict(weeks.fetchall())
     }
 
     return jsonify(response)
 
 
 @app.route("/api/member_count")
+@cached
 def all_member_count():
     ''' The total Meetup.com member count '''
-    member_count = 0
-    orgs = Organization.query.all()
-    for org in orgs:
-        if org.member_count:
-            member_count += org.member_count
+    member_count = db.session.query(func.sum(Organization.member_count)).scalar() or 0
 
     return jsonify({"total": member_count})
 
 
 @app.route("/api/organizations/member_count")
+@cached
 def orgs_member_count():
     ''' The Meetup.com member count for each group '''
-    total_member_count = 0
-    orgs_members = {}
-    orgs = Organization.query.all()
-    for org in orgs:
-        if org.member_count:
-            total_member_count += org.member_count
-            orgs_members[org.id] = org.member_count
+    orgs_members = dict(db.session.query(Organization.id, Organization.member_count).filter(Organization.member_count > 0))
 
     response = {
-        "total": total_member_count,
+        "total": sum(orgs_members.values()),
         "organizations": orgs_members
     }
 
@@ -517,6 +955,7 @@ def orgs_member_count():
 
 @app.route('/api/projects')
 @app.route('/api/projects/<int:id>')
+@cached
 def get_projects(id=None):
     ''' Regular response option for projects.
     '''
@@ -533,6 +972,10 @@ def get_projects(id=None):
             # If no project found
             return jsonify({"status": "Resource Not Found"}), 404
 
+    if 'ids' in request.args:
+        # Get a batch of projects by id.
+        return jsonify(batch_results(Project, querystring))
+
     # Get a bunch of projects.
     query = db.session.query(Project).options(defer('tsv_body'))
     # Default ordering of results
@@ -551,7 +994,7 @@ def get_projects(id=None):
             # Returns all results if the value is empty
             if value:
                 query = query.filter("project.tsv_body @@ plainto_tsquery('%s')" % value)
-                relevance_ordering_filter = func.ts_rank(Project.tsv_body, func.plainto_tsquery('%s' % value))
+                relevance_ordering_filter = func.ts_rank(Project.tsv_body, func.plainto_tsquery('%s' % value), type_=REAL)
                 ordering_filter_name = 'relevance'
         elif 'only_ids' in attr:
             query = query.with_entities(Project.id)
@@ -579,12 +1022,13 @@ def get_projects(id=None):
         ordering = ordering_filter.asc()
     query = query.order_by(ordering)
 
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring)
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring, keys=[ordering_filter, Project.id], descending=(ordering_dir == 'desc'))
+    return json_response(response)
 
 
 @app.route('/api/issues')
 @app.route('/api/issues/<int:id>')
+@cached
 def get_issues(id=None):
     '''Regular response option for issues.
     '''
@@ -600,8 +1044,12 @@ def get_issues(id=None):
             # If no issue found
             return jsonify({"status": "Resource Not Found"}), 404
 
+    if 'ids' in request.args:
+        # Get a batch of issues by id.
+        return jsonify(batch_results(Issue, querystring))
+
     # Get a bunch of issues
-    query = db.session.query(Issue).order_by(func.random())
+    query = db.session.query(Issue).order_by(Issue.shuffle_key, Issue.id)
 
     for attr, value in filters.iteritems():
         if 'project' in attr:
@@ -613,11 +1061,12 @@ def get_issues(id=None):
         else:
             query = query.filter(getattr(Issue, attr).ilike('%%%s%%' % value))
 
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring)
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring, keys=[Issue.shuffle_key, Issue.id])
+    return json_response(response)
 
 
 @app.route('/api/issues/labels/<labels>')
+@cached
 def get_issues_by_labels(labels):
     '''
     A clean url to filter issues by a comma-separated list of labels
@@ -649,15 +1098,16 @@ def get_issues_by_labels(labels):
     label_queries = [base_query.filter(L) for L in labels]
 
     # Intersect filters to find issues with all labels
-    query = base_query.intersect(*label_queries).order_by(func.random())
+    query = base_query.intersect(*label_queries).order_by(Issue.shuffle_key, Issue.id)
 
     # Return the paginated reponse
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)))
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), keys=[Issue.shuffle_key, Issue.id])
+    return json_response(response)
 
 
 @app.route('/api/events')
 @app.route('/api/events/<int:id>')
+@cached
 def get_events(id=None):
     ''' Regular response option for events.
     '''
@@ -673,6 +1123,10 @@ def get_events(id=None):
             # If no event found
             return jsonify({"status": "Resource Not Found"}), 404
 
+    if 'ids' in request.args:
+        # Get a batch of events by id.
+        return jsonify(batch_results(Event, querystring))
+
     # Get a bunch of events.
     query = db.session.query(Event)
 
@@ -683,11 +1137,12 @@ def get_events(id=None):
         else:
             query = query.filter(getattr(Event, attr).ilike('%%%s%%' % value))
 
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), querystring)
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), querystring, keys=[Event.start_time_notz, Event.id])
+    return json_response(response)
 
 
 @app.route('/api/events/upcoming_events')
+@cached(timely=True)
 def get_all_upcoming_events():
     ''' Show all upcoming events.
         Return them in chronological order.
@@ -704,11 +1159,12 @@ def get_all_upcoming_events():
         else:
             query = query.filter(getattr(Event, attr).ilike('%%%s%%' % value))
 
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)))
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), keys=[Event.start_time_notz, Event.id])
+    return json_response(response)
 
 
 @app.route('/api/events/past_events')
+@cached(timely=True)
 def get_all_past_events():
     ''' Show all past events.
         Return them in reverse chronological order.
@@ -725,21 +1181,22 @@ def get_all_past_events():
         else:
             query = query.filter(getattr(Event, attr).ilike('%%%s%%' % value))
 
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)))
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), keys=[Event.start_time_notz, Event.id], descending=True)
+    return json_response(response)
 
 
 @app.route("/api/events/rsvps")
+@cached(timely=True)
 def gather_all_rsvps():
     ''' All rsvps summarized '''
-    events = Event.query.all()
-    rsvps = build_rsvps_response(events)
+    rsvps = build_rsvps_response(Event.query)
 
     return json.dumps(rsvps)
 
 
 @app.route('/api/stories')
 @app.route('/api/stories/<int:id>')
+@cached
 def get_stories(id=None):
     ''' Regular response option for stories.
     '''
@@ -757,6 +1214,10 @@ def get_stories(id=None):
             # If no story found
             return jsonify({"status": "Resource Not Found"}), 404
 
+    if 'ids' in request.args:
+        # Get a batch of stories by id.
+        return jsonify(batch_results(Story, querystring))
+
     # Get a bunch of stories.
     query = db.session.query(Story).order_by(desc(Story.id))
 
@@ -767,8 +1228,8 @@ def get_stories(id=None):
         else:
             query = query.filter(getattr(Story, attr).ilike('%%%s%%' % value))
 
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), querystring)
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), querystring, keys=[Story.id], descending=True)
+    return json_response(response)
 
 # -------------------
 # Routes
@@ -781,11 +1242,6 @@ def well_known_status():
 
         http://engine-light.codeforamerica.org
     '''
-    if 'GITHUB_TOKEN' in os.environ:
-        github_auth = (os.environ['GITHUB_TOKEN'], '')
-    else:
-        github_auth = None
-
     if 'MEETUP_KEY' in os.environ:
         meetup_key = os.environ['MEETUP_KEY']
     else:
@@ -794,8 +1250,14 @@ def well_known_status():
     try:
         org = db.session.query(Organization).order_by(Organization.last_updated).limit(1).first()
         project = db.session.query(Project).limit(1).first()
-        rate_limit = requests.get('https://api.github.com/rate_limit', auth=github_auth)
-        remaining_github = rate_limit.json()['resources']['core']['remaining']
+        # The updater saves the GitHub budget it saw last, so don't spend a request on it here
+        rate_limit = db.session.query(RateLimit).filter(RateLimit.resource == u'github').first()
+        remaining_github = None
+        if rate_limit and rate_limit.remaining is not None:
+            if rate_limit.reset and rate_limit.reset < time.time():
+                remaining_github = rate_limit.limit
+            else:
+                remaining_github = rate_limit.remaining
         recent_error = db.session.query(Error).order_by(desc(Error.time)).limit(1).first()
 
         meetup_status = "No Meetup key set"
@@ -821,7 +1283,7 @@ def well_known_status():
         elif time_since_updated > 16 * 60 * 60:
             status = 'Oldest organization (%s) updated more than 16 hours ago' % org.name
 
-        elif remaining_github < 1000:
+        elif remaining_github is not None and remaining_github < 1000:
             status = 'Only %d remaining Github requests' % remaining_github
 
         elif meetup_status != 'ok':
@@ -833,7 +1295,7 @@ def well_known_status():
     except Exception, e:
         status = 'Error: ' + str(e)
 
-    state = dict(status=status, updated=int(time.time()), resources=[])
+    state = dict(status=status, updated=int(time.time()), resources=[], cache=cache.stats())
     state.update(dict(dependencies=['Meetup', 'Github', 'PostgreSQL']))
 
     return jsonify(state)
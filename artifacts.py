@@ -0,0 +1,66 @@
+"""
+    Prebuilt API responses.
+
+    Some responses cover everything in the database and only change when
+    run_update.py runs, like organizations.geojson. They're built once, for
+    each configured URL root, and stored gzipped so they can be sent as
+    they are.
+"""
+
+from datetime import datetime
+from gzip import GzipFile
+from hashlib import sha1
+from StringIO import StringIO
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Artifact
+
+
+def gzip(body):
+    ''' Return a gzipped body, the same every time for the same body.
+    '''
+    buffer = StringIO()
+    with GzipFile(fileobj=buffer, mode='wb', mtime=0) as file:
+        file.write(body)
+
+    return buffer.getvalue()
+
+
+def gunzip(body):
+    ''' Return an ungzipped body.
+    '''
+    return GzipFile(fileobj=StringIO(body), mode='rb').read()
+
+
+def load(name, url_root):
+    ''' Return the stored artifact with a name for a URL root, or None.
+    '''
+    return db.session.query(Artifact).get((name, url_root))
+
+
+def discard(session, name, url_roots):
+    ''' Delete the artifacts with a name built for any other URL roots.
+    '''
+    query = session.query(Artifact).filter(Artifact.name == name)
+    if url_roots:
+        query = query.filter(~Artifact.url_root.in_(url_roots))
+    query.delete(synchronize_session=False)
+    session.commit()
+
+
+def save(session, name, url_root, content_type, body):
+    ''' Store and return an artifact, replacing any older one.
+    '''
+    artifact = Artifact(name=name, url_root=url_root, content_type=unicode(content_type),
+                        etag=unicode(sha1(body).hexdigest()), body=gzip(body), updated=datetime.utcnow())
+
+    try:
+        artifact = session.merge(artifact)
+        session.commit()
+    except IntegrityError:
+        # another process built it first
+        session.rollback()
+        artifact = session.query(Artifact).get((name, url_root))
+
+    return artifact
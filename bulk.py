@@ -0,0 +1,172 @@
+"""
+    Set-based writes for the updater.
+
+    Saving fetched rows one at a time costs a SELECT and an INSERT or UPDATE
+    per row. upsert() takes a whole batch instead: one SELECT for the rows it
+    could match, one multi-row INSERT for new rows, and one UPDATE ... FROM
+    (VALUES ...) for rows that changed, chunked to keep statements small.
+
+    A Reconciler remembers the ids of every row written while updating an
+    organization, so the rows that weren't seen can be deleted afterwards
+    with one statement per table.
+"""
+
+from collections import OrderedDict, defaultdict
+from itertools import groupby
+
+from sqlalchemy import bindparam, text, and_, not_
+
+# Most rows to send in a single statement
+CHUNK_SIZE = 500
+
+# Columns that are never written directly
+SKIP_COLUMNS = ('id', 'tsv_body', 'shuffle_key')
+
+
+def key_value(value):
+    ''' Normalize a natural key value so fetched and stored values compare.
+    '''
+    if isinstance(value, str):
+        return value.decode('utf8')
+    return value
+
+
+def differs(value, stored):
+    ''' Return True if a fetched value is different from a stored one.
+    '''
+    try:
+        return key_value(value) != stored
+    except TypeError:
+        # e.g. offset-aware and offset-naive datetimes
+        return True
+
+
+def chunks(items, size=CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def expire_instances(session, model):
+    ''' Expire loaded instances of a model that was written to behind the
+        session's back, so they're reloaded the next time they're used.
+    '''
+    for instance in list(session.identity_map.values()):
+        if isinstance(instance, model):
+            session.expire(instance)
+
+
+def update_rows(session, table, rows):
+    ''' Update rows by id with one UPDATE ... FROM (VALUES ...) per chunk.
+
+        Every row must have the same columns.
+    '''
+    if not rows:
+        return
+
+    dialect = session.bind.dialect
+    quote = dialect.identifier_preparer.quote
+    names = [name for name in rows[0].keys() if name != 'id']
+    columns = [table.c.id] + [table.c[name] for name in names]
+
+    assignments = ', '.join(['%s = v.%s' % (quote(name), quote(name)) for name in names])
+    column_list = ', '.join([quote(column.name) for column in columns])
+
+    for chunk in chunks(rows):
+        binds, tuples = [], []
+        for (index, row) in enumerate(chunk):
+            casts = []
+            for column in columns:
+                param = 'p%d_%s' % (index, column.name)
+                binds.append(bindparam(param, row[column.name], type_=column.type))
+                casts.append('CAST(:%s AS %s)' % (param, column.type.compile(dialect=dialect)))
+            tuples.append('(%s)' % ', '.join(casts))
+
+        statement = 'UPDATE %s SET %s FROM (VALUES %s) AS v (%s) WHERE %s.id = v.id' \
+            % (quote(table.name), assignments, ', '.join(tuples), column_list, quote(table.name))
+        session.execute(text(statement).bindparams(*binds))
+
+
+class Reconciler(object):
+    ''' Keep track of the rows seen during an update, by model.
+    '''
+    def __init__(self):
+        self.seen = defaultdict(set)
+
+    def see(self, model, ids):
+        ''' Remember that rows with these ids are still current.
+        '''
+        self.seen[model].update(ids)
+
+    def delete_unseen(self, session, model, scope):
+        ''' Delete the rows selected by the scope filter that weren't seen.
+
+            Return the number of rows deleted.
+        '''
+        table = model.__table__
+        if self.seen[model]:
+            scope = and_(scope, not_(table.c.id.in_(self.seen[model])))
+
+        return session.execute(table.delete().where(scope)).rowcount
+
+
+def upsert(session, model, rows, keys, scope, reconciler=None):
+    ''' Insert or update a batch of row dictionaries for a model.
+
+        Rows are matched to existing ones on the natural key columns in keys,
+        among the existing rows selected by the scope filter. Like saving rows
+        one at a time without autoflush, rows that match the same existing row
+        update it in turn, and new rows are all inserted, even if they share a
+        key. Every row written is reported to the reconciler, if there is one.
+
+        Return a dictionary of natural key tuples to row ids.
+    '''
+    table = model.__table__
+    writable = [column.name for column in table.columns if column.name not in SKIP_COLUMNS]
+
+    incoming = []
+    for row in rows:
+        values = dict([(name, row[name]) for name in writable if name in row])
+        values['keep'] = True
+        incoming.append((tuple([key_value(values.get(name)) for name in keys]), values))
+
+    if not incoming:
+        return {}
+
+    # write out anything pending and read what's already stored in one go
+    session.flush()
+    existing = {}
+    for stored in session.execute(table.select().where(scope).order_by(table.c.id)):
+        existing.setdefault(tuple([stored[name] for name in keys]), stored)
+
+    ids, new_rows, updates = {}, [], OrderedDict()
+    for (key, values) in incoming:
+        stored = existing.get(key)
+        if stored is None:
+            new_rows.append(dict([(name, values.get(name)) for name in writable]))
+        else:
+            ids[key] = stored['id']
+            updates.setdefault(stored['id'], (stored, {}))[1].update(values)
+
+    changed_rows = []
+    for (row_id, (stored, values)) in updates.items():
+        if [name for name in values if name != 'keep' and differs(values[name], stored[name])]:
+            changed_rows.append(dict(values, id=row_id))
+
+    returning = [table.c.id] + [table.c[name] for name in keys]
+    inserted_ids = []
+    for chunk in chunks(new_rows):
+        for inserted in session.execute(table.insert().values(chunk).returning(*returning)):
+            ids.setdefault(tuple([inserted[name] for name in keys]), inserted['id'])
+            inserted_ids.append(inserted['id'])
+
+    # only the columns a row mentions are written, so group rows by them
+    changed_rows.sort(key=lambda row: sorted(row.keys()))
+    for (_, group) in groupby(changed_rows, key=lambda row: sorted(row.keys())):
+        update_rows(session, table, list(group))
+
+    if reconciler:
+        reconciler.see(model, inserted_ids + updates.keys())
+
+    expire_instances(session, model)
+
+    return ids
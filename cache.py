@@ -0,0 +1,196 @@
+"""
+    Response cache for the API.
+
+    The data behind the API only changes when run_update.py runs, so a
+    response can be served again until the next update. Responses are kept
+    in a size-bounded, in-process LRU, and optionally in the database so
+    that every web process can share them.
+
+    Cached responses belong to a generation. The updater bumps the
+    generation at the end of each run, so older responses are never served
+    again, and the shared ones are deleted. The generation also backs the
+    ETag and Last-Modified validators that let clients revalidate.
+"""
+
+import os
+from collections import OrderedDict
+from datetime import datetime
+from hashlib import sha1
+from threading import Lock
+from time import time
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.expression import func
+
+from models import db, CacheGeneration, ResponseCache, Organization, Project
+
+# Most responses to keep in memory, or 0 to turn the cache off
+CACHE_SIZE = int(os.environ.get('API_CACHE_SIZE', 1000))
+# Share cached responses between processes through the database
+CACHE_SHARED = os.environ.get('API_CACHE_SHARED', '').lower() in ('1', 'true', 'yes')
+# Seconds to go between checks for a new generation
+GENERATION_TTL = float(os.environ.get('API_CACHE_GENERATION_TTL', 10))
+# Seconds to keep responses that depend on the current time
+TIMELY_TTL = int(os.environ.get('API_CACHE_TIMELY_TTL', 60))
+
+_stats = dict(hits=0, shared_hits=0, misses=0)
+_stats_lock = Lock()
+
+_generation = dict(number=None, checked=0)
+_last_modified = dict(generation=None, time=None)
+_generation_lock = Lock()
+
+
+class LRUCache(object):
+    ''' Least-recently-used mapping of at most size items.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            value = self.items.pop(key)
+            self.items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
+
+
+_local = LRUCache(CACHE_SIZE)
+_shared = CACHE_SHARED
+
+
+def configure(size=None, shared=None):
+    ''' Replace the in-process cache with an empty one, optionally changing
+        its size or whether responses are shared through the database.
+    '''
+    global _local, _shared
+
+    _local = LRUCache(CACHE_SIZE if size is None else size)
+    _shared = CACHE_SHARED if shared is None else shared
+
+    with _generation_lock:
+        _generation.update(number=None, checked=0)
+        _last_modified.update(generation=None, time=None)
+
+
+def enabled():
+    return _local.size > 0
+
+
+def count(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def current_generation():
+    ''' Return the current cache generation, checking at most every GENERATION_TTL seconds.
+    '''
+    with _generation_lock:
+        if _generation['number'] is None or time() - _generation['checked'] >= GENERATION_TTL:
+            row = db.session.query(CacheGeneration).get(u'api')
+            _generation.update(number=row.generation if row else 0, checked=time())
+
+        return _generation['number']
+
+
+def bump_generation(session):
+    ''' Start a new cache generation, leaving every cached response behind.
+
+        Return the new generation.
+    '''
+    row = session.query(CacheGeneration).get(u'api')
+    if not row:
+        row = CacheGeneration(name=u'api', generation=0)
+        session.add(row)
+
+    row.generation += 1
+    session.query(ResponseCache).filter(ResponseCache.generation < row.generation).delete()
+
+    return row.generation
+
+
+def last_modified():
+    ''' Return when the data behind the current generation last changed,
+        as a naive UTC datetime, or None if there is no data yet.
+    '''
+    generation = current_generation()
+
+    with _generation_lock:
+        if _last_modified['generation'] != generation:
+            times = []
+            org_updated = db.session.query(func.max(Organization.last_updated)).scalar()
+            if org_updated:
+                times.append(datetime.utcfromtimestamp(org_updated))
+            project_updated = db.session.query(func.max(Project.last_updated)).scalar()
+            if project_updated:
+                times.append(project_updated)
+
+            # never claim a change in the future
+            modified = min(max(times), datetime.utcnow()) if times else None
+            _last_modified.update(generation=generation, time=modified)
+
+        return _last_modified['time']
+
+
+def etag(key):
+    ''' Return a strong ETag for the response to a key in the current generation.
+    '''
+    return sha1('%d %s' % (current_generation(), key.encode('utf8'))).hexdigest()
+
+
+def get(key, shared=True):
+    ''' Return a cached (content type, body) pair for a key, or None.
+        Only look in this process's cache unless shared is set.
+    '''
+    generation = current_generation()
+    value = _local.get((generation, key))
+    if value:
+        count('hits')
+        return value
+
+    if _shared and shared:
+        row = db.session.query(ResponseCache).get(key)
+        if row and row.generation == generation:
+            value = row.content_type, str(row.body)
+            _local.set((generation, key), value)
+            count('shared_hits')
+            return value
+
+    count('misses')
+    return None
+
+
+def put(key, content_type, body, shared=True):
+    ''' Cache a (content type, body) pair for a key, only in this process's
+        cache unless shared is set.
+    '''
+    generation = current_generation()
+    _local.set((generation, key), (content_type, body))
+
+    if _shared and shared:
+        try:
+            db.session.merge(ResponseCache(key=key, generation=generation, content_type=unicode(content_type), body=body))
+            db.session.commit()
+        except IntegrityError:
+            # another process cached it first
+            db.session.rollback()
+
+
+def stats():
+    ''' Return a dictionary of cache hits and misses so far, and the cache size.
+    '''
+    with _stats_lock:
+        return dict(_stats, size=len(_local))
@@ -0,0 +1,240 @@
+"""
+    Pipelined update engine, used by `run_update.py --async`.
+
+    Updating an organization is almost all waiting on GitHub, Meetup, feeds
+    and project lists. This engine fetches many organizations at once on a
+    large pool of threads, with a cap on requests in flight to each host,
+    and hands the database writes to a single writer thread. Fetchers
+    mostly read from the database, and only wait on their own
+    organization's writes.
+
+    Unlike the serial and --workers updates, which commit an organization
+    all at once, each organization is committed in two steps; see
+    update_organization().
+"""
+
+import os
+import sys
+import logging
+from Queue import Queue
+from threading import Thread, Event as Done
+from multiprocessing.pool import ThreadPool
+
+from psycopg2 import connect, extras
+
+from app import db, Organization, Project, Error
+from bulk import Reconciler, update_rows
+from utils import is_safe_name
+import transport
+import run_update
+
+# Number of organizations to fetch at once
+FETCHERS = int(os.environ.get('UPDATE_FETCHERS', 16))
+# Most requests to have in flight to any one host
+HOST_CONCURRENCY = int(os.environ.get('UPDATE_HOST_CONCURRENCY', 8))
+
+
+class Writer(object):
+    ''' Run database writes one at a time on a single thread.
+
+        Each call is committed on its own, or rolled back and re-raised
+        in the calling thread if it fails.
+    '''
+    def __init__(self):
+        self.jobs = Queue()
+        self.thread = Thread(target=self.run, name='writer')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.jobs.put(None)
+        self.thread.join()
+
+    def run(self):
+        try:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    break
+
+                function, args, done, outcome = job
+                try:
+                    outcome['result'] = function(*args)
+                    db.session.commit()
+                except:
+                    db.session.rollback()
+                    outcome['error'] = sys.exc_info()
+                finally:
+                    done.set()
+        finally:
+            db.session.remove()
+
+    def call(self, function, *args):
+        ''' Run function(*args) on the writer thread and return its result.
+        '''
+        done, outcome = Done(), {}
+        self.jobs.put((function, args, done, outcome))
+        done.wait()
+
+        if 'error' in outcome:
+            error_type, error, traceback = outcome['error']
+            raise error_type, error, traceback
+
+        return outcome.get('result')
+
+
+def save_error(message):
+    db.session.add(Error(error=message, time=run_update.datetime.now()))
+
+
+def save_member_count(organization_name, members):
+    db.session.query(Organization).filter(Organization.name == organization_name).update({'member_count': members})
+
+
+def save_issues_and_labels(issues, project_changes, reconciler):
+    ''' Save issues and their labels, and the issue bookkeeping of their projects.
+    '''
+    update_rows(db.session, Project.__table__, project_changes)
+    run_update.save_issues(db.session, issues, reconciler)
+    run_update.sync_labels(db.session, issues)
+
+
+def get_issues(organization_name, reconciler, incremental=False):
+    ''' Fetch an organization's issues without writing to the database.
+
+        get_issues() sets the issue ETags and high-water marks on the
+        projects it reads, and reports them too; throw away the session's
+        copy and hand the reported changes to the writer to save.
+    '''
+    # Start over from what the writer has committed so far
+    db.session.rollback()
+    project_changes = []
+
+    try:
+        issues = run_update.get_issues(organization_name, reconciler, incremental, project_changes)
+    finally:
+        db.session.rollback()
+
+    return issues, project_changes
+
+
+def get_attendance(organization):
+    with connect(run_update.PEOPLEDB) as conn:
+        with conn.cursor(cursor_factory=extras.RealDictCursor) as peopledb:
+            cfapi_url = "https://www.codeforamerica.org/api/organizations/"
+            organization_url = cfapi_url + organization.api_id()
+            return run_update.get_attendance(peopledb, organization_url, organization.name)
+
+
+def save_all(writes):
+    ''' Run a list of (function, args) writes in order, in one transaction.
+    '''
+    for (function, args) in writes:
+        function(*args)
+
+
+def update_organization(org_info, writer, incremental=False):
+    ''' Update one organization, sending its writes to the writer.
+
+        Follows the same steps as run_update.update_organization(), but
+        commits in two transactions instead of one: the organization and
+        everything fetched for it are saved before its issues are fetched,
+        because get_issues() reads its projects back from the database.
+        If fetching issues or attendance fails, that first transaction
+        stays committed, and nothing is deleted for the organization until
+        its next update.
+
+        Return the organization's name, or None if it was skipped.
+    '''
+    if not is_safe_name(org_info['name']):
+        writer.call(save_error, unicode('ValueError: Bad organization name: "%s"' % org_info['name']))
+        return None
+
+    # Keep track of everything we see for this organization
+    reconciler = Reconciler()
+
+    # Empty lat longs are okay.
+    for key in ('latitude', 'longitude'):
+        if key in org_info and not org_info[key]:
+            org_info[key] = None
+
+    writes = [(run_update.save_organization_info, (db.session, dict(org_info)))]
+
+    # A copy of the organization for the fetchers to read, outside any session
+    organization = Organization(**org_info)
+
+    if organization.rss or organization.website:
+        logging.info("Gathering all of %s's stories." % organization.name)
+        stories = run_update.get_stories(organization)
+        if stories:
+            writes.append((run_update.save_stories_info, (db.session, stories, reconciler)))
+
+    if organization.projects_list_url:
+        logging.info("Gathering all of %s's projects." % organization.name)
+        projects = run_update.get_projects(organization, reconciler, lambda message: writer.call(save_error, message))
+        writes.append((run_update.save_projects_info, (db.session, projects, reconciler)))
+
+    if organization.events_url:
+        if not run_update.meetup_key:
+            logging.error("No Meetup.com key set.")
+        if 'meetup.com' not in organization.events_url:
+            logging.error("Only Meetup.com events work right now.")
+        else:
+            logging.info("Gathering all of %s's events." % organization.name)
+            identifier = run_update.get_event_group_identifier(organization.events_url)
+            if identifier:
+                events = run_update.get_meetup_events(organization, identifier)
+                writes.append((run_update.save_events_info, (db.session, events, reconciler)))
+
+                members = run_update.get_meetup_member_count(identifier)
+                if members is not None:
+                    writes.append((save_member_count, (organization.name, members)))
+
+            else:
+                logging.error("%s does not have a valid events url" % organization.name)
+
+    writer.call(save_all, writes)
+
+    logging.info("Gathering all of %s's open GitHub issues." % organization.name)
+    issues, project_changes = get_issues(organization.name, reconciler, incremental)
+    writes = [(save_issues_and_labels, (issues, project_changes, reconciler))]
+
+    attendance = get_attendance(organization)
+    if attendance:
+        writes.append((run_update.update_attendance, (db, organization.name, attendance)))
+
+    writes.append((run_update.delete_unseen_rows, (db.session, organization.name, reconciler)))
+    writer.call(save_all, writes)
+
+    return organization.name
+
+
+def update_organizations(orgs_info, fetchers=None, incremental=False):
+    ''' Update organizations with a pool of fetchers and a single writer,
+        optionally fetching only the issues changed since the last update.
+
+        Return the names of the organizations that were updated, in order.
+    '''
+    fetchers = fetchers or FETCHERS
+    transport.limit_hosts(HOST_CONCURRENCY)
+    if HOST_CONCURRENCY > transport.POOL_MAXSIZE:
+        transport.configure(pool_maxsize=HOST_CONCURRENCY)
+
+    writer = Writer()
+    writer.start()
+
+    def fetch(org_info):
+        try:
+            return update_organization(org_info, writer, incremental)
+        finally:
+            db.session.remove()
+
+    pool = ThreadPool(fetchers)
+    try:
+        return pool.map(fetch, orgs_info, chunksize=1)
+    finally:
+        pool.close()
+        writer.stop()
+        transport.limit_hosts(transport.HOST_CONCURRENCY)
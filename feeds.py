@@ -8,13 +8,14 @@
     with feedparser, returning content or a proper error.
 """
 
-import urllib2
-from httplib import BadStatusLine
+from urlparse import urlparse
 
 import feedparser
 
 from BeautifulSoup import BeautifulSoup
-from socket import error as SocketError
+from requests import exceptions
+
+from transport import get
 
 # list of attributes that can have a feed link in the <HEAD> section
 # so we can identify at least one in a page
@@ -40,8 +41,8 @@ def extract_feed_links(html, feed_links_attributes=FEED_LINKS_ATTRIBUTES):
     """
         Return a generator yielding potiential feed links in a HTML page.
 
-        >>> url = urllib2.urlopen('http://www.codinghorror.com/blog/')
-        >>> links = extract_feed_links(url.read(1000000))
+        >>> got = get('http://www.codinghorror.com/blog/')
+        >>> links = extract_feed_links(got.content[:1000000])
         >>> tuple(links)
         (u'http://feeds.feedburner.com/codinghorror/',)
     """
@@ -68,19 +69,24 @@ def get_first_working_feed_link(url):
     """
 
     # if the url is a feed itself, returns it
-    html = None
     try:
-        html = urllib2.urlopen(url).read(1000000)
-    except (SocketError, BadStatusLine):
+        got = get(url)
+    except exceptions.RequestException:
+        return None
+
+    # Consider any status other than 2xx an error
+    if not got.status_code // 100 == 2:
         return None
 
+    html = got.content[:1000000]
+
     feed = feedparser.parse(html)
 
     if not feed.get("bozo", 1):
         return unicode(url)
 
     # construct the site url from the domain name and the protocole name
-    parsed_url = urllib2.urlparse.urlparse(url)
+    parsed_url = urlparse(url)
     site_url = u"%s://%s" % (parsed_url.scheme, parsed_url.netloc)
 
     # parse the html extracted from the url, and get all the potiential
@@ -88,7 +94,10 @@ def get_first_working_feed_link(url):
     for link in extract_feed_links(html):
         if '://' not in link:  # if we got a relative URL, make it absolute
             link = site_url + link
-        feed = feedparser.parse(link)
+        try:
+            feed = feedparser.parse(get(link).content)
+        except exceptions.RequestException:
+            continue
         if not feed.get("bozo", 1):
             return link
 
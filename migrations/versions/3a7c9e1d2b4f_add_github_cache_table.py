@@ -0,0 +1,31 @@
+"""Add github_cache table
+
+Revision ID: 3a7c9e1d2b4f
+Revises: 15593ff6a15f
+Create Date: 2016-02-08 11:20:14.316724
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a7c9e1d2b4f'
+down_revision = '15593ff6a15f'
+
+from alembic import op
+import sqlalchemy as sa
+from models import JsonType
+
+
+def upgrade():
+    op.create_table(
+        'github_cache',
+        sa.Column('url', sa.Unicode(), nullable=False),
+        sa.Column('etag', sa.Unicode(), nullable=True),
+        sa.Column('last_modified', sa.Unicode(), nullable=True),
+        sa.Column('headers', JsonType, nullable=True),
+        sa.Column('body', sa.LargeBinary(), nullable=True),
+        sa.Column('time', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('url')
+    )
+
+def downgrade():
+    op.drop_table('github_cache')
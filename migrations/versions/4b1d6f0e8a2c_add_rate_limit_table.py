@@ -0,0 +1,31 @@
+"""Add rate_limit table
+
+Revision ID: 4b1d6f0e8a2c
+Revises: 3a7c9e1d2b4f
+Create Date: 2016-02-10 16:02:51.118350
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b1d6f0e8a2c'
+down_revision = '3a7c9e1d2b4f'
+
+from alembic import op
+import sqlalchemy as sa
+from models import JsonType
+
+
+def upgrade():
+    op.create_table(
+        'rate_limit',
+        sa.Column('resource', sa.Unicode(), nullable=False),
+        sa.Column('limit', sa.Integer(), nullable=True),
+        sa.Column('remaining', sa.Integer(), nullable=True),
+        sa.Column('reset', sa.Integer(), nullable=True),
+        sa.Column('parked', JsonType, nullable=True),
+        sa.Column('updated', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('resource')
+    )
+
+def downgrade():
+    op.drop_table('rate_limit')
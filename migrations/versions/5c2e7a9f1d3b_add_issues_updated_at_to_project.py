@@ -0,0 +1,22 @@
+"""Adds a high-water mark for incremental issue updates.
+
+Revision ID: 5c2e7a9f1d3b
+Revises: 4b1d6f0e8a2c
+Create Date: 2016-02-12 11:24:05.402716
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c2e7a9f1d3b'
+down_revision = '4b1d6f0e8a2c'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('project', sa.Column('issues_updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('project', 'issues_updated_at')
@@ -0,0 +1,23 @@
+"""Adds indexes on the columns paged through with cursors.
+
+Revision ID: 6d3f8b0a2e4c
+Revises: 5c2e7a9f1d3b
+Create Date: 2016-02-19 10:02:41.118305
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6d3f8b0a2e4c'
+down_revision = '5c2e7a9f1d3b'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index('index_project_last_updated_id', 'project', ['last_updated', 'id'])
+    op.create_index('index_event_start_time_notz_id', 'event', ['start_time_notz', 'id'])
+
+
+def downgrade():
+    op.drop_index('index_event_start_time_notz_id', 'event')
+    op.drop_index('index_project_last_updated_id', 'project')
@@ -0,0 +1,25 @@
+"""Adds a shuffled sort order for issues.
+
+Revision ID: 7e4a9c1b3f5d
+Revises: 6d3f8b0a2e4c
+Create Date: 2016-02-23 15:37:12.530917
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7e4a9c1b3f5d'
+down_revision = '6d3f8b0a2e4c'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # random() is evaluated for each existing row
+    op.add_column('issue', sa.Column('shuffle_key', sa.Float(), server_default=sa.text('random()'), nullable=False))
+    op.create_index('index_issue_shuffle_key_id', 'issue', ['shuffle_key', 'id'])
+
+
+def downgrade():
+    op.drop_index('index_issue_shuffle_key_id', 'issue')
+    op.drop_column('issue', 'shuffle_key')
@@ -0,0 +1,36 @@
+"""Adds tables for the API response cache.
+
+Revision ID: 8f5b0d2c4a6e
+Revises: 7e4a9c1b3f5d
+Create Date: 2016-03-01 09:48:26.204173
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8f5b0d2c4a6e'
+down_revision = '7e4a9c1b3f5d'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'cache_generation',
+        sa.Column('name', sa.Unicode(), nullable=False),
+        sa.Column('generation', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table(
+        'response_cache',
+        sa.Column('key', sa.Unicode(), nullable=False),
+        sa.Column('generation', sa.Integer(), nullable=True),
+        sa.Column('content_type', sa.Unicode(), nullable=True),
+        sa.Column('body', sa.LargeBinary(), nullable=True),
+        sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade():
+    op.drop_table('response_cache')
+    op.drop_table('cache_generation')
@@ -0,0 +1,31 @@
+"""Adds a table for prebuilt API responses.
+
+Revision ID: 9a6c1e3d5b7f
+Revises: 8f5b0d2c4a6e
+Create Date: 2016-03-04 11:02:37.518402
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9a6c1e3d5b7f'
+down_revision = '8f5b0d2c4a6e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'artifact',
+        sa.Column('name', sa.Unicode(), nullable=False),
+        sa.Column('url_root', sa.Unicode(), nullable=False),
+        sa.Column('content_type', sa.Unicode(), nullable=True),
+        sa.Column('etag', sa.Unicode(), nullable=True),
+        sa.Column('body', sa.LargeBinary(), nullable=True),
+        sa.Column('updated', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('name', 'url_root')
+    )
+
+
+def downgrade():
+    op.drop_table('artifact')
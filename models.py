@@ -1,6 +1,7 @@
 from __future__ import division
 
 from datetime import datetime, date
+from collections import defaultdict
 import json
 import time
 
@@ -8,7 +9,9 @@ from flask import request
 from sqlalchemy.ext.mutable import Mutable
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy import types, desc
+from sqlalchemy.sql.expression import func
 from sqlalchemy.orm import backref
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy import event, DDL
 from dateutil.tz import tzoffset
 
@@ -70,6 +73,82 @@ def compile_tsvector(element, compiler, **kw):
     return 'tsvector'
 
 
+# -------------------
+# Links
+# -------------------
+
+
+def api_root():
+    ''' Return the URL API links start with, worked out once per request.
+    '''
+    root = getattr(request, 'api_root', None)
+    if root is None:
+        root = request.api_root = '%s://%s/api' % (request.scheme, request.host)
+
+    return root
+
+
+# -------------------
+# Sparse fieldsets
+# -------------------
+
+
+def wanted(key, fields):
+    ''' Return whether a key belongs in a dictionary limited to some fields,
+        or to all of them if fields is None.
+    '''
+    return fields is None or key in fields
+
+
+def field_columns(model, fields):
+    ''' Return the names of the columns a model needs loaded for asdict() to return some fields.
+    '''
+    names = set([column.key for column in model.__table__.primary_key])
+    dependencies = getattr(model, 'field_dependencies', {})
+
+    for field in fields:
+        if field in model.__table__.columns:
+            names.add(field)
+        names.update(dependencies.get(field, ()))
+
+    return names
+
+
+# -------------------
+# Serializers
+# -------------------
+
+
+def column_serializer(model, exclude=(), formats=None):
+    ''' Return a function that makes a dictionary of a model's public columns,
+        optionally limited to some fields.
+
+        The columns are looked up once, here, and compiled into the function
+        instead of being introspected on every call. formats maps column names
+        to functions that format their values.
+    '''
+    formats = formats or {}
+    keys = [column.key for column in model.__table__.columns if column.key not in exclude]
+    namespace = dict(('format_%s' % key, formats[key]) for key in keys if key in formats)
+
+    items = ['%r: format_%s(instance.%s)' % (key, key, key) if key in formats else '%r: instance.%s' % (key, key)
+             for key in keys]
+    source = 'def serialize(instance):\n    return {%s}\n' % ', '.join(items)
+    exec(compile(source, '<%s serializer>' % model.__name__, 'exec'), namespace)
+    serialize_all = namespace['serialize']
+
+    getters = [(key, formats.get(key)) for key in keys]
+
+    def serialize(instance, fields=None):
+        if fields is None:
+            return serialize_all(instance)
+
+        return dict([(key, format(getattr(instance, key)) if format else getattr(instance, key))
+                     for (key, format) in getters if key in fields])
+
+    return serialize
+
+
 # -------------------
 # Models
 # -------------------
@@ -115,13 +194,20 @@ class Organization(db.Model):
         self.id = safe_name(raw_name(name))
         self.members_count = members_count
 
+    def preloaded(self, key):
+        ''' Return the rows preload() found for one of the current_* lists, once, or None.
+        '''
+        return getattr(self, '_preloaded', {}).pop(key, None)
+
     def current_events(self):
         '''
             Return the two soonest upcoming events
         '''
-        filter_old = Event.start_time_notz >= datetime.utcnow()
-        current_events = Event.query.filter_by(organization_name=self.name)\
-            .filter(filter_old).order_by(Event.start_time_notz.asc()).limit(2).all()
+        current_events = self.preloaded('current_events')
+        if current_events is None:
+            filter_old = Event.start_time_notz >= datetime.utcnow()
+            current_events = Event.query.filter_by(organization_name=self.name)\
+                .filter(filter_old).order_by(Event.start_time_notz.asc()).limit(2).all()
         current_events_json = [row.asdict() for row in current_events]
         return current_events_json
 
@@ -129,7 +215,9 @@ class Organization(db.Model):
         '''
             Return the three most current projects
         '''
-        current_projects = Project.query.filter_by(organization_name=self.name).order_by(desc(Project.last_updated)).limit(3)
+        current_projects = self.preloaded('current_projects')
+        if current_projects is None:
+            current_projects = Project.query.filter_by(organization_name=self.name).order_by(desc(Project.last_updated)).limit(3)
         current_projects_json = [project.asdict(include_issues=False) for project in current_projects]
 
         return current_projects_json
@@ -138,56 +226,45 @@ class Organization(db.Model):
         '''
             Return the two most current stories
         '''
-        current_stories = Story.query.filter_by(organization_name=self.name).order_by(desc(Story.id)).limit(2).all()
+        current_stories = self.preloaded('current_stories')
+        if current_stories is None:
+            current_stories = Story.query.filter_by(organization_name=self.name).order_by(desc(Story.id)).limit(2).all()
         current_stories_json = [row.asdict() for row in current_stories]
         return current_stories_json
 
     def all_events(self):
         ''' API link to all an orgs events
         '''
-        # Make a nice org name
-        organization_name = safe_name(self.name)
-        return '%s://%s/api/organizations/%s/events' % (request.scheme, request.host, organization_name)
+        return '%s/organizations/%s/events' % (api_root(), self.api_id())
 
     def upcoming_events(self):
         ''' API link to an orgs upcoming events
         '''
-        # Make a nice org name
-        organization_name = safe_name(self.name)
-        return '%s://%s/api/organizations/%s/upcoming_events' % (request.scheme, request.host, organization_name)
+        return '%s/organizations/%s/upcoming_events' % (api_root(), self.api_id())
 
     def past_events(self):
         ''' API link to an orgs past events
         '''
-        # Make a nice org name
-        organization_name = safe_name(self.name)
-        return '%s://%s/api/organizations/%s/past_events' % (request.scheme, request.host, organization_name)
+        return '%s/organizations/%s/past_events' % (api_root(), self.api_id())
 
     def all_projects(self):
         ''' API link to all an orgs projects
         '''
-        # Make a nice org name
-        organization_name = safe_name(self.name)
-        return '%s://%s/api/organizations/%s/projects' % (request.scheme, request.host, organization_name)
+        return '%s/organizations/%s/projects' % (api_root(), self.api_id())
 
     def all_issues(self):
         '''API link to all an orgs issues
         '''
-        # Make a nice org name
-        organization_name = safe_name(self.name)
-        return '%s://%s/api/organizations/%s/issues' % (request.scheme, request.host, organization_name)
+        return '%s/organizations/%s/issues' % (api_root(), self.api_id())
 
     def all_stories(self):
         ''' API link to all an orgs stories
         '''
-        # Make a nice org name
-        organization_name = safe_name(self.name)
-        return '%s://%s/api/organizations/%s/stories' % (request.scheme, request.host, organization_name)
+        return '%s/organizations/%s/stories' % (api_root(), self.api_id())
 
     def all_attendance(self):
         ''' API link to orgs attendance '''
-        organization_name = safe_name(self.name)
-        return '%s://%s/api/organizations/%s/attendance' % (request.scheme, request.host, organization_name)
+        return '%s/organizations/%s/attendance' % (api_root(), self.api_id())
 
     def api_id(self):
         ''' Return organization name made safe for use in a URL.
@@ -197,30 +274,33 @@ class Organization(db.Model):
     def api_url(self):
         ''' API link to itself
         '''
-        return '%s://%s/api/organizations/%s' % (request.scheme, request.host, self.api_id())
+        return '%s/organizations/%s' % (api_root(), self.api_id())
 
-    def asdict(self, include_extras=False):
+    def asdict(self, include_extras=False, fields=None):
         ''' Return Organization as a dictionary, with some properties tweaked.
 
-            Optionally include linked projects, events, and stories.
+            Optionally include linked projects, events, and stories, and
+            limit it to some fields.
         '''
-        organization_dict = db.Model.asdict(self)
-
-        # remove fields that don't need to be public
-        del organization_dict['keep']
-        del organization_dict['tsv_body']
+        # leave out fields that don't need to be public
+        organization_dict = serialize_organization(self, fields)
 
         for key in ('all_events', 'all_projects', 'all_stories', 'all_issues',
                     'upcoming_events', 'past_events', 'api_url', 'all_attendance'):
-            organization_dict[key] = getattr(self, key)()
+            if wanted(key, fields):
+                organization_dict[key] = getattr(self, key)()
 
         if include_extras:
             for key in ('current_events', 'current_projects', 'current_stories'):
-                organization_dict[key] = getattr(self, key)()
+                if wanted(key, fields):
+                    organization_dict[key] = getattr(self, key)()
 
         return organization_dict
 
 
+# leave out fields that don't need to be public
+serialize_organization = column_serializer(Organization, exclude=('keep', 'tsv_body'))
+
 tbl = Organization.__table__
 # Index the tsvector column
 db.Index('index_org_tsv_body', tbl.c.tsv_body, postgresql_using='gin')
@@ -249,6 +329,9 @@ class Story(db.Model):
     organization = db.relationship('Organization', single_parent=True, cascade='all, delete-orphan', backref=backref("stories", cascade="save-update, delete"))
     organization_name = db.Column(db.Unicode(), db.ForeignKey('organization.name', ondelete='CASCADE'), nullable=False)
 
+    # Columns asdict() needs for fields that aren't columns themselves
+    field_dependencies = dict(organization=('organization_name', ))
+
     def __init__(self, title=None, link=None, type=None, organization_name=None):
         self.title = title
         self.link = link
@@ -259,25 +342,26 @@ class Story(db.Model):
     def api_url(self):
         ''' API link to itself
         '''
-        return '%s://%s/api/stories/%s' % (request.scheme, request.host, str(self.id))
+        return '%s/stories/%s' % (api_root(), self.id)
 
-    def asdict(self, include_organization=False):
+    def asdict(self, include_organization=False, fields=None):
         ''' Return Story as a dictionary, with some properties tweaked.
 
-            Optionally include linked organization.
+            Optionally include linked organization, and limit it to some fields.
         '''
-        story_dict = db.Model.asdict(self)
-
-        # remove fields that don't need to be public
-        del story_dict['keep']
+        # leave out fields that don't need to be public
+        story_dict = serialize_story(self, fields)
 
-        story_dict['api_url'] = self.api_url()
+        if wanted('api_url', fields):
+            story_dict['api_url'] = self.api_url()
 
-        if include_organization:
+        if include_organization and wanted('organization', fields):
             story_dict['organization'] = self.organization.asdict()
 
         return story_dict
 
+# leave out fields that don't need to be public
+serialize_story = column_serializer(Story, exclude=('keep', ))
 
 class Project(db.Model):
     '''
@@ -301,6 +385,7 @@ class Project(db.Model):
     tsv_body = db.Column(TSVectorType())
     status = db.Column(db.Unicode())
     languages = db.Column(JsonType())
+    issues_updated_at = db.Column(db.DateTime())
 
     # Relationships
     # child
@@ -309,11 +394,14 @@ class Project(db.Model):
 
     # can contain issues (this relationship is defined in the child object)
 
+    # Columns asdict() needs for fields that aren't columns themselves
+    field_dependencies = dict(organization=('organization_name', ))
+
     def __init__(self, name, code_url=None, link_url=None,
                  description=None, type=None, categories=None, tags=None,
                  github_details=None, last_updated=None, last_updated_issues=None,
                  last_updated_civic_json=None, last_updated_root_files=None, organization_name=None,
-                 keep=None, status=None, languages=None):
+                 keep=None, status=None, languages=None, issues_updated_at=None):
         self.name = name
         self.code_url = code_url
         self.link_url = link_url
@@ -330,39 +418,41 @@ class Project(db.Model):
         self.keep = True
         self.status = status
         self.languages = languages
+        self.issues_updated_at = issues_updated_at
 
     def api_url(self):
         ''' API link to itself
         '''
-        return '%s://%s/api/projects/%s' % (request.scheme, request.host, str(self.id))
+        return '%s/projects/%s' % (api_root(), self.id)
 
-    def asdict(self, include_organization=False, include_issues=True):
+    def asdict(self, include_organization=False, include_issues=True, fields=None):
         ''' Return Project as a dictionary, with some properties tweaked.
 
-            Optionally include linked organization.
+            Optionally include linked organization, and limit it to some fields.
         '''
-        project_dict = db.Model.asdict(self)
+        project_dict = serialize_project(self, fields)
 
-        # remove fields that don't need to be public
-        del project_dict['keep']
-        del project_dict['tsv_body']
-        del project_dict['last_updated_issues']
-        del project_dict['last_updated_civic_json']
-        del project_dict['last_updated_root_files']
+        if wanted('api_url', fields):
+            project_dict['api_url'] = self.api_url()
 
-        project_dict['api_url'] = self.api_url()
-
-        if include_organization:
+        if include_organization and wanted('organization', fields):
             project_dict['organization'] = self.organization.asdict()
 
-        if include_issues:
-            project_dict['issues'] = [o.asdict() for o in db.session.query(Issue).filter(Issue.project_id == project_dict['id']).all()]
+        if include_issues and wanted('issues', fields):
+            project_dict['issues'] = [o.asdict() for o in self.issues]
 
         return project_dict
 
+# leave out fields that don't need to be public, without loading
+# the deferred tsv_body just to throw it away
+serialize_project = column_serializer(Project, exclude=('keep', 'tsv_body', 'last_updated_issues', 'last_updated_civic_json',
+                                                        'last_updated_root_files', 'issues_updated_at'))
+
 tbl = Project.__table__
 # Index the tsvector column
 db.Index('index_project_tsv_body', tbl.c.tsv_body, postgresql_using='gin')
+# Index the columns paged through with cursors
+db.Index('index_project_last_updated_id', tbl.c.last_updated, tbl.c.id)
 
 # Trigger to populate the search index column
 trig_ddl = DDL("""
@@ -397,6 +487,8 @@ class Issue(db.Model):
     keep = db.Column(db.Boolean())
     created_at = db.Column(db.DateTime())
     updated_at = db.Column(db.DateTime())
+    # Place in the shuffled order issues are listed in, reshuffled by run_update.py
+    shuffle_key = db.Column(db.Float(), server_default=db.text('random()'), nullable=False)
 
     # Relationships
     # child
@@ -405,6 +497,9 @@ class Issue(db.Model):
 
     # can contain labels (this relationship is defined in the child object)
 
+    # Columns asdict() needs for fields that aren't columns themselves
+    field_dependencies = dict(project=('project_id', ))
+
     def __init__(self, title, project_id=None, html_url=None, labels=None, body=None, created_at=None, updated_at=None):
         self.title = title
         self.html_url = html_url
@@ -417,31 +512,35 @@ class Issue(db.Model):
     def api_url(self):
         ''' API link to itself
         '''
-        return '%s://%s/api/issues/%s' % (request.scheme, request.host, str(self.id))
+        return '%s/issues/%s' % (api_root(), self.id)
 
-    def asdict(self, include_project=False):
+    def asdict(self, include_project=False, fields=None):
         '''
-            Return issue as a dictionary with some properties tweaked
+            Return issue as a dictionary with some properties tweaked,
+            optionally limited to some fields
         '''
-        issue_dict = db.Model.asdict(self)
+        issue_dict = serialize_issue(self, fields)
 
         # TODO: Also paged_results assumes asdict takes this argument, should be checked and fixed later
         if include_project:
-            issue_dict['project'] = db.session.query(Project).filter(Project.id == self.project_id).first().asdict()
-            del issue_dict['project']['issues']
-            del issue_dict['project_id']
+            if wanted('project', fields):
+                issue_dict['project'] = self.project.asdict(include_issues=False)
+            issue_dict.pop('project_id', None)
 
-        # remove fields that don't need to be public
-        del issue_dict['keep']
+        if wanted('api_url', fields):
+            issue_dict['api_url'] = self.api_url()
+        if wanted('labels', fields):
+            issue_dict['labels'] = [l.asdict() for l in self.labels]
 
-        # manually convert dates to ISO 8601
-        issue_dict['created_at'] = convert_datetime_to_iso_8601(issue_dict['created_at'])
-        issue_dict['updated_at'] = convert_datetime_to_iso_8601(issue_dict['updated_at'])
+        return issue_dict
 
-        issue_dict['api_url'] = self.api_url()
-        issue_dict['labels'] = [l.asdict() for l in self.labels]
+# leave out fields that don't need to be public, and convert dates to ISO 8601
+serialize_issue = column_serializer(Issue, exclude=('keep', 'shuffle_key'),
+                                    formats=dict(created_at=convert_datetime_to_iso_8601, updated_at=convert_datetime_to_iso_8601))
 
-        return issue_dict
+tbl = Issue.__table__
+# Index the shuffled order
+db.Index('index_issue_shuffle_key_id', tbl.c.shuffle_key, tbl.c.id)
 
 
 class Label(db.Model):
@@ -469,13 +568,116 @@ class Label(db.Model):
         '''
             Return label as a dictionary with some properties tweaked
         '''
-        label_dict = db.Model.asdict(self)
+        return serialize_label(self)
+
+# leave out fields that don't need to be public
+serialize_label = column_serializer(Label, exclude=('id', 'issue_id'))
 
-        # remove fields that don't need to be public
-        del label_dict['id']
-        del label_dict['issue_id']
 
-        return label_dict
+def load_children(parents, relationship, child_model, foreign_key):
+    ''' Load the children of many parents with one IN query, and set them
+        as each parent's already-loaded relationship collection.
+
+        Return the list of children.
+    '''
+    parent_ids = set([parent.id for parent in parents])
+    children = child_model.query.filter(foreign_key.in_(parent_ids)).all() if parent_ids else []
+
+    children_by_parent = defaultdict(list)
+    for child in children:
+        children_by_parent[getattr(child, foreign_key.key)].append(child)
+
+    for parent in parents:
+        set_committed_value(parent, relationship, children_by_parent[parent.id])
+
+    return children
+
+
+def load_current(organizations, model, ordering, limit, *filters):
+    ''' Load the first few rows of a model for each of many organizations
+        with one windowed query.
+
+        Return the rows, grouped by organization name.
+    '''
+    names = set([organization.name for organization in organizations])
+    rank = func.row_number().over(partition_by=model.organization_name, order_by=ordering).label('rank')
+    ranked = db.session.query(model.id.label('id'), rank).filter(model.organization_name.in_(names), *filters).subquery()
+    rows = model.query.join(ranked, model.id == ranked.c.id).filter(ranked.c.rank <= limit).order_by(ranked.c.rank).all()
+
+    rows_by_organization = defaultdict(list)
+    for row in rows:
+        rows_by_organization[row.organization_name].append(row)
+
+    return rows_by_organization
+
+
+def preload(instances, fields=None):
+    ''' Load everything asdict(True) needs for a page of rows up front, so
+        serializing the page takes the same few queries however many rows
+        it has. Leave out what isn't needed for some fields.
+
+        Return the loaded rows. The session only holds on to rows weakly,
+        so keep them around until the page is serialized.
+    '''
+    organizations = [instance for instance in instances if isinstance(instance, Organization)]
+    projects = [instance for instance in instances if isinstance(instance, Project)]
+    issues = [instance for instance in instances if isinstance(instance, Issue)]
+    loaded = []
+
+    if organizations:
+        # The same rows as each organization's current_* methods would find
+        current = dict(
+            current_events=lambda: load_current(organizations, Event, Event.start_time_notz.asc(), 2, Event.start_time_notz >= datetime.utcnow()),
+            current_projects=lambda: load_current(organizations, Project, desc(Project.last_updated), 3),
+            current_stories=lambda: load_current(organizations, Story, desc(Story.id), 2)
+        )
+
+        for organization in organizations:
+            organization._preloaded = dict()
+
+        for (key, load) in current.items():
+            if wanted(key, fields):
+                rows_by_organization = load()
+                for organization in organizations:
+                    organization._preloaded[key] = rows_by_organization[organization.name]
+                    loaded += organization._preloaded[key]
+
+    # Loaded organizations are found in the session by each row's organization
+    with_organizations = [instance for instance in instances if isinstance(instance, (Project, Event, Story))]
+    if with_organizations and wanted('organization', fields):
+        organization_names = set([instance.organization_name for instance in with_organizations])
+        loaded += Organization.query.filter(Organization.name.in_(organization_names)).all()
+
+    if projects:
+        issues = load_children(projects, 'issues', Issue, Issue.project_id) if wanted('issues', fields) else []
+        loaded += issues
+
+    elif issues:
+        if wanted('project', fields):
+            # Loaded projects are found in the session by Issue.project
+            project_ids = set([issue.project_id for issue in issues])
+            loaded += Project.query.filter(Project.id.in_(project_ids)).all()
+        if not wanted('labels', fields):
+            issues = []
+
+    loaded += load_children(issues, 'labels', Label, Label.issue_id)
+
+    return loaded
+
+
+# Time zones for the UTC offsets events have been seen with
+_tzoffsets = {}
+
+
+def format_event_time(time, utc_offset):
+    ''' Get a string representation of an event time with its UTC offset.
+    '''
+    if time is None:
+        return None
+    if utc_offset not in _tzoffsets:
+        _tzoffsets[utc_offset] = tzoffset(None, utc_offset)
+    dt = time.replace(microsecond=0, tzinfo=_tzoffsets[utc_offset])
+    return dt.strftime('%Y-%m-%d %H:%M:%S %z')
 
 
 class Event(db.Model):
@@ -500,6 +702,10 @@ class Event(db.Model):
     organization = db.relationship('Organization', single_parent=True, cascade='all, delete-orphan', backref=backref("events", cascade="save-update, delete"))
     organization_name = db.Column(db.Unicode(), db.ForeignKey('organization.name', ondelete='CASCADE'), nullable=False)
 
+    # Columns asdict() needs for fields that aren't columns themselves
+    field_dependencies = dict(start_time=('start_time_notz', 'utc_offset'), end_time=('end_time_notz', 'utc_offset'),
+                              organization=('organization_name', ))
+
     def __init__(self, name, event_url, start_time_notz, created_at, utc_offset,
                  organization_name, location=None, end_time_notz=None, description=None, rsvps=None):
         self.name = name
@@ -517,47 +723,41 @@ class Event(db.Model):
     def start_time(self):
         ''' Get a string representation of the start time with UTC offset.
         '''
-        if self.start_time_notz is None:
-            return None
-        tz = tzoffset(None, self.utc_offset)
-        st = self.start_time_notz
-        dt = datetime(st.year, st.month, st.day, st.hour, st.minute, st.second, tzinfo=tz)
-        return dt.strftime('%Y-%m-%d %H:%M:%S %z')
+        return format_event_time(self.start_time_notz, self.utc_offset)
 
     def end_time(self):
         ''' Get a string representation of the end time with UTC offset.
         '''
-        if self.end_time_notz is None:
-            return None
-        tz = tzoffset(None, self.utc_offset)
-        et = self.end_time_notz
-        dt = datetime(et.year, et.month, et.day, et.hour, et.minute, et.second, tzinfo=tz)
-        return dt.strftime('%Y-%m-%d %H:%M:%S %z')
+        return format_event_time(self.end_time_notz, self.utc_offset)
 
     def api_url(self):
         ''' API link to itself
         '''
-        return '%s://%s/api/events/%s' % (request.scheme, request.host, str(self.id))
+        return '%s/events/%s' % (api_root(), self.id)
 
-    def asdict(self, include_organization=False):
+    def asdict(self, include_organization=False, fields=None):
         ''' Return Event as a dictionary, with some properties tweaked.
 
-            Optionally include linked organization.
+            Optionally include linked organization, and limit it to some fields.
         '''
-        event_dict = db.Model.asdict(self)
-
-        # remove fields that don't need to be public
-        for key in ('keep', 'start_time_notz', 'end_time_notz', 'utc_offset'):
-            del event_dict[key]
+        event_dict = serialize_event(self, fields)
 
         for key in ('start_time', 'end_time', 'api_url'):
-            event_dict[key] = getattr(self, key)()
+            if wanted(key, fields):
+                event_dict[key] = getattr(self, key)()
 
-        if include_organization:
+        if include_organization and wanted('organization', fields):
             event_dict['organization'] = self.organization.asdict()
 
         return event_dict
 
+# leave out fields that don't need to be public
+serialize_event = column_serializer(Event, exclude=('keep', 'start_time_notz', 'end_time_notz', 'utc_offset'))
+
+tbl = Event.__table__
+# Index the columns paged through with cursors
+db.Index('index_event_start_time_notz_id', tbl.c.start_time_notz, tbl.c.id)
+
 
 class Attendance(db.Model):
     ''' Attendance at organization events
@@ -587,3 +787,62 @@ class Error(db.Model):
     id = db.Column(db.Integer(), primary_key=True)
     error = db.Column(db.Unicode())
     time = db.Column(db.DateTime(False))
+
+
+class RateLimit(db.Model):
+    '''
+        Rate limit budgets left at the end of run_update.py
+    '''
+    # Columns
+    resource = db.Column(db.Unicode(), primary_key=True)
+    limit = db.Column(db.Integer())
+    remaining = db.Column(db.Integer())
+    reset = db.Column(db.Integer())
+    parked = db.Column(JsonType())
+    updated = db.Column(db.Integer())
+
+
+class GithubCache(db.Model):
+    '''
+        Cached GitHub API responses from run_update.py, for conditional requests
+    '''
+    # Columns
+    url = db.Column(db.Unicode(), primary_key=True)
+    etag = db.Column(db.Unicode())
+    last_modified = db.Column(db.Unicode())
+    headers = db.Column(JsonType())
+    body = db.Column(db.LargeBinary())
+    time = db.Column(db.DateTime(False))
+
+
+class CacheGeneration(db.Model):
+    '''
+        Counter bumped by run_update.py when the data behind the API changes
+    '''
+    # Columns
+    name = db.Column(db.Unicode(), primary_key=True)
+    generation = db.Column(db.Integer())
+
+
+class ResponseCache(db.Model):
+    '''
+        API responses shared between web processes, for one cache generation
+    '''
+    # Columns
+    key = db.Column(db.Unicode(), primary_key=True)
+    generation = db.Column(db.Integer())
+    content_type = db.Column(db.Unicode())
+    body = db.Column(db.LargeBinary())
+
+
+class Artifact(db.Model):
+    '''
+        API responses built ahead of time by run_update.py, gzipped, for each URL root they're served from
+    '''
+    # Columns
+    name = db.Column(db.Unicode(), primary_key=True)
+    url_root = db.Column(db.Unicode(), primary_key=True)
+    content_type = db.Column(db.Unicode())
+    etag = db.Column(db.Unicode())
+    body = db.Column(db.LargeBinary())
+    updated = db.Column(db.DateTime(False))
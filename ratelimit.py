@@ -0,0 +1,139 @@
+"""
+    Pace requests to a rate limited API, like GitHub's, across worker threads.
+
+    The scheduler reads the X-RateLimit-* headers from every response. While
+    plenty of budget is left requests go out as fast as they're made; as the
+    budget runs low they're spread out evenly until the window resets. Once
+    the budget is spent, work that can't wait for the reset is parked so it
+    can be picked up first on the next run.
+"""
+
+import os
+import logging
+from threading import Lock
+from time import time, sleep
+
+# Number of requests to hold back for other consumers of the same token
+RESERVE = int(os.environ.get('GITHUB_RATELIMIT_RESERVE', 50))
+# Start spacing requests out when fewer than this many are left
+PACE_BELOW = int(os.environ.get('GITHUB_RATELIMIT_PACE_BELOW', 500))
+# Longest we're willing to sleep waiting for the window to reset, in seconds
+MAX_WAIT = int(os.environ.get('GITHUB_RATELIMIT_MAX_WAIT', 300))
+
+
+class RateLimitScheduler(object):
+    ''' Keep track of a rate limit budget and hand out turns to use it.
+    '''
+    def __init__(self, reserve=RESERVE, pace_below=PACE_BELOW, max_wait=MAX_WAIT):
+        self.reserve = reserve
+        self.pace_below = pace_below
+        self.max_wait = max_wait
+
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.parked = []
+        self.stale = []
+        self.next_turn = 0
+
+        self.lock = Lock()
+
+    def load(self, limit=None, remaining=None, reset=None, parked=None):
+        ''' Restore a budget and the work parked by an earlier run.
+        '''
+        with self.lock:
+            self.limit = limit
+            self.remaining = remaining
+            self.reset = reset
+            self.stale = list(parked or [])
+
+    def update(self, response):
+        ''' Read the remaining budget from a response's headers.
+        '''
+        headers = response.headers
+        with self.lock:
+            if 'x-ratelimit-limit' in headers:
+                self.limit = int(headers['x-ratelimit-limit'])
+            if 'x-ratelimit-remaining' in headers:
+                self.remaining = int(headers['x-ratelimit-remaining'])
+            if 'x-ratelimit-reset' in headers:
+                self.reset = int(headers['x-ratelimit-reset'])
+
+    def exhaust(self):
+        ''' Mark the budget as spent, e.g. after being throttled.
+        '''
+        with self.lock:
+            self.remaining = 0
+
+    def exhausted(self):
+        ''' Return True if the budget is spent until the window resets.
+        '''
+        with self.lock:
+            return self._exhausted(time())
+
+    def _exhausted(self, now):
+        if self.remaining is None or self.remaining > self.reserve:
+            return False
+
+        # without a reset time we can't know when the budget comes back
+        return self.reset is None or now < self.reset
+
+    def available(self):
+        ''' Return True if requests can be made now, sleeping first if the
+            budget comes back within max_wait seconds.
+        '''
+        with self.lock:
+            now = time()
+            if not self._exhausted(now):
+                return True
+
+            if self.reset is None or self.reset - now > self.max_wait:
+                return False
+
+            wait = self.reset - now
+
+        logging.info('GitHub rate limit spent, waiting %d seconds for it to reset', wait)
+        sleep(wait)
+
+        with self.lock:
+            self.remaining = None
+
+        return True
+
+    def wait(self):
+        ''' Wait for a turn to make a request.
+
+            Turns are handed out at an even pace across all threads so that
+            a low budget lasts until the window resets.
+        '''
+        with self.lock:
+            now = time()
+            interval = 0
+            if self.remaining is not None and self.remaining < self.pace_below and self.reset and self.reset > now and not self._exhausted(now):
+                interval = float(self.reset - now) / (self.remaining - self.reserve)
+
+            turn = max(now, self.next_turn)
+            self.next_turn = turn + interval
+
+        if turn > now:
+            sleep(turn - now)
+
+    def park(self, organization_name, code_url):
+        ''' Remember a project that couldn't be updated in this window.
+
+            Returns True if it's the first one parked.
+        '''
+        with self.lock:
+            self.parked.append(dict(organization_name=organization_name, code_url=code_url))
+            return len(self.parked) == 1
+
+    def is_stale(self, code_url):
+        ''' Return True if a project was parked by an earlier run.
+        '''
+        return code_url in [item['code_url'] for item in self.stale]
+
+    def state(self):
+        ''' Return the budget as a dictionary.
+        '''
+        with self.lock:
+            return dict(limit=self.limit, remaining=self.remaining, reset=self.reset, parked=list(self.parked))
@@ -6,20 +6,30 @@ from operator import itemgetter
 from StringIO import StringIO
 from datetime import datetime
 from urllib2 import HTTPError, URLError
-from urlparse import urlparse
+from urlparse import urlparse, urlunparse, parse_qsl
+from urllib import urlencode
 from random import shuffle
 from argparse import ArgumentParser
+from multiprocessing.pool import ThreadPool
 from time import time
+from threading import Lock
 from re import match, sub
 from psycopg2 import connect, extras
 
-from requests import get, exceptions
+from requests import exceptions, Response
+from requests.structures import CaseInsensitiveDict
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.expression import func
 from dateutil.tz import tzoffset
 import feedparser
 
 from feeds import get_first_working_feed_link
+from transport import get, configure as configure_transport, connection_stats, POOL_MAXSIZE
+from ratelimit import RateLimitScheduler
+from bulk import upsert, key_value, chunks, expire_instances, Reconciler
+from cache import bump_generation
 
-from app import db, Project, Organization, Story, Event, Error, Issue, Label, Attendance
+from app import db, refresh_geojson, Project, Organization, Story, Event, Error, Issue, Label, Attendance, GithubCache, RateLimit
 from utils import is_safe_name, safe_name, raw_name
 
 
@@ -44,6 +54,15 @@ GITHUB_REPOS_API_URL = 'https://api.github.com/repos{repo_path}'
 GITHUB_ISSUES_API_URL = 'https://api.github.com/repos{repo_path}/issues'
 GITHUB_CONTENT_API_URL = 'https://api.github.com/repos{repo_path}/contents/{file_path}'
 
+# Format of timestamps in GitHub API responses and parameters
+GITHUB_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Number of pages of GitHub lists to fetch at once, across all workers
+GITHUB_PAGE_WORKERS = int(os.environ.get('GITHUB_PAGE_WORKERS', 4))
+
+_page_pool = None
+_page_pool_lock = Lock()
+
 if 'GITHUB_TOKEN' in os.environ:
     github_auth = (os.environ['GITHUB_TOKEN'], '')
 else:
@@ -59,18 +78,90 @@ if 'PEOPLEDB' in os.environ:
 else:
     PEOPLEDB = None
 
-github_throttling = False
+# Paces GitHub requests across workers and parks projects when the budget is spent
+github_scheduler = RateLimitScheduler()
 
 def get_github_api(url, headers=None):
     '''
         Make authenticated GitHub requests.
+
+        Responses are cached by URL. When the caller hasn't made the request
+        conditional itself, the cached ETag or Last-Modified date is sent, and
+        a 304 from GitHub is answered with the cached response.
     '''
     logging.info('Asking Github for {}{}'.format(url, ' ({})'.format(headers) if headers and headers != {} else ''))
 
+    # requests drops headers set to None, do the same so we can check for them
+    headers = dict([(key, value) for (key, value) in (headers or {}).items() if value is not None])
+
+    cached = None
+    if 'If-None-Match' not in headers and 'If-Modified-Since' not in headers:
+        cached = get_cached_github_response(url)
+        if cached and cached.etag:
+            headers['If-None-Match'] = cached.etag
+        elif cached and cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+
+    github_scheduler.wait()
     got = get(url, auth=github_auth, headers=headers)
+    github_scheduler.update(got)
+
+    if got.status_code == 304 and cached:
+        logging.info('Using cached response for {}'.format(url))
+        return make_cached_github_response(cached, got)
+
+    # URLs asking for changes since some time are rarely asked for twice
+    if got.status_code == 200 and ('ETag' in got.headers or 'Last-Modified' in got.headers) and 'since=' not in url:
+        save_cached_github_response(url, got)
 
     return got
 
+def get_cached_github_response(url):
+    ''' Return the cached response for a GitHub API URL, or None.
+    '''
+    table = GithubCache.__table__
+    with db.engine.connect() as connection:
+        return connection.execute(table.select().where(table.c.url == unicode(url))).first()
+
+def save_cached_github_response(url, got):
+    ''' Save a GitHub API response to the cache.
+
+        The cache is written outside of the current session's transaction,
+        so that concurrent organization updates don't wait on each other.
+    '''
+    table = GithubCache.__table__
+    headers = dict([(key, unicode(got.headers[key])) for key in ('Content-Type', 'ETag', 'Last-Modified', 'Link') if key in got.headers])
+    values = dict(etag=got.headers.get('ETag') and unicode(got.headers['ETag']),
+                  last_modified=got.headers.get('Last-Modified') and unicode(got.headers['Last-Modified']),
+                  headers=headers, body=got.content, time=datetime.now())
+
+    try:
+        with db.engine.begin() as connection:
+            updated = connection.execute(table.update().where(table.c.url == unicode(url)).values(**values))
+            if not updated.rowcount:
+                connection.execute(table.insert().values(url=unicode(url), **values))
+    except IntegrityError:
+        # another worker cached this URL at the same time
+        pass
+
+def make_cached_github_response(cached, got):
+    ''' Build a 200 response from a cached row and GitHub's 304 response.
+    '''
+    response = Response()
+    response.status_code = 200
+    response.reason = 'OK'
+    response.url = got.url
+    response.request = got.request
+    response.headers = CaseInsensitiveDict(cached.headers)
+    response._content = cached.body
+
+    # keep the fresh rate limit headers
+    for key in got.headers:
+        if key.lower().startswith('x-ratelimit'):
+            response.headers[key] = got.headers[key]
+
+    return response
+
 def format_date(time_in_milliseconds, utc_offset_msec):
     '''
         Create a datetime object from a time in milliseconds from the epoch
@@ -95,7 +186,12 @@ def get_meetup_events(organization, group_urlname):
     '''
     meetup_url = MEETUP_API_URL.format(group_urlname=group_urlname, key=meetup_key)
 
-    got = get(meetup_url)
+    try:
+        got = get(meetup_url)
+    except exceptions.RequestException:
+        logging.error("%s's meetup page could not be reached" % organization.name)
+        return []
+
     if got.status_code in range(400, 499):
         logging.error("%s's meetup page cannot be found" % organization.name)
         return []
@@ -122,17 +218,25 @@ def get_meetup_events(organization, group_urlname):
             return []
 
 
-def get_meetup_count(organization, identifier):
-    ''' Get the count of meetup members '''
+def get_meetup_member_count(identifier):
+    ''' Get the count of meetup members, or None '''
     MEETUP_COUNT_API_URL = "https://api.meetup.com/2/groups?group_urlname={group_urlname}&key={key}"
     meetup_url = MEETUP_COUNT_API_URL.format(group_urlname=identifier, key=meetup_key)
-    got = get(meetup_url)
+    try:
+        got = get(meetup_url)
+    except exceptions.RequestException:
+        return None
     if got:
         response = got.json()
         if response:
-            members = response["results"][0]["members"]
-            organization.member_count = members
-            db.session.commit()
+            return response["results"][0]["members"]
+
+def get_meetup_count(organization, identifier):
+    ''' Save the count of meetup members '''
+    members = get_meetup_member_count(identifier)
+    if members is not None:
+        organization.member_count = members
+        db.session.commit()
 
 def get_organizations(org_sources):
     ''' Collate all organizations from different sources.
@@ -188,7 +292,7 @@ def get_stories(organization):
     try:
         logging.info('Asking cyberspace for ' + url)
         d = feedparser.parse(get(url).text)
-    except (HTTPError, URLError, exceptions.SSLError):
+    except (HTTPError, URLError, exceptions.RequestException):
         url = None
         return None
 
@@ -198,26 +302,101 @@ def get_stories(organization):
     return [dict(title=e.title, link=e.link, type=u'blog', organization_name=organization.name)
             for e in d.entries[:2]]
 
+def get_page_urls(response):
+    ''' Return the URLs of the pages after this one, or None if they can't
+        be worked out up front.
+
+        Github uses the Link header (RFC 5988) to do pagination. When it
+        links to a numbered last page, every page in between is known.
+    '''
+    if 'next' not in response.links:
+        return []
+
+    next_url = response.links['next']['url']
+    last_url = response.links.get('last', {}).get('url', '')
+    next_page = dict(parse_qsl(urlparse(next_url).query)).get('page', '')
+    last_page = dict(parse_qsl(urlparse(last_url).query)).get('page', '')
+
+    if not next_page.isdigit() or not last_page.isdigit():
+        return None
+
+    scheme, host, path, params, query, fragment = urlparse(last_url)
+    urls = []
+    for page in range(int(next_page), int(last_page) + 1):
+        page_query = urlencode([(key, page if key == 'page' else value) for (key, value) in parse_qsl(query)])
+        urls.append(urlunparse((scheme, host, path, params, page_query, fragment)))
+
+    return urls
+
+def get_page_pool():
+    ''' Return the pool of threads that fetches pages of GitHub lists,
+        shared by every worker so they don't each open their own connections.
+    '''
+    global _page_pool
+
+    with _page_pool_lock:
+        if not _page_pool:
+            _page_pool = ThreadPool(GITHUB_PAGE_WORKERS)
+
+    return _page_pool
+
+def get_github_page(url, headers=None):
+    ''' Get a later page of a paginated list from Github.
+
+        Return the response and the list on it, or None if it didn't
+        come back as a list.
+    '''
+    response = get_github_api(url, headers=headers)
+    page = response.json() if response.status_code // 100 == 2 else None
+
+    if type(page) is not list:
+        logging.error('Expected a list from %s, got status %d', url, response.status_code)
+        return response, None
+
+    return response, page
+
 def get_adjoined_json_lists(response, headers=None):
-    ''' Github uses the Link header (RFC 5988) to do pagination.
+    ''' Generate the items of a paginated list from Github, starting with
+        the given response.
 
-        If we see a Link header, assume we're dealing with lists
-        and concat them all together.
+        If we see a Link header, assume we're dealing with lists. When the
+        last page is linked, the remaining pages are fetched concurrently
+        and their items generated in order; otherwise the next links are
+        followed one at a time. Stop at the first page that isn't a list.
     '''
     result = response.json()
 
-    if type(result) is list:
-        while 'next' in response.links:
-            response = get_github_api(response.links['next']['url'], headers=headers)
-            result += response.json()
+    if type(result) is not list:
+        logging.error('Expected a list from %s', response.url)
+        return
 
-    return result
+    for item in result:
+        yield item
 
+    page_urls = get_page_urls(response)
 
-def get_projects(organization):
+    if page_urls is None:
+        while 'next' in response.links:
+            response, page = get_github_page(response.links['next']['url'], headers=headers)
+            if page is None:
+                return
+            for item in page:
+                yield item
+
+    elif page_urls:
+        for page in get_page_pool().imap(lambda url: get_github_page(url, headers=headers)[1], page_urls):
+            if page is None:
+                return
+            for item in page:
+                yield item
+
+def get_projects(organization, reconciler=None, record_error=None):
     '''
         Get a list of projects from CSV, TSV, JSON, or Github URL.
         Convert to a dict.
+        Projects that haven't changed aren't returned, but are reported
+        to the reconciler, if there is one. Errors are saved with
+        record_error(message), if given.
         TODO: Have this work for GDocs.
     '''
 
@@ -240,7 +419,7 @@ def get_projects(organization):
             if not response.status_code // 100 == 2:
                 return []
 
-            projects = get_adjoined_json_lists(response)
+            projects = list(get_adjoined_json_lists(response))
 
         except exceptions.RequestException:
             # Something has gone wrong, probably a bad URL or site is down.
@@ -306,8 +485,9 @@ def get_projects(organization):
                 if key not in ['name', 'description', 'link_url', 'code_url', 'type', 'categories', 'tags', 'organization_name', 'status']:
                     del project[key]
 
-    # Get any updates on the projects
-    projects = [update_project_info(proj) for proj in projects]
+    # Get any updates on the projects, starting with any parked by an earlier run
+    projects.sort(key=lambda proj: not github_scheduler.is_stale(proj.get('code_url')))
+    projects = [update_project_info(proj, reconciler, record_error) for proj in projects]
 
     # Drop projects with no updates
     projects = filter(None, projects)
@@ -363,7 +543,24 @@ def non_github_project_update_time(project):
 
     return project
 
-def update_project_info(project):
+def save_error(message):
+    ''' Record an error, committing it right away.
+    '''
+    db.session.add(Error(error=message, time=datetime.now()))
+    db.session.commit()
+
+def park_project(project, record_error=None):
+    ''' Leave a project alone until the GitHub rate limit resets,
+        recording an error the first time this happens in a run.
+
+        The error is saved with record_error(message), if given.
+    '''
+    if github_scheduler.park(project['organization_name'], project['code_url']):
+        (record_error or save_error)(u'IOError: We done got throttled by GitHub')
+
+    return project
+
+def update_project_info(project, reconciler=None, record_error=None):
     ''' Update info from Github, if it's missing.
 
         Modify the project in-place and return nothing.
@@ -373,6 +570,9 @@ def update_project_info(project):
 
         Github_details is specifically expected to be used on this page:
         http://opengovhacknight.org/projects.html
+
+        Projects that haven't changed are reported to the reconciler, and
+        errors are saved with record_error(message), if given.
     '''
     if 'code_url' not in project or not project['code_url']:
         project = non_github_project_update_time(project)
@@ -389,10 +589,9 @@ def update_project_info(project):
         path = sub(r"[\ /]+\s*$", "", path)
         repo_url = GITHUB_REPOS_API_URL.format(repo_path=path)
 
-        # If we've hit the GitHub rate limit, skip updating projects.
-        global github_throttling
-        if github_throttling:
-            return project
+        # If we've spent the GitHub rate limit, park the project until the next run.
+        if not github_scheduler.available():
+            return park_project(project, record_error)
 
         # find an existing project, filtering on code_url, organization_name, and project name (if we know it)
         existing_filter = [Project.code_url == project['code_url'], Project.organization_name == project['organization_name']]
@@ -437,16 +636,8 @@ def update_project_info(project):
                 return None
             elif got.status_code == 403:
                 logging.error("GitHub Rate Limit Remaining: " + str(got.headers["x-ratelimit-remaining"]))
-                error_dict = {
-                    "error": u'IOError: We done got throttled by GitHub',
-                    "time": datetime.now()
-                }
-                new_error = Error(**error_dict)
-                db.session.add(new_error)
-                # commit the error
-                db.session.commit()
-                github_throttling = True
-                return project
+                github_scheduler.exhaust()
+                return park_project(project, record_error)
 
             else:
                 raise IOError
@@ -466,11 +657,8 @@ def update_project_info(project):
                 return project
 
             # nothing was updated, but make sure we keep the project
-            # :::here (project/true)
-            existing_project.keep = True
-            db.session.add(existing_project)
-            # commit the project
-            db.session.commit()
+            if reconciler:
+                reconciler.see(Project, [existing_project.id])
             return None
 
         all_github_attributes = got.json()
@@ -638,21 +826,29 @@ def get_issues_for_project(project):
 
     return issues
 
-def get_issues(org_name):
+def get_issues(org_name, reconciler=None, incremental=False, project_changes=None):
     '''
         Get github issues associated to each Organization's Projects.
+        Issues of projects that haven't changed are reported to the
+        reconciler, if there is one.
+
+        The issue ETag and high-water mark of each project that changed
+        are set on it, and also added to project_changes, if given, as
+        dictionaries of id, last_updated_issues and issues_updated_at.
+
+        With incremental set, projects that have been updated before
+        only ask for issues updated since their latest one, open or closed.
+        Stored issues that didn't come back are left as they are.
     '''
     issues = []
+    unchanged_project_ids = []
+    changed_urls = {}
 
     # Only grab this organization's projects
     projects = db.session.query(Project).filter(Project.organization_name == org_name).all()
 
     # Populate issues for each project
     for project in projects:
-        # Mark this project's issues for deletion
-        # :::here (issue/false)
-        db.session.execute(db.update(Issue, values={'keep': False}).where(Issue.project_id == project.id))
-
         # don't try to parse an empty code_url
         if not project.code_url:
             continue
@@ -664,17 +860,27 @@ def get_issues(org_name):
         if host != 'github.com':
             continue
 
+        # Keep the existing issues if we've spent the GitHub rate limit
+        if not github_scheduler.available():
+            unchanged_project_ids.append(project.id)
+            logging.info('Keeping issues for %s until the GitHub rate limit resets', project.name)
+            continue
+
         path = sub(r"[\ /]+\s*$", "", path)
         issues_url = GITHUB_ISSUES_API_URL.format(repo_path=path)
 
+        since_last = incremental and project.issues_updated_at
+        if since_last:
+            since = datetime.strftime(project.issues_updated_at, GITHUB_TIME_FORMAT)
+            issues_url += '?' + urlencode([('since', since), ('state', 'all')])
+
         # Ping github's api for project issues
         # :TODO: non-github projects are hitting here and shouldn't be!
         got = get_github_api(issues_url, headers={'If-None-Match': project.last_updated_issues})
 
         # Verify that content has not been modified since last run
         if got.status_code == 304:
-            # :::here (issue/true)
-            db.session.execute(db.update(Issue, values={'keep': True}).where(Issue.project_id == project.id))
+            unchanged_project_ids.append(project.id)
             logging.info('Issues %s have not changed since last update', issues_url)
 
         elif got.status_code not in range(400, 499):
@@ -683,20 +889,54 @@ def get_issues(org_name):
             db.session.add(project)
 
             responses = get_adjoined_json_lists(got, headers={'If-None-Match': project.last_updated_issues})
+            updated, html_urls = [], []
 
             # Save each issue in response
             for issue in responses:
                 # Type check the issue, we are expecting a dictionary
                 if isinstance(issue, dict):
+                    if issue.get('updated_at'):
+                        updated.append(issue['updated_at'])
+                    html_urls.append(issue['html_url'])
+
                     # Pull requests are returned along with issues. Skip them.
                     if "/pull/" in issue['html_url']:
                         continue
+                    # Closed issues only come back from incremental fetches, and are dropped.
+                    if issue.get('state') == 'closed':
+                        continue
                     issue_dict = dict(title=issue['title'], html_url=issue['html_url'],
                                       body=issue['body'], project_id=project.id, labels=issue['labels'],
                                       created_at=issue['created_at'], updated_at=issue['updated_at'])
                     issues.append(issue_dict)
                 else:
                     logging.error('Issue for project %s is not a dictionary', project.name)
+
+            # Remember the latest update for the next incremental fetch
+            if updated:
+                project.issues_updated_at = datetime.strptime(max(updated), GITHUB_TIME_FORMAT)
+
+            if since_last:
+                changed_urls[project.id] = html_urls
+
+            if project_changes is not None:
+                project_changes.append(dict(id=project.id, last_updated_issues=project.last_updated_issues,
+                                            issues_updated_at=project.issues_updated_at))
+
+    # Keep the stored issues of unchanged projects
+    if reconciler and unchanged_project_ids:
+        unchanged_issues = db.session.query(Issue.id).filter(Issue.project_id.in_(unchanged_project_ids))
+        reconciler.see(Issue, [issue_id for (issue_id,) in unchanged_issues])
+
+    # Keep the stored issues of incrementally fetched projects that didn't
+    # come back; the ones that did are saved again or, if closed, dropped.
+    if reconciler:
+        for (project_id, html_urls) in changed_urls.items():
+            filter = [Issue.project_id == project_id]
+            if html_urls:
+                filter.append(~Issue.html_url.in_(html_urls))
+            reconciler.see(Issue, [issue_id for (issue_id,) in db.session.query(Issue.id).filter(*filter)])
+
     return issues
 
 def get_root_directory_listing_for_project(project_dict, force=False):
@@ -860,128 +1100,82 @@ def save_organization_info(session, org_dict):
 
     return existing_org
 
-def save_project_info(session, proj_dict):
-    ''' Save a dictionary of project info to the datastore session.
-
-        Return an app.Project instance.
+def save_issues(session, issues, reconciler=None):
     '''
-    # Select the current project, filtering on name AND organization.
-    filter = Project.name == proj_dict['name'], Project.organization_name == proj_dict['organization_name']
-    existing_project = session.query(Project).filter(*filter).first()
-
-    # If this is a new project, save and return it.
-    if not existing_project:
-        new_project = Project(**proj_dict)
-        session.add(new_project)
-        return new_project
-
-    # Preserve the existing project
-    # :::here (project/true)
-    existing_project.keep = True
+        Save a list of issue dictionaries to the datastore session in bulk,
+        setting the id of each one for sync_labels().
+        Return a dictionary of (title, project_id) to issue ids.
+    '''
+    project_ids = set([issue['project_id'] for issue in issues])
+    ids = upsert(session, Issue, issues, ('title', 'project_id'), Issue.project_id.in_(project_ids), reconciler)
 
-    # Update existing project details
-    for (field, value) in proj_dict.items():
-        setattr(existing_project, field, value)
+    for issue in issues:
+        issue['id'] = ids[(key_value(issue['title']), issue['project_id'])]
 
-    return existing_project
+    return ids
 
-def save_issue(session, issue):
-    '''
-        Save a dictionary of issue info to the datastore session.
-        Return an app.Issue instance
-    '''
-    # Select the current issue, filtering on title AND project_id.
-    filter = Issue.title == issue['title'], Issue.project_id == issue['project_id']
-    existing_issue = session.query(Issue).filter(*filter).first()
-
-    # If this is a new issue save it
-    if not existing_issue:
-        new_issue = Issue(**issue)
-        session.add(new_issue)
-    else:
-        # Preserve the existing issue.
-        # :::here (issue/true)
-        existing_issue.keep = True
-        # Update existing issue details
-        existing_issue.title = issue['title']
-        existing_issue.body = issue['body']
-        existing_issue.html_url = issue['html_url']
-        existing_issue.project_id = issue['project_id']
-
-def save_labels(session, issue):
-    '''
-        Save labels to issues
-    '''
-    # Select the current issue, filtering on title AND project_id.
-    filter = Issue.title == issue['title'], Issue.project_id == issue['project_id']
-    existing_issue = session.query(Issue).filter(*filter).first()
-
-    # Get list of existing and incoming label names (dupes will be filtered out in comparison process)
-    existing_label_names = [label.name for label in existing_issue.labels]
-    incoming_label_names = [label['name'] for label in issue['labels']]
-
-    # Add labels that are in the incoming list and not the existing list
-    add_label_names = list(set(incoming_label_names) - set(existing_label_names))
-    for label_dict in issue['labels']:
-        if label_dict['name'] in add_label_names:
-            # add the issue id to the labels
-            label_dict["issue_id"] = existing_issue.id
-            new_label = Label(**label_dict)
-            session.add(new_label)
-
-    # Delete labels that are not in the incoming list but are in the existing list
-    delete_label_names = list(set(existing_label_names) - set(incoming_label_names))
-    for label_name in delete_label_names:
-        session.query(Label).filter(Label.issue_id == existing_issue.id, Label.name == label_name).delete()
-
-def save_event_info(session, event_dict):
-    '''
-        Save a dictionary of event into to the datastore session then return
-        that event instance
+def sync_labels(session, issues):
     '''
-    # Select the current event, filtering on event_url and organization name.
-    filter = Event.event_url == event_dict['event_url'], \
-        Event.organization_name == event_dict['organization_name']
-    existing_event = session.query(Event).filter(*filter).first()
-
-    # If this is a new event, save and return it.
-    if not existing_event:
-        new_event = Event(**event_dict)
-        session.add(new_event)
-        return new_event
-
-    # Preserve the existing event.
-    # :::here (event/true)
-    existing_event.keep = True
-
-    # Update existing event details
-    for (field, value) in event_dict.items():
-        setattr(existing_event, field, value)
-
-def save_story_info(session, story_dict):
+        Save the labels of a list of saved issues in bulk. Existing labels
+        are loaded in one query and compared with the incoming ones, then
+        new labels are inserted and stale ones deleted in one statement each.
     '''
-        Save a dictionary of story into to the datastore session then return
-        that story instance
+    # the last copy of an issue wins, like saving them one at a time
+    incoming = dict([(issue['id'], set([label['name'] for label in issue['labels']])) for issue in issues])
+    if not incoming:
+        return
+
+    existing = {}
+    stale_ids = []
+    query = session.query(Label.id, Label.issue_id, Label.name).filter(Label.issue_id.in_(incoming.keys()))
+    for (label_id, issue_id, name) in query:
+        existing.setdefault(issue_id, set()).add(name)
+        if name not in incoming[issue_id]:
+            stale_ids.append(label_id)
+
+    new_labels, added = [], set()
+    for issue in issues:
+        for label_dict in issue['labels']:
+            key = issue['id'], label_dict['name']
+            if label_dict['name'] in existing.get(issue['id'], ()) or key in added:
+                continue
+            if label_dict['name'] not in incoming[issue['id']]:
+                continue
+            added.add(key)
+            new_labels.append(dict(name=label_dict['name'], color=label_dict['color'], url=label_dict['url'], issue_id=issue['id']))
+
+    table = Label.__table__
+    for chunk in chunks(new_labels):
+        session.execute(table.insert().values(chunk))
+    for chunk in chunks(stale_ids):
+        session.execute(table.delete().where(table.c.id.in_(chunk)))
+
+    expire_instances(session, Issue)
+    expire_instances(session, Label)
+
+def save_projects_info(session, proj_dicts, reconciler=None):
+    ''' Save a list of project dictionaries to the datastore session in bulk.
+
+        Return a dictionary of (name, organization_name) to project ids.
     '''
-    # Select the current story, filtering on link and organization name.
-    filter = Story.organization_name == story_dict['organization_name'], \
-        Story.link == story_dict['link']
+    org_names = set([proj_dict['organization_name'] for proj_dict in proj_dicts])
+    return upsert(session, Project, proj_dicts, ('name', 'organization_name'), Project.organization_name.in_(org_names), reconciler)
 
-    existing_story = session.query(Story).filter(*filter).first()
+def save_events_info(session, event_dicts, reconciler=None):
+    ''' Save a list of event dictionaries to the datastore session in bulk.
 
-    # If this is a new story, save and return it.
-    if not existing_story:
-        new_story = Story(**story_dict)
-        session.add(new_story)
-        return new_story
+        Return a dictionary of (event_url, organization_name) to event ids.
+    '''
+    org_names = set([event_dict['organization_name'] for event_dict in event_dicts])
+    return upsert(session, Event, event_dicts, ('event_url', 'organization_name'), Event.organization_name.in_(org_names), reconciler)
 
-    # Preserve the existing story.
-    # :::here (story/true)
-    existing_story.keep = True
+def save_stories_info(session, story_dicts, reconciler=None):
+    ''' Save a list of story dictionaries to the datastore session in bulk.
 
-    # Update existing story details
-    for (field, value) in story_dict.items():
-        setattr(existing_story, field, value)
+        Return a dictionary of (link, organization_name) to story ids.
+    '''
+    org_names = set([story_dict['organization_name'] for story_dict in story_dicts])
+    return upsert(session, Story, story_dicts, ('link', 'organization_name'), Story.organization_name.in_(org_names), reconciler)
 
 def get_event_group_identifier(events_url):
     parse_result = urlparse(events_url)
@@ -1038,18 +1232,171 @@ def update_attendance(db, organization_name, attendance):
     else:
         new_att = Attendance(**attendance)
         db.session.add(new_att)
+    db.session.flush()
+
+
+def load_github_budget():
+    ''' Restore the GitHub rate limit budget saved at the end of the last run.
+    '''
+    budget = db.session.query(RateLimit).filter(RateLimit.resource == u'github').first()
+    if budget:
+        github_scheduler.load(budget.limit, budget.remaining, budget.reset, budget.parked or [])
+
+def save_github_budget():
+    ''' Save the GitHub rate limit budget and parked projects for the next run,
+        and for the status endpoint.
+    '''
+    state = github_scheduler.state()
+    budget = db.session.query(RateLimit).filter(RateLimit.resource == u'github').first()
+    if not budget:
+        budget = RateLimit(resource=u'github')
+        db.session.add(budget)
+
+    budget.limit = state['limit']
+    budget.remaining = state['remaining']
+    budget.reset = state['reset']
+    budget.parked = state['parked']
+    budget.updated = int(time())
     db.session.commit()
 
+    if state['parked']:
+        logging.info('%d projects parked until the GitHub rate limit resets', len(state['parked']))
+
+def shuffle_issues(session):
+    ''' Give every issue a new place in the shuffled order the API lists them in.
+    '''
+    session.execute(Issue.__table__.update().values(shuffle_key=func.random()))
+
+def delete_unseen_rows(session, organization_name, reconciler):
+    ''' Remove everything belonging to an organization that the reconciler
+        didn't see, with one statement per table. Labels go along with
+        their issues.
+    '''
+    # :::here (event/delete, story/delete, project/delete, issue/delete)
+    project_ids = session.query(Project.id).filter(Project.organization_name == organization_name).subquery()
+    reconciler.delete_unseen(session, Event, Event.organization_name == organization_name)
+    reconciler.delete_unseen(session, Story, Story.organization_name == organization_name)
+    reconciler.delete_unseen(session, Issue, Issue.project_id.in_(project_ids))
+    reconciler.delete_unseen(session, Project, Project.organization_name == organization_name)
+
+def update_organization(org_info, incremental=False):
+    ''' Update one organization and everything that belongs to it,
+        optionally fetching only the issues changed since the last update.
+
+        Return the organization's name, or None if it was skipped.
+    '''
+    if not is_safe_name(org_info['name']):
+        error_dict = {
+            "error": unicode('ValueError: Bad organization name: "%s"' % org_info['name']),
+            "time": datetime.now()
+        }
+        new_error = Error(**error_dict)
+        db.session.add(new_error)
+        # commit the error
+        db.session.commit()
+        return None
+
+    try:
+        # Keep track of everything we see for this organization
+        reconciler = Reconciler()
+
+        # Empty lat longs are okay.
+        if 'latitude' in org_info:
+            if not org_info['latitude']:
+                org_info['latitude'] = None
+        if 'longitude' in org_info:
+            if not org_info['longitude']:
+                org_info['longitude'] = None
+
+        organization = save_organization_info(db.session, org_info)
+
+        # flush the organization
+        db.session.flush()
+
+        if organization.rss or organization.website:
+            logging.info("Gathering all of %s's stories." % organization.name)
+            stories = get_stories(organization)
+            if stories:
+                save_stories_info(db.session, stories, reconciler)
+
+        if organization.projects_list_url:
+            logging.info("Gathering all of %s's projects." % organization.name)
+            projects = get_projects(organization, reconciler)
+            save_projects_info(db.session, projects, reconciler)
+
+        if organization.events_url:
+            if not meetup_key:
+                logging.error("No Meetup.com key set.")
+            if 'meetup.com' not in organization.events_url:
+                logging.error("Only Meetup.com events work right now.")
+            else:
+                logging.info("Gathering all of %s's events." % organization.name)
+                identifier = get_event_group_identifier(organization.events_url)
+                if identifier:
+                    save_events_info(db.session, get_meetup_events(organization, identifier), reconciler)
+
+                    # Get Meetup member count
+                    get_meetup_count(organization, identifier)
+
+                else:
+                    logging.error("%s does not have a valid events url" % organization.name)
+
+        # Get issues for all of the projects
+        logging.info("Gathering all of %s's open GitHub issues." % organization.name)
+        issues = get_issues(organization.name, reconciler, incremental)
+        save_issues(db.session, issues, reconciler)
+        sync_labels(db.session, issues)
+
+        # Get attendance data
+        with connect(PEOPLEDB) as conn:
+            with conn.cursor(cursor_factory=extras.RealDictCursor) as peopledb:
+                cfapi_url = "https://www.codeforamerica.org/api/organizations/"
+                organization_url = cfapi_url + organization.api_id()
+                attendance = get_attendance(peopledb, organization_url, organization.name)
 
-def main(org_name=None, org_sources=None):
+        if attendance:
+            update_attendance(db, organization.name, attendance)
+
+        # commit everything
+        db.session.commit()
+
+        delete_unseen_rows(db.session, organization.name, reconciler)
+        # commit the deletes
+        db.session.commit()
+
+    except:
+        # Raise the error, get out of main(), and don't commit the transaction.
+        raise
+
+    else:
+        # Commit and move on to the next organization.
+        # final commit before moving on to the next organization
+        db.session.commit()
+
+    return organization.name
+
+def update_organization_in_worker(org_info, incremental=False):
+    ''' Update one organization from a worker thread.
+
+        db.session is scoped to the current thread, so each worker gets its
+        own session and transaction; release it when the work is done.
+    '''
+    try:
+        return update_organization(org_info, incremental)
+    finally:
+        db.session.remove()
+
+def main(org_name=None, org_sources=None, workers=1, incremental=False, use_async=False):
     ''' Run update over all organizations. Optionally, update just one.
+
+        With more than one worker, organizations are updated concurrently.
+        With incremental set, only issues changed since the last run are fetched.
+        With use_async set, organizations are fetched by the pipelined engine,
+        using workers as the number of fetchers if there's more than one.
     '''
     # set org_sources
     org_sources = org_sources or ORG_SOURCES_FILENAME
 
-    # Collect a set of fresh organization names.
-    organization_names = set()
-
     # Retrieve all organizations and shuffle the list in place.
     orgs_info = get_organizations(org_sources)
     shuffle(orgs_info)
@@ -1057,127 +1404,32 @@ def main(org_name=None, org_sources=None):
     if org_name:
         orgs_info = [org for org in orgs_info if org['name'] == org_name]
 
-    # Iterate over organizations and projects, saving them to db.session.
-    for org_info in orgs_info:
-
-        if not is_safe_name(org_info['name']):
-            error_dict = {
-                "error": unicode('ValueError: Bad organization name: "%s"' % org_info['name']),
-                "time": datetime.now()
-            }
-            new_error = Error(**error_dict)
-            db.session.add(new_error)
-            # commit the error
-            db.session.commit()
-            continue
-
-        try:
-            filter = Organization.name == org_info['name']
-            existing_org = db.session.query(Organization).filter(filter).first()
-            organization_names.add(org_info['name'])
-
-            # Mark everything associated with this organization for deletion at first.
-            # :::here (event/false, story/false, project/false, organization/false)
-            db.session.execute(db.update(Event, values={'keep': False}).where(Event.organization_name == org_info['name']))
-            db.session.execute(db.update(Story, values={'keep': False}).where(Story.organization_name == org_info['name']))
-            db.session.execute(db.update(Project, values={'keep': False}).where(Project.organization_name == org_info['name']))
-            db.session.execute(db.update(Organization, values={'keep': False}).where(Organization.name == org_info['name']))
-            # commit the false keeps
-            db.session.commit()
+    # Update organizations with projects parked by the last run first.
+    load_github_budget()
+    stale_names = [item['organization_name'] for item in github_scheduler.stale]
+    orgs_info.sort(key=lambda org: org['name'] not in stale_names)
 
-            # Empty lat longs are okay.
-            if 'latitude' in org_info:
-                if not org_info['latitude']:
-                    org_info['latitude'] = None
-            if 'longitude' in org_info:
-                if not org_info['longitude']:
-                    org_info['longitude'] = None
-
-            organization = save_organization_info(db.session, org_info)
-
-            organization_names.add(organization.name)
-            # flush the organization
-            db.session.flush()
-
-            if organization.rss or organization.website:
-                logging.info("Gathering all of %s's stories." % organization.name)
-                stories = get_stories(organization)
-                if stories:
-                    for story_info in stories:
-                        save_story_info(db.session, story_info)
-                    # flush the stories
-                    db.session.flush()
-
-            if organization.projects_list_url:
-                logging.info("Gathering all of %s's projects." % organization.name)
-                projects = get_projects(organization)
-                for proj_dict in projects:
-                    save_project_info(db.session, proj_dict)
-                # flush the projects
-                db.session.flush()
-
-            if organization.events_url:
-                if not meetup_key:
-                    logging.error("No Meetup.com key set.")
-                if 'meetup.com' not in organization.events_url:
-                    logging.error("Only Meetup.com events work right now.")
-                else:
-                    logging.info("Gathering all of %s's events." % organization.name)
-                    identifier = get_event_group_identifier(organization.events_url)
-                    if identifier:
-                        for event in get_meetup_events(organization, identifier):
-                            save_event_info(db.session, event)
-                        # flush the events
-                        db.session.flush()
-
-                        # Get Meetup member count
-                        get_meetup_count(organization, identifier)
-
-                    else:
-                        logging.error("%s does not have a valid events url" % organization.name)
-
-            # Get issues for all of the projects
-            logging.info("Gathering all of %s's open GitHub issues." % organization.name)
-            issues = get_issues(organization.name)
-            for issue in issues:
-                save_issue(db.session, issue)
-
-            # flush the issues
-            db.session.flush()
-            for issue in issues:
-                save_labels(db.session, issue)
-
-            # Get attendance data
-            with connect(PEOPLEDB) as conn:
-                with conn.cursor(cursor_factory=extras.RealDictCursor) as peopledb:
-                    cfapi_url = "https://www.codeforamerica.org/api/organizations/"
-                    organization_url = cfapi_url + organization.api_id()
-                    attendance = get_attendance(peopledb, organization_url, organization.name)
-
-            if attendance:
-                update_attendance(db, organization.name, attendance)
-
-            # commit everything
-            db.session.commit()
+    # Keep enough connections alive per host for every worker, and for
+    # the threads fetching pages of GitHub lists for them.
+    if workers + GITHUB_PAGE_WORKERS > POOL_MAXSIZE:
+        configure_transport(pool_maxsize=workers + GITHUB_PAGE_WORKERS)
 
-            # Remove everything marked for deletion.
-            # :::here (event/delete, story/delete, project/delete, issue/delete, organization/delete)
-            db.session.query(Event).filter(Event.keep == False).delete()
-            db.session.query(Story).filter(Story.keep == False).delete()
-            db.session.query(Issue).filter(Issue.keep == False).delete()
-            db.session.query(Project).filter(Project.keep == False).delete()
-            db.session.query(Organization).filter(Organization.keep == False).delete()
-            # commit objects deleted for keep=False
-            db.session.commit()
-
-        except:
-            # Raise the error, get out of main(), and don't commit the transaction.
-            raise
+    # Iterate over organizations and projects, saving them to db.session.
+    if use_async:
+        from engine import update_organizations
+        updated_names = update_organizations(orgs_info, workers if workers > 1 else None, incremental)
+    elif workers > 1:
+        pool = ThreadPool(workers)
+        try:
+            updated_names = pool.map(lambda org_info: update_organization_in_worker(org_info, incremental), orgs_info, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        updated_names = [update_organization(org_info, incremental) for org_info in orgs_info]
 
-        else:
-            # Commit and move on to the next organization.
-            # final commit before moving on to the next organization
-            db.session.commit()
+    # Collect a set of fresh organization names.
+    organization_names = set([name for name in updated_names if name])
 
     # prune orphaned organizations if no organization name was passed
     if not org_name:
@@ -1190,11 +1442,27 @@ def main(org_name=None, org_sources=None):
             # commit for deleting orphaned organizations
             db.session.commit()
 
+    # reshuffle issues once per run, so their order holds still in between
+    shuffle_issues(db.session)
+    # let the API know its cached responses are out of date
+    bump_generation(db.session)
+    db.session.commit()
+
+    # rebuild the responses that are built ahead of time
+    refresh_geojson(db.session)
+
+    save_github_budget()
+
+    logging.info('HTTP connections: %(opened)d opened, %(reused)d reused for %(requests)d requests' % connection_stats())
+
 parser = ArgumentParser(description='''Update database from CSV source URL.''')
 parser.add_argument('--name', dest='name', help='Single organization name to update.')
 parser.add_argument('--test', action='store_const', dest='org_sources', const=TEST_ORG_SOURCES_FILENAME, help='Use the testing list of organizations.')
+parser.add_argument('--workers', dest='workers', type=int, default=1, help='Number of organizations to update concurrently.')
+parser.add_argument('--incremental-issues', dest='incremental', action='store_true', help='Only fetch GitHub issues updated since the last run.')
+parser.add_argument('--async', dest='use_async', action='store_true', help='Fetch many organizations at once and write to the database from a single thread.')
 
 if __name__ == "__main__":
     args = parser.parse_args()
     org_name = args.name and args.name.decode('utf8') or ''
-    main(org_name=org_name, org_sources=args.org_sources)
+    main(org_name=org_name, org_sources=args.org_sources, workers=args.workers, incremental=args.incremental, use_async=args.use_async)
@@ -1,5 +1,7 @@
 import unittest
+from sqlalchemy import event
 from app import app, db
+import cache
 
 class IntegrationTest(unittest.TestCase):
 
@@ -9,8 +11,26 @@ class IntegrationTest(unittest.TestCase):
         app.config['SQLALCHEMY_DATABASE_URI'] = 'postgres:///civic_json_worker_test'
         db.create_all()
         self.app = app.test_client()
+        # responses change from one request to the next in tests
+        cache.configure(size=0)
 
 
     def tearDown(self):
         db.session.close()
         db.drop_all()
+
+    def get_with_statements(self, url, headers=None):
+        ''' Get a url, returning the response and the SQL statements it ran
+        '''
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.app.get(url, headers=headers)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+        return response, statements
@@ -41,6 +41,294 @@ class TestApi(IntegrationTest):
         self.assertNotIn('first', response['pages'])
         self.assertNotIn('prev', response['pages'])
 
+    def test_pagination_count_modes(self):
+        ''' Totals can be counted exactly, estimated, or left out
+        '''
+        from urlparse import parse_qs
+
+        for number in range(5):
+            ProjectFactory(name=u'Project %d' % number)
+        db.session.commit()
+
+        response = json.loads(self.app.get('/api/projects?per_page=2&page=2').data)
+        self.assertEqual(response['total'], 5)
+        self.assertEqual(len(response['objects']), 2)
+        self.assertEqual(parse_qs(urlparse(response['pages']['last']).query)['page'], ['3'])
+
+        # past the last page, the total is still counted
+        response = json.loads(self.app.get('/api/projects?per_page=2&page=4').data)
+        self.assertEqual(response['total'], 5)
+        self.assertEqual(response['objects'], [])
+
+        response = json.loads(self.app.get('/api/projects?per_page=2&count=estimate').data)
+        self.assertIsInstance(response['total'], int)
+        self.assertEqual(len(response['objects']), 2)
+        self.assertIn('next', response['pages'])
+        self.assertEqual(parse_qs(urlparse(response['pages']['next']).query)['count'], ['estimate'])
+
+        response = json.loads(self.app.get('/api/projects?per_page=2&page=2&count=none').data)
+        self.assertIsNone(response['total'])
+        self.assertEqual(len(response['objects']), 2)
+        self.assertNotIn('last', response['pages'])
+        self.assertEqual(parse_qs(urlparse(response['pages']['next']).query), dict(page=['3'], per_page=['2'], count=['none']))
+
+        response = json.loads(self.app.get('/api/projects?per_page=2&page=3&count=none').data)
+        self.assertEqual(len(response['objects']), 1)
+        self.assertNotIn('next', response['pages'])
+
+        # ids only
+        response = json.loads(self.app.get('/api/projects?per_page=2&only_ids=true').data)
+        self.assertEqual(response['total'], 5)
+        self.assertTrue(all([isinstance(id, int) for id in response['objects']]))
+
+        response = json.loads(self.app.get('/api/projects?per_page=2&only_ids=true&count=none').data)
+        self.assertTrue(all([isinstance(id, int) for id in response['objects']]))
+
+    def relative_url(self, url):
+        ''' Return a page link without its scheme and host, for the test client
+        '''
+        _, _, path, _, query, _ = urlparse(url)
+        return '%s?%s' % (path, query)
+
+    def walk_cursor_pages(self, url):
+        ''' Follow next links from a cursor-paged url, returning every object seen
+        '''
+        objects = []
+        while url and len(objects) < 100:
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, 200)
+            response = json.loads(response.data)
+            objects.extend(response['objects'])
+            url = response['pages'].get('next') and self.relative_url(response['pages']['next'])
+
+        return objects
+
+    def test_cursor_pagination(self):
+        ''' Cursor pages follow the same order as numbered pages, without
+            gaps or repeats, including ties and missing sort values
+        '''
+        from datetime import datetime
+        from urlparse import parse_qs
+
+        last_updated = [datetime(2015, 1, 1), datetime(2015, 1, 1), None, datetime(2014, 1, 1),
+                        datetime(2016, 1, 1), None, datetime(2015, 1, 1)]
+        for (number, updated) in enumerate(last_updated):
+            ProjectFactory(name=u'Project %d' % number, last_updated=updated)
+
+        organization = OrganizationFactory()
+        for number in range(5):
+            StoryFactory(organization_name=organization.name)
+        for number in range(5):
+            EventFactory(organization_name=organization.name, start_time_notz=datetime(2014, 1, 1 + number % 3))
+        db.session.commit()
+
+        for url in ('/api/projects', '/api/projects?sort_dir=asc', '/api/stories',
+                    '/api/events/past_events', '/api/organizations/%s/past_events' % organization.api_id()):
+            numbered = json.loads(self.app.get(url + ('&' if '?' in url else '?') + 'per_page=100').data)['objects']
+            cursored = self.walk_cursor_pages(url + ('&' if '?' in url else '?') + 'per_page=2&cursor=')
+            self.assertEqual(sorted([o['id'] for o in cursored]), sorted([o['id'] for o in numbered]), url)
+
+            # numbered pages don't break ties, so compare the sort values
+            sort_key = dict(projects='last_updated', stories='id', past_events='start_time')[url.split('?')[0].split('/')[-1]]
+            self.assertEqual([o[sort_key] for o in cursored], [o[sort_key] for o in numbered], url)
+
+        # relevance is compared as the real it is, so ties don't repeat
+        cursored = self.walk_cursor_pages('/api/projects?q=description&per_page=2&cursor=')
+        self.assertEqual(sorted([o['name'] for o in cursored]), [u'Project %d' % number for number in range(7)])
+
+        # cursor pages link back to the first, and don't count unless asked
+        response = json.loads(self.app.get('/api/projects?per_page=2&cursor=').data)
+        self.assertIsNone(response['total'])
+        self.assertNotIn('first', response['pages'])
+        self.assertNotIn('last', response['pages'])
+
+        response = json.loads(self.app.get(self.relative_url(response['pages']['next']) + '&count=exact').data)
+        self.assertEqual(response['total'], 7)
+        self.assertEqual(parse_qs(urlparse(response['pages']['first']).query, keep_blank_values=True)['cursor'], [''])
+
+        # a bad cursor is a bad request
+        response = self.app.get('/api/projects?cursor=nonsense')
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_pagination_issues(self):
+        ''' Issues, including ones filtered by labels, can be paged by cursor
+        '''
+        project = ProjectFactory()
+        db.session.flush()
+
+        for number in range(5):
+            issue = IssueFactory(project_id=project.id)
+            issue.labels = [LabelFactory(name=u'hack')]
+        db.session.commit()
+
+        for url in ('/api/issues', '/api/issues/labels/hack', '/api/organizations/%s/issues/labels/hack' % project.organization.api_id()):
+            numbered = json.loads(self.app.get(url + '?per_page=100').data)['objects']
+            cursored = self.walk_cursor_pages(url + '?per_page=2&cursor=')
+            self.assertEqual(len(cursored), 5)
+            self.assertEqual([o['id'] for o in cursored], [o['id'] for o in numbered])
+
+    def test_streamed_pages(self):
+        ''' Streamed pages have the same results and links as the rest
+        '''
+        from datetime import datetime
+        import app
+
+        organization = OrganizationFactory()
+        for number in range(5):
+            project = ProjectFactory(organization_name=organization.name, name=u'Project %d' % number, last_updated=datetime(2015, 1, 1 + number))
+            db.session.flush()
+            issue = IssueFactory(project_id=project.id)
+            issue.labels = [LabelFactory()]
+        db.session.commit()
+
+        urls = ['/api/projects?per_page=3', '/api/projects?per_page=3&page=2', '/api/projects?per_page=3&count=none',
+                '/api/projects?per_page=3&page=3&count=none', '/api/projects?per_page=3&count=estimate',
+                '/api/projects?per_page=3&cursor=', '/api/projects?per_page=5&cursor=', '/api/projects?per_page=3&only_ids=true',
+                '/api/issues?per_page=3', '/api/organizations', '/api/organizations/%s/projects' % organization.api_id()]
+        expected = [json.loads(self.app.get(url).data) for url in urls]
+
+        stream_per_page, stream_chunk = app.STREAM_PER_PAGE, app.STREAM_CHUNK
+        app.STREAM_PER_PAGE, app.STREAM_CHUNK = 1, 2
+        try:
+            for (url, expected_response) in zip(urls, expected):
+                response = self.app.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.mimetype, 'application/json')
+                self.assertEqual(json.loads(response.data), expected_response, url)
+        finally:
+            app.STREAM_PER_PAGE, app.STREAM_CHUNK = stream_per_page, stream_chunk
+
+    def test_sparse_fieldsets(self):
+        ''' Objects can be limited to some fields, loading only what they need
+        '''
+        from urlparse import parse_qs
+
+        organization = OrganizationFactory()
+        for number in range(3):
+            project = ProjectFactory(organization_name=organization.name, name=u'Project %d' % number)
+            db.session.flush()
+            issue = IssueFactory(project_id=project.id, title=u'Issue %d' % number)
+            issue.labels = [LabelFactory(name=u'hack')]
+        EventFactory(organization_name=organization.name)
+        db.session.commit()
+
+        # look up the cache generation and its validators before watching queries
+        self.app.get('/api/projects')
+
+        def get_with_statements(url):
+            response, statements = self.get_with_statements(url)
+            return json.loads(response.data), statements
+
+        response, statements = get_with_statements('/api/projects?per_page=2&fields=name,api_url')
+        self.assertEqual([set(o.keys()) for o in response['objects']], [set(['name', 'api_url'])] * 2)
+        self.assertEqual(parse_qs(urlparse(response['pages']['next']).query)['fields'], ['name,api_url'])
+        self.assertFalse([s for s in statements if 'github_details' in s or 'FROM issue' in s or 'FROM organization' in s])
+
+        response, statements = get_with_statements('/api/issues?fields=title,html_url')
+        self.assertEqual(sorted([o['title'] for o in response['objects']]), [u'Issue 0', u'Issue 1', u'Issue 2'])
+        self.assertEqual(set(response['objects'][0].keys()), set(['title', 'html_url']))
+        self.assertFalse([s for s in statements if 'issue.body' in s or 'FROM project' in s or 'FROM label' in s])
+
+        response = json.loads(self.app.get('/api/issues/labels/hack?fields=title,project,labels&cursor=').data)
+        self.assertEqual(set(response['objects'][0].keys()), set(['title', 'project', 'labels']))
+        self.assertEqual(response['objects'][0]['labels'][0]['name'], u'hack')
+        self.assertIn(response['objects'][0]['project']['name'], [u'Project 0', u'Project 1', u'Project 2'])
+
+        response = json.loads(self.app.get('/api/events?fields=name,start_time').data)
+        self.assertEqual(set(response['objects'][0].keys()), set(['name', 'start_time']))
+        self.assertIsNotNone(response['objects'][0]['start_time'])
+
+        response, statements = get_with_statements('/api/organizations?fields=name')
+        self.assertEqual(response['objects'], [dict(name=organization.name)])
+        self.assertFalse([s for s in statements if 'FROM project' in s or 'FROM event' in s or 'FROM story' in s])
+
+    def test_batch_get(self):
+        ''' Objects can be got by a list of ids, in the order asked for
+        '''
+        organizations = [OrganizationFactory(), OrganizationFactory()]
+        projects, issues, events, stories = [], [], [], []
+        for number in range(4):
+            organization = organizations[number % 2]
+            projects.append(ProjectFactory(organization_name=organization.name, name=u'Project %d' % number))
+            events.append(EventFactory(organization_name=organization.name))
+            stories.append(StoryFactory(organization_name=organization.name))
+            db.session.flush()
+            issues.append(IssueFactory(project_id=projects[-1].id))
+            issues[-1].labels = [LabelFactory()]
+        db.session.commit()
+
+        project_ids, issue_ids = [p.id for p in projects], [i.id for i in issues]
+        issue_title = issues[1].title
+        urls = (('/api/projects', project_ids), ('/api/issues', issue_ids),
+                ('/api/events', [e.id for e in events]), ('/api/stories', [s.id for s in stories]))
+
+        for (url, row_ids) in urls:
+            ids = [row_ids[2], row_ids[0], 12345, row_ids[3], row_ids[0]]
+            response = json.loads(self.app.get('%s?ids=%s' % (url, ','.join(map(str, ids)))).data)
+            self.assertEqual([o['id'] for o in response['objects']], [row_ids[2], row_ids[0], row_ids[3]], url)
+            self.assertEqual(response['total'], 3)
+
+            self.assertEqual(json.loads(self.app.get(url + '?ids=').data)['objects'], [])
+            self.assertEqual(self.app.get(url + '?ids=1,two').status_code, 400)
+            self.assertEqual(self.app.get(url + '?ids=' + ','.join(map(str, range(1, 200)))).status_code, 400)
+
+        # related rows are loaded for the whole batch at once
+        self.app.get('/api/projects')
+        response, statements = self.get_with_statements('/api/projects?ids=%s' % ','.join(map(str, project_ids)))
+        response = json.loads(response.data)
+
+        self.assertEqual(len(response['objects']), 4)
+        self.assertTrue(all([o['organization'] and o['issues'][0]['labels'] for o in response['objects']]))
+        self.assertEqual(len(statements), 4)
+
+        response = json.loads(self.app.get('/api/issues?ids=%d&fields=title' % issue_ids[1]).data)
+        self.assertEqual(response['objects'], [dict(title=issue_title)])
+
+    def test_links_follow_host(self):
+        ''' Links are built for the host of each request
+        '''
+        organization = OrganizationFactory(name=u'Code for San Francisco')
+        ProjectFactory(organization_name=organization.name)
+        db.session.commit()
+
+        for host in ('localhost', 'api.example.com'):
+            response = json.loads(self.app.get('/api/projects', base_url='https://%s' % host).data)
+            project = response['objects'][0]
+            self.assertEqual(project['api_url'], 'https://%s/api/projects/%d' % (host, project['id']))
+            self.assertEqual(project['organization']['all_events'], 'https://%s/api/organizations/Code-for-San-Francisco/events' % host)
+
+    def test_serializers(self):
+        ''' Compiled serializers return the same public columns dictalchemy would
+        '''
+        from models import serialize_organization, serialize_project, serialize_issue, serialize_label, serialize_event, serialize_story
+        from utils import convert_datetime_to_iso_8601
+
+        organization = OrganizationFactory()
+        project = ProjectFactory(organization_name=organization.name)
+        db.session.flush()
+        issue = IssueFactory(project_id=project.id)
+        db.session.flush()
+        label = LabelFactory(issue_id=issue.id)
+        event = EventFactory(organization_name=organization.name)
+        story = StoryFactory(organization_name=organization.name)
+        db.session.commit()
+
+        private = dict(keep=None, tsv_body=None, shuffle_key=None, last_updated_issues=None, last_updated_civic_json=None,
+                       last_updated_root_files=None, issues_updated_at=None, start_time_notz=None, end_time_notz=None, utc_offset=None)
+        for (serialize, instance) in ((serialize_organization, organization), (serialize_project, project), (serialize_event, event),
+                                      (serialize_story, story)):
+            expected = db.Model.asdict(instance, exclude=private.keys())
+            self.assertEqual(serialize(instance), expected)
+            self.assertEqual(serialize(instance, set(['name', 'id', 'title'])),
+                             dict([(key, value) for (key, value) in expected.items() if key in ('name', 'id', 'title')]))
+
+        expected = db.Model.asdict(issue, exclude=private.keys())
+        expected.update(created_at=convert_datetime_to_iso_8601(issue.created_at), updated_at=convert_datetime_to_iso_8601(issue.updated_at))
+        self.assertEqual(serialize_issue(issue), expected)
+        self.assertEqual(serialize_issue(issue, set(['created_at'])), dict(created_at=expected['created_at']))
+
+        self.assertEqual(serialize_label(label), db.Model.asdict(label, exclude=['id', 'issue_id']))
+
     def test_utf8_characters(self):
         organization = OrganizationFactory(name=u'Cöde for Ameriça')
         db.session.add(organization)
@@ -0,0 +1,198 @@
+import json
+from datetime import datetime, timedelta
+from time import time
+
+from mock import patch
+
+from test.factories import OrganizationFactory, ProjectFactory, EventFactory
+from test.harness import IntegrationTest
+from app import db
+from models import ResponseCache
+import cache
+
+
+class TestCache(IntegrationTest):
+
+    def setUp(self):
+        super(TestCache, self).setUp()
+        self.generation_ttl = cache.GENERATION_TTL
+        cache.configure(size=10)
+
+    def tearDown(self):
+        cache.GENERATION_TTL = self.generation_ttl
+        cache.configure(size=0)
+        super(TestCache, self).tearDown()
+
+    def count_queries(self, url, headers=None):
+        ''' Get a url, returning the response and the number of queries it took
+        '''
+        response, statements = self.get_with_statements(url, headers)
+        return response, len(statements)
+
+    def test_cached_responses(self):
+        ''' Repeated requests are served from the cache without touching the database
+        '''
+        ProjectFactory(name=u'Project 1')
+        db.session.commit()
+
+        before = cache.stats()
+        first, _ = self.count_queries('/api/projects?per_page=5&sort_dir=desc')
+        second, queries = self.count_queries('/api/projects?sort_dir=desc&per_page=5')
+
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.content_type, first.content_type)
+        self.assertEqual(queries, 0)
+
+        after = cache.stats()
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+
+        # not found responses aren't cached
+        self.assertEqual(self.app.get('/api/projects/12345').headers['X-Cache'], 'MISS')
+        self.assertEqual(self.app.get('/api/projects/12345').headers['X-Cache'], 'MISS')
+
+    def test_new_generation(self):
+        ''' Cached responses are left behind when the updater bumps the generation
+        '''
+        cache.GENERATION_TTL = 0
+
+        ProjectFactory(name=u'Project 1')
+        db.session.commit()
+        self.assertEqual(json.loads(self.app.get('/api/projects').data)['total'], 1)
+
+        ProjectFactory(name=u'Project 2')
+        db.session.commit()
+        self.assertEqual(json.loads(self.app.get('/api/projects').data)['total'], 1)
+
+        cache.bump_generation(db.session)
+        db.session.commit()
+        response = self.app.get('/api/projects')
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(json.loads(response.data)['total'], 2)
+
+    def test_least_recently_used(self):
+        ''' The least recently used response makes room for new ones
+        '''
+        cache.configure(size=2)
+        ProjectFactory()
+        db.session.commit()
+
+        for url in ('/api/projects', '/api/issues', '/api/projects', '/api/stories', '/api/projects', '/api/issues'):
+            self.app.get(url)
+
+        self.assertEqual(cache.stats()['size'], 2)
+        self.assertEqual(self.app.get('/api/projects').headers['X-Cache'], 'HIT')
+        self.assertEqual(self.app.get('/api/stories').headers['X-Cache'], 'MISS')
+
+    def test_shared_cache(self):
+        ''' Responses can be shared between processes through the database
+        '''
+        cache.configure(size=10, shared=True)
+        ProjectFactory()
+        db.session.commit()
+
+        first = self.app.get('/api/projects')
+        self.assertEqual(db.session.query(ResponseCache).count(), 1)
+
+        # a fresh process starts with an empty in-memory cache
+        cache.configure(size=10, shared=True)
+        before = cache.stats()
+        second = self.app.get('/api/projects')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(cache.stats()['shared_hits'] - before['shared_hits'], 1)
+
+        # a new generation clears out shared responses
+        cache.bump_generation(db.session)
+        db.session.commit()
+        self.assertEqual(db.session.query(ResponseCache).count(), 0)
+
+    def test_conditional_requests(self):
+        ''' Requests with matching validators get 304 Not Modified without running the view
+        '''
+        cache.configure(size=0)
+        cache.GENERATION_TTL = 0
+        organization = OrganizationFactory(last_updated=1420070400)  # 2015-01-01 UTC
+        ProjectFactory(organization_name=organization.name, last_updated=datetime(2015, 1, 2, 3, 4, 5))
+        db.session.commit()
+
+        response = self.app.get('/api/projects')
+        etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(last_modified, 'Fri, 02 Jan 2015 03:04:05 GMT')
+        self.assertNotEqual(self.app.get('/api/projects?per_page=5').headers['ETag'], etag)
+
+        cache.GENERATION_TTL = 60
+        response, queries = self.count_queries('/api/projects', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(queries, 0)
+
+        response = self.app.get('/api/projects', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+        response = self.app.get('/api/projects', headers={'If-None-Match': '"something else"', 'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 200)
+
+        # a new generation changes the ETag
+        cache.GENERATION_TTL = 0
+        cache.bump_generation(db.session)
+        db.session.commit()
+        response = self.app.get('/api/projects', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(json.loads(response.data)['total'], 1)
+
+        # not found responses have no validators
+        self.assertNotIn('ETag', self.app.get('/api/projects/12345').headers)
+
+    def test_streamed_responses(self):
+        ''' Streamed responses are cached once they've been sent
+        '''
+        import app
+
+        ProjectFactory()
+        db.session.commit()
+
+        stream_per_page = app.STREAM_PER_PAGE
+        app.STREAM_PER_PAGE = 1
+        try:
+            # read each streamed response before the next request, like a server would
+            first = self.app.get('/api/projects')
+            first_data = first.data
+            second = self.app.get('/api/projects')
+        finally:
+            app.STREAM_PER_PAGE = stream_per_page
+
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first_data)
+        self.assertEqual(json.loads(second.data)['total'], 1)
+
+    def test_timely_responses(self):
+        ''' Responses that depend on the current time are only cached for a
+            short while, and only in this process
+        '''
+        cache.configure(size=10, shared=True)
+        organization = OrganizationFactory()
+        EventFactory(organization_name=organization.name, start_time_notz=datetime.utcnow() + timedelta(seconds=90))
+        db.session.commit()
+
+        # a while after the data last changed
+        now = float((int(time()) + 3600) // cache.TIMELY_TTL * cache.TIMELY_TTL)
+        with patch('time.time', lambda: now):
+            first = self.app.get('/api/events/upcoming_events')
+            second = self.app.get('/api/events/upcoming_events')
+            self.assertEqual(first.headers['X-Cache'], 'MISS')
+            self.assertEqual(second.headers['X-Cache'], 'HIT')
+            self.assertEqual(json.loads(second.data)['total'], 1)
+            self.assertEqual(db.session.query(ResponseCache).count(), 0)
+
+        now += cache.TIMELY_TTL
+        with patch('time.time', lambda: now):
+            response = self.app.get('/api/events/upcoming_events', headers={'If-None-Match': first.headers['ETag']})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['X-Cache'], 'MISS')
+            self.assertEqual(response.last_modified, datetime.utcfromtimestamp(now))
@@ -242,4 +242,22 @@ class TestEvents(IntegrationTest):
         response = json.loads(response.data)
         self.assertEqual(response["total"], 1234)
 
+    def test_rsvps_weekly(self):
+        ''' RSVPs are summed by week, up to today '''
+        org = OrganizationFactory(name=u'Code for San Francisco')
+        for (day, rsvps) in [(datetime(2014, 12, 30, 18), 10), (datetime(2015, 1, 2, 18), 5), (datetime(2015, 1, 5, 18), 3),
+                             (datetime(2015, 1, 11, 23, 30), 4), (datetime(2015, 1, 6, 18), 0), (datetime.now() + timedelta(days=30), 100)]:
+            EventFactory(organization_name=org.name, start_time_notz=day, rsvps=rsvps)
+        EventFactory(organization_name=OrganizationFactory().name, start_time_notz=datetime(2015, 1, 7, 18), rsvps=20)
+        db.session.commit()
+
+        response = json.loads(self.app.get('/api/organizations/Code-for-San-Francisco/events/rsvps').data)
+        self.assertEqual(response['total'], 22)
+        # the week of the new year is split between the years
+        self.assertEqual(response['weekly'], {'2014 52': 10, '2015 00': 5, '2015 01': 7})
+
+        response = json.loads(self.app.get('/api/events/rsvps').data)
+        self.assertEqual(response['total'], 42)
+        self.assertEqual(response['weekly']['2015 01'], 27)
+
 
@@ -75,6 +75,59 @@ class TestIssues(IntegrationTest):
         response = json.loads(response.data)
         self.assertEqual(response['total'], 0)
 
+    def test_issues_page_query_count(self):
+        ''' A page of issues takes the same number of queries however many
+            issues, projects and labels are on it
+        '''
+        for number in range(5):
+            project = ProjectFactory(name=u'Project %d' % number)
+            db.session.flush()
+            for _ in range(2):
+                issue = IssueFactory(project_id=project.id)
+                issue.labels = [LabelFactory(), LabelFactory()]
+        db.session.commit()
+
+        def count_queries(url):
+            db.session.close()
+            response, statements = self.get_with_statements(url)
+            return json.loads(response.data), len(statements)
+
+        # look up the cache generation and its validators before counting
+        self.app.get('/api/issues')
+
+        small_page, small_count = count_queries('/api/issues?per_page=1')
+        full_page, full_count = count_queries('/api/issues?per_page=10')
+
+        self.assertEqual(len(full_page['objects']), 10)
+        self.assertEqual(small_count, full_count)
+
+        for issue in full_page['objects']:
+            self.assertEqual(len(issue['labels']), 2)
+            self.assertTrue(issue['project']['name'].startswith(u'Project'))
+            self.assertFalse('issues' in issue['project'])
+
+    def test_issues_shuffled_order(self):
+        ''' Issues are listed in a shuffled order that holds still from one
+            request to the next, so numbered pages don't overlap
+        '''
+        from app import Issue
+
+        project = ProjectFactory()
+        db.session.flush()
+        for number in range(9):
+            IssueFactory(project_id=project.id)
+        db.session.commit()
+
+        issues = db.session.query(Issue).order_by(Issue.shuffle_key, Issue.id).all()
+        self.assertEqual(len(set([issue.shuffle_key for issue in issues])), 9)
+
+        pages = [json.loads(self.app.get('/api/issues?per_page=4&page=%d' % page).data)['objects'] for page in (1, 2, 3)]
+        self.assertEqual([issue['id'] for page in pages for issue in page], [issue.id for issue in issues])
+        self.assertNotIn('shuffle_key', pages[0][0])
+
+        again = json.loads(self.app.get('/api/issues?per_page=4&page=2').data)['objects']
+        self.assertEqual([issue['id'] for issue in again], [issue['id'] for issue in pages[1]])
+
     def test_issues_query_filter(self):
         org1 = OrganizationFactory(name=u'Code for Africa', type=u'Code for All')
         org2 = OrganizationFactory(name=u'Code for San Francisco', type=u'Brigade')
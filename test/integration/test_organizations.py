@@ -366,7 +366,7 @@ class TestOrganizations(IntegrationTest):
         self.assertTrue(u'Civic Issue 1.1' in [item['title'] for item in response['objects']])
 
     def test_issues_returned_randomly(self):
-        ''' Issues are returned in random order by default
+        ''' Issues are returned in shuffled order by default
         '''
         org1 = OrganizationFactory(name=u'Civic Organization')
         org2 = OrganizationFactory(name=u'Institute of Institutions')
@@ -418,7 +418,9 @@ class TestOrganizations(IntegrationTest):
         self.assertEqual(response['total'], 24)
         ids_round_two = [item['id'] for item in response['objects']]
 
-        self.assertTrue(ids_round_one != ids_round_two)
+        # the order is shuffled, and holds still from one request to the next
+        self.assertNotEqual(ids_round_one, sorted(ids_round_one))
+        self.assertEqual(ids_round_one, ids_round_two)
 
         # get project 4's issues twice and compare results
         response = self.app.get('/api/organizations/{}/issues?per_page=16'.format(project4.organization_name))
@@ -433,7 +435,8 @@ class TestOrganizations(IntegrationTest):
         self.assertEqual(response['total'], 16)
         ids_round_four = [item['id'] for item in response['objects']]
 
-        self.assertTrue(ids_round_three != ids_round_four)
+        self.assertNotEqual(ids_round_three, sorted(ids_round_three))
+        self.assertEqual(ids_round_three, ids_round_four)
 
     def test_org_issues_filtered_by_label(self):
         ''' An organization's issues, filtered by label, are returned as expected.
@@ -497,7 +500,7 @@ class TestOrganizations(IntegrationTest):
         db.session.commit()
 
         # get project 4's issues twice and compare results; there should
-        # be results and they should be randomized
+        # be results and they should be in the same shuffled order
         response = self.app.get('/api/organizations/{}/issues/labels/{}?per_page=12'.format(org1.name, label1.name))
         self.assertEqual(response.status_code, 200)
         response = json.loads(response.data)
@@ -534,7 +537,7 @@ class TestOrganizations(IntegrationTest):
         self.assertTrue(label21.id in ids_round_two)
         self.assertTrue(label23.id in ids_round_two)
 
-        self.assertTrue(ids_round_one != ids_round_two)
+        self.assertEqual(ids_round_one, ids_round_two)
 
     def test_org_dont_show_issues(self):
         ''' Test that calls to /organizations dont return project issues '''
@@ -554,3 +557,103 @@ class TestOrganizations(IntegrationTest):
             if org['current_projects']:
                 self.assertFalse('issues' in org['current_projects'][0])
                 break
+
+    def test_organizations_geojson(self):
+        ''' The GeoJSON of every organization is built once and served gzipped '''
+        from gzip import GzipFile
+        from StringIO import StringIO
+        from app import refresh_geojson
+        from models import Artifact
+        import app
+
+        OrganizationFactory(name=u'Code for San Francisco', latitude=37.7749, longitude=-122.4194)
+        db.session.commit()
+
+        url_roots = app.GEOJSON_URL_ROOTS
+        app.GEOJSON_URL_ROOTS = [u'http://localhost/']
+        self.addCleanup(setattr, app, 'GEOJSON_URL_ROOTS', url_roots)
+
+        response = self.app.get('/api/organizations.geojson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/json')
+        geojson = json.loads(response.data)
+        self.assertEqual(geojson['type'], 'FeatureCollection')
+        self.assertEqual(len(geojson['features']), 1)
+        feature = geojson['features'][0]
+        self.assertEqual(feature['id'], u'Code-for-San-Francisco')
+        self.assertEqual(feature['geometry'], dict(type='Point', coordinates=[-122.4194, 37.7749]))
+        self.assertEqual(feature['properties']['all_projects'], 'http://localhost/api/organizations/Code-for-San-Francisco/projects')
+
+        # new organizations wait for the next update
+        OrganizationFactory(name=u'Open Oakland')
+        db.session.commit()
+
+        response = self.app.get('/api/organizations.geojson', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(GzipFile(fileobj=StringIO(response.data)).read()), geojson)
+
+        refresh_geojson(db.session)
+        response = self.app.get('/api/organizations.geojson')
+        self.assertEqual(len(json.loads(response.data)['features']), 2)
+
+        # unchanged responses aren't sent again
+        response = self.app.get('/api/organizations.geojson', headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        # other hosts get it built for them without storing it
+        for host in ('one.example.com', 'two.example.com'):
+            response = self.app.get('/api/organizations.geojson', headers={'X-Forwarded-Host': host})
+            feature = json.loads(response.data)['features'][0]
+            self.assertEqual(feature['properties']['api_url'], 'http://%s/api/organizations/%s' % (host, feature['id']))
+        self.assertEqual([artifact.url_root for artifact in db.session.query(Artifact)], [u'http://localhost/'])
+
+    def test_member_count(self):
+        ''' Meetup member counts are summed up, leaving out organizations without any '''
+        for (name, member_count) in [(u'Code for San Francisco', 100), (u'Open Oakland', 25), (u'Code for Nowhere', None), (u'Code for Empty', 0)]:
+            organization = OrganizationFactory(name=name)
+            organization.member_count = member_count
+        db.session.commit()
+
+        response = json.loads(self.app.get('/api/member_count').data)
+        self.assertEqual(response['total'], 125)
+
+        response = json.loads(self.app.get('/api/organizations/member_count').data)
+        self.assertEqual(response['total'], 125)
+        self.assertEqual(response['organizations'], {u'Code-for-San-Francisco': 100, u'Open-Oakland': 25})
+
+    def test_organizations_page_query_count(self):
+        ''' A page of organizations finds their current events, projects and
+            stories in the same number of queries however many there are
+        '''
+        names = []
+        for number in range(4):
+            organization = OrganizationFactory(name=u'Organization %d' % number)
+            names.append(organization.name)
+            for days in range(number + 1):
+                EventFactory(organization_name=organization.name, start_time_notz=datetime.utcnow() + timedelta(days=days + 1))
+                EventFactory(organization_name=organization.name, start_time_notz=datetime.utcnow() - timedelta(days=days + 1))
+                StoryFactory(organization_name=organization.name)
+                ProjectFactory(organization_name=organization.name, last_updated=datetime(2015, 1, 1 + days))
+        db.session.commit()
+
+        def count_queries(url):
+            response, statements = self.get_with_statements(url)
+            return json.loads(response.data), len(statements)
+
+        # look up the cache generation and its validators before counting
+        self.app.get('/api/organizations')
+
+        small_page, small_count = count_queries('/api/organizations?per_page=1')
+        full_page, full_count = count_queries('/api/organizations?per_page=10')
+        self.assertEqual(len(full_page['objects']), 4)
+        self.assertEqual(small_count, full_count)
+
+        # the page has the same current rows as each organization on its own
+        for organization in full_page['objects']:
+            alone = json.loads(self.app.get('/api/organizations/%s' % organization['id']).data)
+            for key in ('current_events', 'current_projects', 'current_stories'):
+                self.assertEqual(organization[key], alone[key], key)
+
+        number = names.index(full_page['objects'][0]['name'])
+        self.assertEqual(len(full_page['objects'][0]['current_events']), min(number + 1, 2))
+        self.assertEqual(len(full_page['objects'][0]['current_projects']), min(number + 1, 3))
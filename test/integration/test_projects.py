@@ -1,7 +1,7 @@
 import json
 from datetime import datetime, timedelta
 
-from test.factories import ProjectFactory, OrganizationFactory, IssueFactory
+from test.factories import ProjectFactory, OrganizationFactory, IssueFactory, LabelFactory
 from test.harness import IntegrationTest
 from app import db, Issue
 
@@ -504,3 +504,36 @@ class TestProjects(IntegrationTest):
         db.session.commit()
         issues = db.session.query(Issue).all()
         self.assertFalse(len(issues))
+
+    def test_projects_page_query_count(self):
+        ''' A page of projects takes the same number of queries however many
+            projects, issues and labels are on it
+        '''
+        for organization in (OrganizationFactory(), OrganizationFactory()):
+            for number in range(5):
+                project = ProjectFactory(organization_name=organization.name, name=u'Project %d' % number)
+                db.session.flush()
+                for _ in range(3):
+                    issue = IssueFactory(project_id=project.id)
+                    issue.labels = [LabelFactory(), LabelFactory()]
+        db.session.commit()
+
+        def count_queries(url):
+            db.session.close()
+            response, statements = self.get_with_statements(url)
+            return json.loads(response.data), len(statements)
+
+        # look up the cache generation and its validators before counting
+        self.app.get('/api/projects')
+
+        small_page, small_count = count_queries('/api/projects?per_page=1')
+        full_page, full_count = count_queries('/api/projects?per_page=10')
+
+        self.assertEqual(len(full_page['objects']), 10)
+        self.assertEqual(small_count, full_count)
+
+        for project in full_page['objects']:
+            self.assertEqual(len(project['issues']), 3)
+            for issue in project['issues']:
+                self.assertEqual(len(issue['labels']), 2)
+            self.assertEqual(project['organization']['name'], project['organization_name'])
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import os
+import unittest
+import datetime
+
+os.environ['DATABASE_URL'] = 'postgres:///civic_json_worker_test'
+
+
+class BulkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from app import db
+        import bulk
+
+        self.db = db
+        self.db.create_all()
+
+        self.chunk_size = bulk.CHUNK_SIZE
+        bulk.CHUNK_SIZE = 2
+
+        from test.factories import OrganizationFactory
+        self.organization = OrganizationFactory(name=u'Cöde for Ameriça')
+        self.db.session.commit()
+
+    def tearDown(self):
+        import bulk
+        bulk.CHUNK_SIZE = self.chunk_size
+
+        self.db.session.close()
+        self.db.drop_all()
+
+    def save_projects(self, proj_dicts, reconciler=None):
+        from app import Project
+        from bulk import upsert
+
+        ids = upsert(self.db.session, Project, proj_dicts, ('name', 'organization_name'),
+                     Project.organization_name == self.organization.name, reconciler)
+        self.db.session.commit()
+        return ids
+
+    def test_insert_and_update(self):
+        ''' New rows are inserted, changed rows are updated, and ids come back for both
+        '''
+        from app import Project
+        from bulk import Reconciler
+
+        names = [u'cityvoice', u'bizfriendly-web', u'echelon', u'pütt']
+        first_ids = self.save_projects([dict(name=name, organization_name=self.organization.name, description=u'old', github_details={'name': name}) for name in names])
+        self.assertEqual(len(first_ids), 4)
+
+        reconciler = Reconciler()
+        second_ids = self.save_projects([dict(name=u'cityvoice', organization_name=self.organization.name, description=u'new'),
+                                         dict(name=u'pütt', organization_name=self.organization.name, description=u'old', github_details={'name': u'pütt'}),
+                                         dict(name=u'echelon', organization_name=self.organization.name, description=u'new', github_details={'stars': 10})], reconciler)
+
+        for key in second_ids:
+            self.assertEqual(second_ids[key], first_ids[key])
+
+        projects = dict([(project.name, project) for project in self.db.session.query(Project).all()])
+        self.assertEqual(len(projects), 4)
+
+        # changed columns are written, unmentioned ones are left alone
+        self.assertEqual(projects[u'cityvoice'].description, u'new')
+        self.assertEqual(projects[u'cityvoice'].github_details, {'name': u'cityvoice'})
+        self.assertEqual(projects[u'echelon'].github_details, {'stars': 10})
+
+        # every row that was seen is reconciled, changed or not
+        self.assertEqual(reconciler.seen[Project], set(second_ids.values()))
+        self.assertNotIn(first_ids[(u'bizfriendly-web', self.organization.name)], reconciler.seen[Project])
+
+    def test_delete_unseen(self):
+        ''' Rows that weren't seen are deleted, within the scope
+        '''
+        from app import Project
+        from bulk import Reconciler
+
+        self.save_projects([dict(name=name, organization_name=self.organization.name) for name in (u'cityvoice', u'echelon')])
+
+        from test.factories import ProjectFactory
+        ProjectFactory(name=u'elsewhere')
+        self.db.session.commit()
+
+        reconciler = Reconciler()
+        self.save_projects([dict(name=u'cityvoice', organization_name=self.organization.name)], reconciler)
+        deleted = reconciler.delete_unseen(self.db.session, Project, Project.organization_name == self.organization.name)
+        self.db.session.commit()
+
+        self.assertEqual(deleted, 1)
+        self.assertEqual(sorted([project.name for project in self.db.session.query(Project).all()]), [u'cityvoice', u'elsewhere'])
+
+        # nothing seen means everything in scope goes
+        deleted = Reconciler().delete_unseen(self.db.session, Project, Project.organization_name == self.organization.name)
+        self.assertEqual(deleted, 1)
+
+    def test_repeated_keys(self):
+        ''' Rows sharing a key update the same existing row in turn
+        '''
+        from app import Project
+
+        self.save_projects([dict(name=u'cityvoice', organization_name=self.organization.name, description=u'old')])
+        self.save_projects([dict(name=u'cityvoice', organization_name=self.organization.name, description=u'first', link_url=u'http://www.cityvoiceapp.com/'),
+                            dict(name=u'cityvoice', organization_name=self.organization.name, description=u'second')])
+
+        project = self.db.session.query(Project).one()
+        self.assertEqual(project.description, u'second')
+        self.assertEqual(project.link_url, u'http://www.cityvoiceapp.com/')
+
+    def test_typed_values(self):
+        ''' Values are cast to their column types in bulk updates
+        '''
+        from app import Project, Issue
+        from bulk import upsert
+
+        project_id = self.save_projects([dict(name=u'cityvoice', organization_name=self.organization.name)]).values()[0]
+
+        issues = [dict(title=u'Fix the thing', project_id=project_id, created_at='2014-02-21T20:43:16Z'),
+                  dict(title=u'Fix the other thing', project_id=project_id, created_at=None)]
+        upsert(self.db.session, Issue, issues, ('title', 'project_id'), Issue.project_id == project_id)
+
+        issues[0]['created_at'] = '2014-03-01T12:00:00Z'
+        issues[1]['created_at'] = '2014-03-02T12:00:00Z'
+        upsert(self.db.session, Issue, issues, ('title', 'project_id'), Issue.project_id == project_id)
+        self.db.session.commit()
+
+        issues = dict([(issue.title, issue) for issue in self.db.session.query(Issue).all()])
+        self.assertEqual(issues[u'Fix the thing'].created_at, datetime.datetime(2014, 3, 1, 12))
+        self.assertEqual(issues[u'Fix the other thing'].created_at, datetime.datetime(2014, 3, 2, 12))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import unittest
+from time import time
+
+from httmock import response
+
+from ratelimit import RateLimitScheduler
+
+
+class RateLimitTestCase(unittest.TestCase):
+
+    def test_update_from_headers(self):
+        ''' The budget is read from X-RateLimit headers
+        '''
+        scheduler = RateLimitScheduler()
+        scheduler.update(response(200, '', {'X-RateLimit-Limit': '5000', 'X-RateLimit-Remaining': '4999', 'X-RateLimit-Reset': '1400000000'}))
+        self.assertEqual(scheduler.state(), dict(limit=5000, remaining=4999, reset=1400000000, parked=[]))
+
+    def test_unknown_budget_is_available(self):
+        ''' Requests go out before any budget has been seen
+        '''
+        scheduler = RateLimitScheduler()
+        self.assertFalse(scheduler.exhausted())
+        self.assertTrue(scheduler.available())
+
+    def test_reserve_is_held_back(self):
+        ''' The budget counts as spent once only the reserve is left
+        '''
+        scheduler = RateLimitScheduler(reserve=10, max_wait=0)
+        scheduler.load(limit=5000, remaining=10, reset=int(time()) + 3600)
+        self.assertTrue(scheduler.exhausted())
+        self.assertFalse(scheduler.available())
+
+    def test_budget_resets(self):
+        ''' A spent budget comes back once the window has reset
+        '''
+        scheduler = RateLimitScheduler()
+        scheduler.load(limit=5000, remaining=0, reset=int(time()) - 1)
+        self.assertFalse(scheduler.exhausted())
+
+    def test_short_wait_for_reset(self):
+        ''' The scheduler waits for a reset that's close enough
+        '''
+        scheduler = RateLimitScheduler(max_wait=5)
+        scheduler.load(limit=5000, remaining=0, reset=time() + 0.1)
+        self.assertTrue(scheduler.available())
+        self.assertFalse(scheduler.exhausted())
+
+    def test_exhaust_without_reset(self):
+        ''' Being throttled without a reset time parks work until the next run
+        '''
+        scheduler = RateLimitScheduler()
+        scheduler.exhaust()
+        self.assertTrue(scheduler.exhausted())
+        self.assertFalse(scheduler.available())
+
+    def test_pacing(self):
+        ''' Turns are spread out evenly when the budget runs low
+        '''
+        scheduler = RateLimitScheduler(reserve=0, pace_below=500)
+        scheduler.load(limit=5000, remaining=100, reset=int(time()) + 1000)
+        scheduler.wait()
+        self.assertGreater(scheduler.next_turn - time(), 8)
+
+        scheduler = RateLimitScheduler(reserve=0, pace_below=500)
+        scheduler.load(limit=5000, remaining=1000, reset=int(time()) + 1000)
+        scheduler.wait()
+        self.assertLess(scheduler.next_turn - time(), 1)
+
+    def test_parked_work(self):
+        ''' Parked projects are reported as stale on the next run
+        '''
+        scheduler = RateLimitScheduler()
+        scheduler.park(u'Code for America', u'https://github.com/codeforamerica/cityvoice')
+
+        next_run = RateLimitScheduler()
+        next_run.load(**scheduler.state())
+        self.assertTrue(next_run.is_stale(u'https://github.com/codeforamerica/cityvoice'))
+        self.assertFalse(next_run.is_stale(u'https://github.com/codeforamerica/bizfriendly-web'))
+        self.assertEqual(next_run.state()['parked'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
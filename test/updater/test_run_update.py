@@ -7,9 +7,10 @@ import logging
 import time
 import json
 from re import match, search, sub
+from urlparse import parse_qsl
 
 from httmock import response, HTTMock
-from mock import Mock
+from mock import Mock, patch
 
 from psycopg2 import connect, extras
 
@@ -42,7 +43,7 @@ class RunUpdateTestCase(unittest.TestCase):
         self.db.create_all()
 
         import run_update
-        run_update.github_throttling = False
+        run_update.github_scheduler = run_update.RateLimitScheduler()
 
         # FAKE PEOPLEDB
         with connect(os.environ["PEOPLEDB"]) as conn:
@@ -63,8 +64,9 @@ class RunUpdateTestCase(unittest.TestCase):
 
     def setup_mock_rss_response(self):
         ''' This overwrites urllib2.urlopen to return a mock response, which stops
-            get_first_working_feed_link() in feeds.py from pulling data from the
-            internet
+            anything still using urllib2 from pulling data from the internet.
+            Feed requests from get_first_working_feed_link() in feeds.py go
+            through transport.get() and are answered by response_content().
         '''
 
         import urllib2
@@ -378,7 +380,7 @@ class RunUpdateTestCase(unittest.TestCase):
         with HTTMock(self.response_content):
             with HTTMock(overwrite_response_content):
                 import run_update
-                self.assertFalse(run_update.github_throttling)
+                self.assertFalse(run_update.github_scheduler.exhausted())
                 with self.assertRaises(IOError):
                     run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME)
 
@@ -475,6 +477,38 @@ class RunUpdateTestCase(unittest.TestCase):
 
         logging.error.assert_called_with('Code for America\'s meetup page cannot be found')
 
+    def test_unreachable_feeds_and_meetup(self):
+        ''' Timeouts from a feed or Meetup leave that organization's stories
+            and events out without stopping the update
+        '''
+        self.setup_mock_rss_response()
+
+        from requests.exceptions import Timeout
+        from app import Organization, Event, Story
+        import run_update
+        import transport
+
+        feed_requests = []
+
+        def timeout_response_content(url, request):
+            if url.netloc == 'api.meetup.com':
+                raise Timeout(url.geturl())
+            if url.geturl() == 'http://www.codeforamerica.org/blog/feed/':
+                # the feed is found, then times out when it's read
+                feed_requests.append(url.geturl())
+                if len(feed_requests) > 1:
+                    raise Timeout(url.geturl())
+
+        with patch.object(transport, 'BACKOFF', 0):
+            with HTTMock(self.response_content):
+                with HTTMock(timeout_response_content):
+                    run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME)
+
+        self.assertEqual(self.db.session.query(Organization).count(), 3)
+        self.assertEqual(self.db.session.query(Event).count(), 0)
+        self.assertEqual(self.db.session.query(Story).filter(Story.organization_name == u'C\xf6de for Ameri\xe7a').count(), 0)
+        self.assertIsNone(self.db.session.query(Organization).filter(Organization.name == u'Code for America (3)').one().member_count)
+
     def test_main_with_stories(self):
         '''
         Test that two most recent blog posts are in the db.
@@ -486,8 +520,7 @@ class RunUpdateTestCase(unittest.TestCase):
 
         with HTTMock(self.response_content):
             import run_update
-            for story_info in run_update.get_stories(organization):
-                run_update.save_story_info(self.db.session, story_info)
+            run_update.save_stories_info(self.db.session, run_update.get_stories(organization))
 
         self.db.session.flush()
 
@@ -524,6 +557,43 @@ class RunUpdateTestCase(unittest.TestCase):
         error = self.db.session.query(Error).first()
         self.assertEqual(error.error, "IOError: We done got throttled by GitHub")
 
+        # the skipped projects are parked for the next run
+        from app import RateLimit
+        budget = self.db.session.query(RateLimit).filter(RateLimit.resource == u'github').one()
+        self.assertEqual(budget.remaining, 0)
+        parked = [item['code_url'] for item in budget.parked]
+        self.assertEqual(sorted(parked), sorted([project.code_url for project in projects if project.code_url]))
+
+    def test_parked_projects_updated_first(self):
+        '''
+        Test that projects parked by a throttled run are the first ones updated on the next run.
+        '''
+        self.setup_mock_rss_response()
+
+        from app import RateLimit
+        parked = [dict(organization_name=u'C\xf6de for Ameri\xe7a', code_url=u'https://github.com/codeforamerica/bizfriendly-web/')]
+        self.db.session.add(RateLimit(resource=u'github', limit=5000, remaining=0, reset=0, parked=parked))
+        self.db.session.commit()
+
+        self.organization_count = 1
+        repo_urls = []
+
+        def record_repo_requests(url, request):
+            if url.netloc == 'api.github.com' and url.path.startswith('/repos/') and url.path.count('/') == 3:
+                repo_urls.append(url.geturl())
+
+        with HTTMock(self.response_content):
+            with HTTMock(record_repo_requests):
+                import run_update
+                run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME)
+
+        # bizfriendly-web comes after cityvoice in the projects list
+        self.assertEqual(repo_urls[0], 'https://api.github.com/repos/codeforamerica/bizfriendly-web')
+
+        # nothing is parked once the budget is back
+        budget = self.db.session.query(RateLimit).filter(RateLimit.resource == u'github').one()
+        self.assertEqual(budget.parked, [])
+
     def test_csv_sniffer(self):
         '''
         Testing weird csv dialects we've encountered
@@ -575,9 +645,8 @@ class RunUpdateTestCase(unittest.TestCase):
         with HTTMock(self.response_content):
             import run_update
             projects = run_update.get_projects(philly)
-            for proj_info in projects:
-                run_update.save_project_info(self.db.session, proj_info)
-                self.db.session.flush()
+            run_update.save_projects_info(self.db.session, projects)
+            self.db.session.flush()
 
         time.sleep(1)
 
@@ -590,9 +659,8 @@ class RunUpdateTestCase(unittest.TestCase):
             projects = run_update.get_projects(philly)
             self.assertEqual(projects[0]['description'], "UPDATED DESCRIPTION")
             self.assertEqual(projects[0]['last_updated'], datetime.datetime.now().strftime("%a, %d %b %Y %H:%M:%S %Z"))
-            for proj_info in projects:
-                run_update.save_project_info(self.db.session, proj_info)
-                self.db.session.flush()
+            run_update.save_projects_info(self.db.session, projects)
+            self.db.session.flush()
 
         time.sleep(1)
 
@@ -625,39 +693,35 @@ class RunUpdateTestCase(unittest.TestCase):
             freezer.start()
 
             projects = run_update.get_projects(philly)
-            for proj_info in projects:
-                run_update.save_project_info(self.db.session, proj_info)
-                self.db.session.flush()
+            run_update.save_projects_info(self.db.session, projects)
+            self.db.session.flush()
 
             projects = run_update.get_projects(philly2)
-            for proj_info in projects:
-                run_update.save_project_info(self.db.session, proj_info)
-                self.db.session.flush()
+            run_update.save_projects_info(self.db.session, projects)
+            self.db.session.flush()
 
             from app import Project
             projects = self.db.session.query(Project).all()
-            self.assertEqual(projects[0].last_updated, datetime.datetime.now().strftime("%a, %d %b %Y %H:%M:%S %Z"))
-            self.assertEqual(projects[1].last_updated, datetime.datetime.now().strftime("%a, %d %b %Y %H:%M:%S %Z"))
+            self.assertEqual(projects[0].last_updated, datetime.datetime.now())
+            self.assertEqual(projects[1].last_updated, datetime.datetime.now())
 
             freezer.stop()
             freezer = freeze_time("2012-01-14 12:00:02")
             freezer.start()
 
             projects = run_update.get_projects(philly)
-            for proj_info in projects:
-                run_update.save_project_info(self.db.session, proj_info)
-                self.db.session.flush()
+            run_update.save_projects_info(self.db.session, projects)
+            self.db.session.flush()
 
             projects = run_update.get_projects(philly2)
-            for proj_info in projects:
-                run_update.save_project_info(self.db.session, proj_info)
-                self.db.session.flush()
+            run_update.save_projects_info(self.db.session, projects)
+            self.db.session.flush()
 
             projects = self.db.session.query(Project).all()
             from datetime import timedelta
             one_second_ago = datetime.datetime.now() - timedelta(seconds=1)
-            self.assertEqual(projects[0].last_updated, one_second_ago.strftime("%a, %d %b %Y %H:%M:%S %Z"))
-            self.assertEqual(projects[1].last_updated, one_second_ago.strftime("%a, %d %b %Y %H:%M:%S %Z"))
+            self.assertEqual(projects[0].last_updated, one_second_ago)
+            self.assertEqual(projects[1].last_updated, one_second_ago)
 
             freezer.stop()
 
@@ -729,6 +793,53 @@ class RunUpdateTestCase(unittest.TestCase):
                 issues = run_update.get_issues(organization.name)
                 assert (len(issues) == 2)
 
+    def test_parallel_paging(self):
+        ''' When the last page is linked, every page is fetched and the items come out in order '''
+        import run_update
+
+        requested = []
+        page_url = 'https://api.github.com/user/337792/repos?per_page=2&page={}'
+
+        def paged_response_content(url, request):
+            if url.path == '/user/337792/repos':
+                page = int(dict(parse_qsl(url.query)).get('page', 1))
+                requested.append(page)
+                headers = {}
+                if page == 1:
+                    headers['Link'] = '<{}>; rel="next", <{}>; rel="last"'.format(page_url.format(2), page_url.format(5))
+                return response(200, json.dumps([dict(name='repo {}'.format(page * 2 + i)) for i in range(2)]), headers)
+
+        with HTTMock(paged_response_content):
+            got = run_update.get_github_api('https://api.github.com/user/337792/repos?per_page=2')
+            items = run_update.get_adjoined_json_lists(got)
+            self.assertEqual(requested, [1])
+            names = [item['name'] for item in items]
+
+        self.assertEqual(names, ['repo {}'.format(number) for number in range(2, 12)])
+        self.assertEqual(sorted(requested), [1, 2, 3, 4, 5])
+
+    def test_paging_errors(self):
+        ''' Paging stops at the first page that comes back as an error instead of a list '''
+        import run_update
+
+        page_url = 'https://api.github.com/user/337792/repos?per_page=2&page={}'
+
+        def paged_response_content(url, request):
+            if url.path == '/user/337792/repos':
+                page = int(dict(parse_qsl(url.query)).get('page', 1))
+                if page == 3:
+                    return response(403, json.dumps(dict(message='API rate limit exceeded')))
+                headers = {}
+                if page == 1:
+                    headers['Link'] = '<{}>; rel="next", <{}>; rel="last"'.format(page_url.format(2), page_url.format(4))
+                return response(200, json.dumps([dict(name='repo {}'.format(page * 2 + i)) for i in range(2)]), headers)
+
+        with HTTMock(paged_response_content):
+            got = run_update.get_github_api('https://api.github.com/user/337792/repos?per_page=2')
+            names = [item['name'] for item in run_update.get_adjoined_json_lists(got)]
+
+        self.assertEqual(names, ['repo {}'.format(number) for number in range(2, 6)])
+
     def test_project_list_without_all_columns(self):
         ''' Get a project list that doesn't have all the columns.
             Don't die.
@@ -883,6 +994,54 @@ class RunUpdateTestCase(unittest.TestCase):
             assert (label.issue_id, label.name) not in unique_labels
             unique_labels.append((label.issue_id, label.name))
 
+    def test_sync_labels(self):
+        ''' Labels are added and removed for a batch of issues at once.
+        '''
+        from app import Label
+        from test.factories import ProjectFactory, IssueFactory, LabelFactory
+        import run_update
+
+        project = ProjectFactory()
+        self.db.session.flush()
+        first, second = IssueFactory(project_id=project.id), IssueFactory(project_id=project.id)
+        self.db.session.flush()
+        LabelFactory(name=u'bug', issue_id=first.id)
+        LabelFactory(name=u'help wanted', issue_id=first.id)
+        LabelFactory(name=u'bug', issue_id=second.id)
+        self.db.session.commit()
+
+        new_label = dict(name=u'enhancement', color=u'84b6eb', url=u'https://api.github.com/repos/codeforamerica/cfapi/labels/enhancement')
+        issues = [dict(id=first.id, labels=[dict(name=u'bug', color=u'fc2929', url=u'https://api.github.com/repos/codeforamerica/cfapi/labels/bug'), new_label, new_label]),
+                  dict(id=second.id, labels=[])]
+
+        run_update.sync_labels(self.db.session, issues)
+        self.db.session.commit()
+
+        labels = self.db.session.query(Label.issue_id, Label.name).order_by(Label.issue_id, Label.name).all()
+        self.assertEqual(labels, [(first.id, u'bug'), (first.id, u'enhancement')])
+
+    def test_shuffle_issues(self):
+        ''' Each update gives issues a new shuffled order
+        '''
+        from app import Issue
+        from test.factories import ProjectFactory, IssueFactory
+        import run_update
+
+        project = ProjectFactory()
+        self.db.session.flush()
+        for number in range(5):
+            IssueFactory(project_id=project.id)
+        self.db.session.commit()
+
+        before = dict(self.db.session.query(Issue.id, Issue.shuffle_key).all())
+        run_update.shuffle_issues(self.db.session)
+        self.db.session.commit()
+        after = dict(self.db.session.query(Issue.id, Issue.shuffle_key).all())
+
+        self.assertEqual(sorted(before.keys()), sorted(after.keys()))
+        for issue_id in before:
+            self.assertNotEqual(before[issue_id], after[issue_id])
+
     def test_unicode_warning(self):
         ''' Testing for the postgres unicode warning
         '''
@@ -1096,6 +1255,244 @@ class RunUpdateTestCase(unittest.TestCase):
         self.organization_count = 3
         self.results_state = 'before'
 
+    def test_concurrent_update_matches_serial(self):
+        ''' Updating organizations with several workers saves the same rows
+            as updating them one at a time
+        '''
+        self.setup_mock_rss_response()
+
+        from app import Organization, Project, Event, Story, Issue, Label
+        import run_update
+
+        def snapshot():
+            return dict(
+                organizations=sorted([o.name for o in self.db.session.query(Organization)]),
+                projects=sorted([(p.organization_name, p.name, p.code_url, p.status, p.tags) for p in self.db.session.query(Project)]),
+                events=sorted([(e.organization_name, e.event_url, e.name) for e in self.db.session.query(Event)]),
+                stories=sorted([(s.organization_name, s.link, s.title) for s in self.db.session.query(Story)]),
+                issues=sorted([(i.project.organization_name, i.project.name, i.title) for i in self.db.session.query(Issue)]),
+                labels=sorted([(l.issue.project.organization_name, l.issue.title, l.name) for l in self.db.session.query(Label)])
+            )
+
+        with HTTMock(self.response_content):
+            run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME)
+        serial = snapshot()
+
+        self.db.session.close()
+        self.db.drop_all()
+        self.db.create_all()
+
+        with HTTMock(self.response_content):
+            run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME, workers=3)
+        concurrent = snapshot()
+
+        self.assertEqual(len(serial['organizations']), 3)
+        self.assertEqual(serial, concurrent)
+
+    def test_async_update_matches_serial(self):
+        ''' The pipelined engine saves the same rows as updating organizations
+            one at a time, both on the first update and on later ones
+        '''
+        self.setup_mock_rss_response()
+
+        from app import Organization, Project, Event, Story, Issue, Label
+        import run_update
+
+        def snapshot():
+            return dict(
+                organizations=sorted([(o.name, o.member_count) for o in self.db.session.query(Organization)]),
+                projects=sorted([(p.organization_name, p.name, p.code_url, p.status, p.tags, p.last_updated_issues, p.issues_updated_at) for p in self.db.session.query(Project)]),
+                events=sorted([(e.organization_name, e.event_url, e.name) for e in self.db.session.query(Event)]),
+                stories=sorted([(s.organization_name, s.link, s.title) for s in self.db.session.query(Story)]),
+                issues=sorted([(i.project.organization_name, i.project.name, i.title) for i in self.db.session.query(Issue)]),
+                labels=sorted([(l.issue.project.organization_name, l.issue.title, l.name) for l in self.db.session.query(Label)])
+            )
+
+        with HTTMock(self.response_content):
+            run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME)
+        serial = snapshot()
+
+        self.db.session.close()
+        self.db.drop_all()
+        self.db.create_all()
+
+        with HTTMock(self.response_content):
+            run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME, use_async=True)
+            self.db.session.close()
+            first = snapshot()
+
+            run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME, workers=2, use_async=True)
+            self.db.session.close()
+            second = snapshot()
+
+        self.assertEqual(len(serial['organizations']), 3)
+        self.assertTrue(serial['issues'])
+        self.assertEqual(serial, first)
+        self.assertEqual(serial, second)
+
+    def test_async_update_saves_issue_bookkeeping(self):
+        ''' The pipelined engine saves the issue ETags and high-water marks of
+            changed projects, even when other projects' issues haven't changed
+        '''
+        self.setup_mock_rss_response()
+
+        from app import Project
+        import run_update
+
+        with HTTMock(self.response_content):
+            run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME, use_async=True)
+            self.db.session.close()
+
+        cityvoice_etags = dict([(p.id, p.last_updated_issues) for p in self.db.session.query(Project).filter(Project.name == u'cityvoice')])
+        self.assertTrue(cityvoice_etags)
+        self.db.session.close()
+
+        # the changes have to survive queries flushing them before get_issues() returns
+        get_issues = run_update.get_issues
+
+        def flushing_get_issues(*args, **kwargs):
+            issues = get_issues(*args, **kwargs)
+            self.db.session.flush()
+            return issues
+
+        def changed_issues_content(url, request):
+            if url.path == '/repos/codeforamerica/cityvoice/issues':
+                return response(304, '')
+            elif url.path == '/repos/codeforamerica/bizfriendly-web/issues':
+                issue = '''{"html_url": "https://github.com/codeforamerica/bizfriendly-web/issue/1", "title": "New bizfriendly issue", "state": "open", "labels": [], "created_at": "2015-11-05T00:00:00Z", "updated_at": "2015-11-05T00:00:00Z", "body": "WHATEVER"}'''
+                return response(200, '[' + issue + ']', {'ETag': '"bizfriendly-etag-2"'})
+
+        with HTTMock(self.response_content):
+            with HTTMock(changed_issues_content):
+                with patch.object(run_update, 'get_issues', flushing_get_issues):
+                    run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME, incremental=True, use_async=True)
+                self.db.session.close()
+
+        bizfriendly = self.db.session.query(Project).filter(Project.name == u'bizfriendly-web').all()
+        self.assertTrue(bizfriendly)
+        for project in bizfriendly:
+            self.assertEqual(project.last_updated_issues, u'"bizfriendly-etag-2"')
+            self.assertEqual(project.issues_updated_at, datetime.datetime(2015, 11, 5))
+
+        for project in self.db.session.query(Project).filter(Project.name == u'cityvoice'):
+            self.assertEqual(project.last_updated_issues, cityvoice_etags[project.id])
+
+    def test_async_update_errors_go_through_writer(self):
+        ''' The pipelined engine saves errors from its fetchers on the writer thread
+        '''
+        self.setup_mock_rss_response()
+
+        from threading import current_thread
+        from sqlalchemy import event
+        from app import Error
+        import run_update
+
+        def overwrite_response_content(url, request):
+            if url.netloc == 'api.github.com':
+                return response(403, "", {"x-ratelimit-remaining": 0})
+
+        threads = []
+
+        def before_insert(mapper, connection, target):
+            threads.append(current_thread().name)
+
+        event.listen(Error, 'before_insert', before_insert)
+        try:
+            with HTTMock(self.response_content):
+                with HTTMock(overwrite_response_content):
+                    run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME, use_async=True)
+        finally:
+            event.remove(Error, 'before_insert', before_insert)
+
+        self.assertEqual(self.db.session.query(Error).first().error, "IOError: We done got throttled by GitHub")
+        self.assertEqual(set(threads), set(['writer']))
+
+    def test_incremental_issues(self):
+        ''' Incremental updates only ask for issues changed since the last one,
+            and apply them as changes to the stored issues
+        '''
+        self.setup_mock_rss_response()
+
+        from app import Project, Issue
+        from urlparse import parse_qs
+        import run_update
+
+        since_requests = []
+
+        def changed_issues_content(url, request):
+            if url.path.endswith('/issues') and url.query:
+                since_requests.append(parse_qs(url.query))
+                issue_lines = ['''{"html_url": "https://github.com/codeforamerica/cityvoice/issue/211", "title": "More important cityvoice issue", "state": "closed", "labels": [], "created_at": "2015-10-26T01:13:03Z", "updated_at": "2015-11-02T10:00:00Z", "body": "WHATEVER"}''',
+                               '''{"html_url": "https://github.com/codeforamerica/cityvoice/issue/212", "title": "Brand new cityvoice issue", "state": "open", "labels": [], "created_at": "2015-11-01T09:00:00Z", "updated_at": "2015-11-01T09:00:00Z", "body": "WHATEVER"}''']
+                return response(200, ''' [ ''' + ', '.join(issue_lines) + ''' ] ''', {'ETag': '"changed-issues"'})
+
+        with HTTMock(self.response_content):
+            with HTTMock(changed_issues_content):
+                run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME, incremental=True)
+
+                # the first update fetched every open issue and set the high-water mark
+                self.assertEqual(since_requests, [])
+                for project in self.db.session.query(Project).filter(Project.name == u'cityvoice'):
+                    self.assertEqual(project.issues_updated_at, datetime.datetime(2015, 10, 26, 18, 6, 54))
+
+                run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME, incremental=True)
+
+        self.assertTrue(since_requests)
+        for params in since_requests:
+            self.assertEqual(params, dict(since=['2015-10-26T18:06:54Z'], state=['all']))
+
+        # the closed issue is gone, the new one is added, and the untouched one is kept
+        for project in self.db.session.query(Project).filter(Project.name == u'cityvoice'):
+            titles = sorted([issue.title for issue in self.db.session.query(Issue).filter(Issue.project_id == project.id)])
+            self.assertEqual(titles, [u'Brand new cityvoice issue', u'Important cityvoice issue'])
+            self.assertEqual(project.issues_updated_at, datetime.datetime(2015, 11, 2, 10))
+
+        # a later full update doesn't carry the setting over
+        since_count = len(since_requests)
+        with HTTMock(self.response_content):
+            with HTTMock(changed_issues_content):
+                run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME)
+
+        self.assertEqual(len(since_requests), since_count)
+
+    def test_github_responses_cached(self):
+        ''' Unconditional GitHub requests are made conditional with a cached ETag,
+            and a 304 response is answered from the cache
+        '''
+        self.setup_mock_rss_response()
+
+        from app import Project, GithubCache
+        import run_update
+
+        self.organization_count = 1
+        contributors_url = 'https://api.github.com/repos/codeforamerica/cityvoice/contributors'
+        contributors_requests = []
+
+        def contributors_response_content(url, request):
+            if url.geturl() == contributors_url:
+                contributors_requests.append(request.headers.get('If-None-Match'))
+                if request.headers.get('If-None-Match') == '"contributors-etag"':
+                    return response(304, '', {'ETag': '"contributors-etag"'})
+                return response(200, '''[ { "login": "daguar", "avatar_url": "https://avatars.githubusercontent.com/u/994938", "url": "https://api.github.com/users/daguar", "html_url": "https://github.com/daguar", "contributions": 518 } ]''', {'ETag': '"contributors-etag"'})
+
+        with HTTMock(self.response_content):
+            with HTTMock(contributors_response_content):
+                run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME)
+                run_update.main(org_sources=run_update.TEST_ORG_SOURCES_FILENAME)
+
+        # the first request was unconditional, the second used the cached ETag
+        self.assertEqual(contributors_requests, [None, '"contributors-etag"'])
+
+        cached = self.db.session.query(GithubCache).filter(GithubCache.url == contributors_url).first()
+        self.assertIsNotNone(cached)
+        self.assertEqual(cached.etag, u'"contributors-etag"')
+
+        # contributors were read from the cache after the 304
+        project = self.db.session.query(Project).filter(Project.name == u'cityvoice').first()
+        self.assertEqual(project.github_details['contributors'][0]['login'], u'daguar')
+
+        self.organization_count = 3
+
     def test_same_projects_different_organizations(self):
         ''' Verify that the same project can be associated with two different organizations
         '''
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+import unittest
+
+from httmock import response, HTTMock
+from requests import exceptions
+
+import transport
+
+
+class TransportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.backoff = transport.BACKOFF
+        transport.BACKOFF = 0
+        transport.configure()
+
+    def tearDown(self):
+        transport.BACKOFF = self.backoff
+        transport.limit_hosts(transport.HOST_CONCURRENCY)
+
+    def test_session_is_shared(self):
+        ''' Every request goes through the same pooled session
+        '''
+        self.assertIs(transport.get_session(), transport.get_session())
+        adapter = transport.get_session().get_adapter('https://api.github.com')
+        self.assertIsInstance(adapter, transport.PooledAdapter)
+        self.assertIs(adapter, transport.get_session().get_adapter('http://www.meetup.com'))
+
+    def test_configure_pool_size(self):
+        ''' Pool sizes can be configured
+        '''
+        session = transport.configure(pool_connections=3, pool_maxsize=20)
+        adapter = session.get_adapter('https://api.github.com')
+        self.assertEqual(adapter.poolmanager.pools._maxsize, 3)
+        self.assertEqual(adapter.poolmanager.connection_pool_kw['maxsize'], 20)
+
+    def test_retry_on_unavailable(self):
+        ''' Temporary server errors are retried
+        '''
+        calls = []
+
+        def flaky_response(url, request):
+            calls.append(url.geturl())
+            if len(calls) < 3:
+                return response(503, 'Unavailable')
+            return response(200, 'OK')
+
+        with HTTMock(flaky_response):
+            got = transport.get('https://api.github.com/rate_limit')
+
+        self.assertEqual(got.status_code, 200)
+        self.assertEqual(len(calls), 3)
+
+    def test_retries_run_out(self):
+        ''' The last response is returned once retries run out
+        '''
+        calls = []
+
+        def unavailable_response(url, request):
+            calls.append(url.geturl())
+            return response(502, 'Bad Gateway')
+
+        with HTTMock(unavailable_response):
+            got = transport.get('https://api.github.com/rate_limit')
+
+        self.assertEqual(got.status_code, 502)
+        self.assertEqual(len(calls), transport.RETRIES + 1)
+
+    def test_retry_on_connection_error(self):
+        ''' Connection errors are retried, then raised
+        '''
+        calls = []
+
+        def broken_response(url, request):
+            calls.append(url.geturl())
+            raise exceptions.ConnectionError('Connection refused')
+
+        with HTTMock(broken_response):
+            with self.assertRaises(exceptions.ConnectionError):
+                transport.get('https://api.github.com/rate_limit')
+
+        self.assertEqual(len(calls), transport.RETRIES + 1)
+
+    def test_client_errors_not_retried(self):
+        ''' 4xx responses come straight back
+        '''
+        calls = []
+
+        def missing_response(url, request):
+            calls.append(url.geturl())
+            return response(404, 'Not Found')
+
+        with HTTMock(missing_response):
+            got = transport.get('https://api.github.com/repos/codeforamerica/nope')
+
+        self.assertEqual(got.status_code, 404)
+        self.assertEqual(len(calls), 1)
+
+    def test_connection_stats(self):
+        ''' Connections opened and reused are counted across pools
+        '''
+        class FakePool(object):
+            def __init__(self, num_connections, num_requests):
+                self.num_connections = num_connections
+                self.num_requests = num_requests
+
+            def close(self):
+                pass
+
+        adapter = transport.get_session().get_adapter('https://api.github.com')
+        adapter.poolmanager.pools['api.github.com'] = FakePool(2, 10)
+        adapter.dispose_pool(FakePool(1, 4))
+
+        self.assertEqual(transport.connection_stats(), dict(opened=3, reused=11, requests=14))
+
+
+    def test_limit_hosts(self):
+        ''' Requests in flight to one host are capped, but not to others
+        '''
+        from threading import Lock
+        from multiprocessing.pool import ThreadPool
+        from time import sleep
+
+        lock, in_flight, most = Lock(), {}, {}
+
+        def slow_content(url, request):
+            with lock:
+                in_flight[url.netloc] = in_flight.get(url.netloc, 0) + 1
+                most[url.netloc] = max(most.get(url.netloc, 0), in_flight[url.netloc])
+            sleep(.05)
+            with lock:
+                in_flight[url.netloc] -= 1
+            return response(200, 'ok')
+
+        transport.limit_hosts(2)
+        urls = ['https://api.github.com/%d' % number for number in range(6)] + ['http://www.meetup.com/%d' % number for number in range(2)]
+
+        pool = ThreadPool(8)
+        try:
+            with HTTMock(slow_content):
+                pool.map(transport.get, urls)
+        finally:
+            pool.close()
+
+        self.assertEqual(most['api.github.com'], 2)
+        self.assertEqual(most['www.meetup.com'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+"""
+    Shared HTTP transport for the updater.
+
+    All fetches go through one requests Session so that connections to each
+    host are pooled and kept alive between requests, instead of paying for a
+    fresh TCP and TLS handshake every time.
+"""
+
+import os
+import logging
+from contextlib import contextmanager
+from threading import Lock, BoundedSemaphore
+from time import sleep
+from urlparse import urlparse
+
+from requests import Session, exceptions
+from requests.adapters import HTTPAdapter
+
+# Number of hosts to keep connection pools for
+POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))
+# Number of connections to keep alive per host
+POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 10))
+# Seconds to wait for a server before giving up
+TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 30))
+# Number of times to retry a failed request, and the base delay between tries
+RETRIES = int(os.environ.get('HTTP_RETRIES', 3))
+BACKOFF = float(os.environ.get('HTTP_BACKOFF', 0.5))
+
+# Most requests to have in flight to any one host, or 0 for no limit
+HOST_CONCURRENCY = int(os.environ.get('HTTP_HOST_CONCURRENCY', 0))
+
+# Response statuses that are worth another try
+RETRY_STATUSES = (502, 503, 504)
+
+_session = None
+_session_lock = Lock()
+
+_host_limit = HOST_CONCURRENCY
+_host_slots = {}
+_host_slots_lock = Lock()
+
+
+class PooledAdapter(HTTPAdapter):
+    ''' HTTPAdapter that keeps count of the connections its pools opened,
+        including the pools it has already thrown away.
+    '''
+    def init_poolmanager(self, connections, maxsize, block=False):
+        HTTPAdapter.init_poolmanager(self, connections, maxsize, block)
+        self.discarded_connections = 0
+        self.discarded_requests = 0
+        self.poolmanager.pools.dispose_func = self.dispose_pool
+
+    def dispose_pool(self, pool):
+        self.discarded_connections += pool.num_connections
+        self.discarded_requests += pool.num_requests
+        pool.close()
+
+    def connection_stats(self):
+        ''' Return the number of connections opened and requests sent.
+        '''
+        pools = self.poolmanager.pools
+        opened = self.discarded_connections + sum([pools[key].num_connections for key in pools.keys()])
+        requests = self.discarded_requests + sum([pools[key].num_requests for key in pools.keys()])
+        return opened, requests
+
+
+def new_session(pool_connections=None, pool_maxsize=None):
+    ''' Return a new session with pooled adapters for http and https.
+    '''
+    adapter = PooledAdapter(pool_connections=pool_connections or POOL_CONNECTIONS,
+                            pool_maxsize=pool_maxsize or POOL_MAXSIZE)
+    session = Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def configure(pool_connections=None, pool_maxsize=None):
+    ''' Replace the shared session with one using the given pool sizes.
+    '''
+    global _session
+
+    with _session_lock:
+        if _session:
+            _session.close()
+        _session = new_session(pool_connections, pool_maxsize)
+
+    return _session
+
+
+def get_session():
+    ''' Return the shared session, setting it up the first time.
+    '''
+    global _session
+
+    with _session_lock:
+        if not _session:
+            _session = new_session()
+
+    return _session
+
+
+def limit_hosts(limit):
+    ''' Allow at most limit requests in flight to each host, or any number if 0.
+    '''
+    global _host_limit
+
+    with _host_slots_lock:
+        _host_limit = limit
+        _host_slots.clear()
+
+
+@contextmanager
+def host_slot(url):
+    ''' Wait for a turn to make a request to the URL's host.
+    '''
+    with _host_slots_lock:
+        host = urlparse(url).netloc
+        if _host_limit and host not in _host_slots:
+            _host_slots[host] = BoundedSemaphore(_host_limit)
+        slot = _host_slots.get(host)
+
+    if slot:
+        slot.acquire()
+    try:
+        yield
+    finally:
+        if slot:
+            slot.release()
+
+
+def get(url, **kwargs):
+    ''' Make a GET request through the shared session.
+
+        Connection errors, timeouts, and 502/503/504 responses are retried
+        up to RETRIES times, waiting a little longer after each try. If
+        hosts are limited, wait for a turn with the host first.
+    '''
+    kwargs.setdefault('timeout', TIMEOUT)
+    session = get_session()
+
+    for attempt in range(RETRIES + 1):
+        try:
+            with host_slot(url):
+                got = session.get(url, **kwargs)
+        except (exceptions.ConnectionError, exceptions.Timeout):
+            if attempt == RETRIES:
+                raise
+            logging.warning('Retrying %s after a connection error', url)
+        else:
+            if got.status_code not in RETRY_STATUSES or attempt == RETRIES:
+                return got
+            logging.warning('Retrying %s after a %d response', url, got.status_code)
+
+        sleep(BACKOFF * (2 ** attempt))
+
+
+def connection_stats():
+    ''' Return a dictionary of connections opened and reused so far.
+    '''
+    opened, requests = 0, 0
+    for adapter in set(get_session().adapters.values()):
+        if isinstance(adapter, PooledAdapter):
+            adapter_opened, adapter_requests = adapter.connection_stats()
+            opened += adapter_opened
+            requests += adapter_requests
+
+    return dict(opened=opened, reused=max(requests - opened, 0), requests=requests)
@@ -5,12 +5,23 @@ def is_safe_name(name):
     '''
     return raw_name(safe_name(name)) == name
 
+# Remembered safe names, by name
+_safe_names = {}
+SAFE_NAMES_SIZE = 10000
+
 def safe_name(name):
     ''' Return URL-safe organization name with spaces replaced by dashes.
 
         Slashes will be removed, which is incompatible with raw_name().
     '''
-    return name.replace(' ', '-').replace('/', '-').replace('?', '-').replace('#', '-')
+    try:
+        return _safe_names[name]
+    except KeyError:
+        safe = name.replace(' ', '-').replace('/', '-').replace('?', '-').replace('#', '-')
+        # there are only so many organizations, but don't grow forever
+        if len(_safe_names) < SAFE_NAMES_SIZE:
+            _safe_names[name] = safe
+        return safe
 
 def raw_name(name):
     ''' Return raw organization name with dashes replaced by spaces.